@@ -0,0 +1,4 @@
+"""``python -m app serve``: see app/server.py."""
+from .server import main
+
+main()
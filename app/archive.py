@@ -0,0 +1,492 @@
+"""
+Archival of old weeks and pruning of stale recurring exceptions.
+
+One-off entries of weeks older than the cutoff are moved, a batch of weeks
+per run, into a separate SQLite file (PLANNER_ARCHIVE_PATH, or one per user
+next to their database in multi-tenant mode). Exceptions dated before the
+archived weeks end move with them. The archive records the date everything
+before it was archived ("archived before"). Reads of earlier dates attach
+the archive read-only to the connection and add its rows, so old weeks still
+render, but every live query only scans the live rows. Archived rows keep
+their ids, the archive's primary key; the live tables use AUTOINCREMENT, so
+an archived id is never handed out again and merged reads never see the same
+id twice.
+
+Archived history stays part of the data everywhere but sync. Stats and
+exports read the archive too. Moved entries are indexed, under the titles
+they have then, in the archive's own search table, which search queries next
+to the live one. A backup copies archived rows back into the snapshot, so it
+holds the whole history. After a restore, archived rows that are live again
+are dropped from the archive. After an import, which replaces all data, the
+archive is emptied.
+
+Exceptions that can no longer apply are deleted on each run: those whose
+task is gone and those outside the task's date range. Exceptions on a date
+the task's pattern no longer produces are kept (and archived with their
+week), since reverting an edit of the pattern makes them apply again.
+
+Usage: python -m app.archive report | run [--after-weeks N]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Iterator
+
+from sqlalchemy import Column, MetaData, Table, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import aliased
+from sqlalchemy.schema import CreateTable
+from sqlmodel import Session, SQLModel, select
+
+from . import db
+from .config import ARCHIVE_AFTER_WEEKS, ARCHIVE_BATCH_WEEKS, ARCHIVE_INTERVAL_SECONDS, ARCHIVE_PATH
+from .models import RecurringException, ScheduleEntry
+
+logger = logging.getLogger("uvicorn.error")
+
+# Archived table and the indexes its archive copy needs
+ARCHIVED_TABLES = {
+    "scheduleentry": "CREATE INDEX IF NOT EXISTS archive_rw.ix_archive_entry_date ON scheduleentry (entry_date)",
+    "recurringexception": (
+        "CREATE INDEX IF NOT EXISTS archive_rw.ix_archive_exception_task "
+        "ON recurringexception (recurring_task_id, exception_date)"
+    ),
+}
+
+_archive_metadata = MetaData()
+ArchivedEntry = aliased(
+    ScheduleEntry, ScheduleEntry.__table__.to_metadata(_archive_metadata, schema="archive"), adapt_on_names=True
+)
+ArchivedException = aliased(
+    RecurringException, RecurringException.__table__.to_metadata(_archive_metadata, schema="archive"), adapt_on_names=True
+)
+
+
+# ─────────────────────────── READING ─────────────────────────────────────────
+
+def archive_path() -> str:
+    """The archive file of the current database."""
+    from .tenants import tenant_path
+
+    tenant = db.current_tenant.get()
+    return tenant_path(tenant, ".archive.db") if tenant else ARCHIVE_PATH
+
+
+def _attach(session: Session) -> bool:
+    """Attach the archive read-only to the session's connection, once per pooled connection."""
+    if db.get_engine().dialect.name != "sqlite":
+        return False
+    path = os.path.abspath(archive_path())
+    conn = session.connection()
+    if conn.connection.info.get("archive_path") == path:
+        return True
+    if not os.path.exists(path):
+        return False
+    conn.exec_driver_sql("ATTACH DATABASE ? AS archive", (f"file:{path}?mode=ro",))
+    conn.connection.info["archive_path"] = path
+    return True
+
+
+def archived_before(session: Session) -> date | None:
+    """Everything dated before this day has been archived; None without an archive."""
+    if not _attach(session):
+        return None
+    try:
+        value = session.connection().exec_driver_sql(
+            "SELECT archived_before FROM archive.archivestate WHERE id = 1"
+        ).scalar()
+    except OperationalError:  # the first archival run is still creating the file
+        return None
+    return date.fromisoformat(value) if value else None
+
+
+def archived_entries(session: Session, start: date, end: date, plan_ids: list[int] | None = None) -> list[ScheduleEntry]:
+    """Archived one-off entries dated between `start` and `end` (inclusive)."""
+    cutoff = archived_before(session)
+    if cutoff is None or start >= cutoff:
+        return []
+    query = select(ArchivedEntry).where(ArchivedEntry.entry_date >= start, ArchivedEntry.entry_date <= end)
+    if plan_ids is not None:
+        query = query.where(ArchivedEntry.plan_id.in_(plan_ids) | (ArchivedEntry.plan_id == None))
+    return session.exec(query).all()
+
+
+def archived_exceptions(session: Session, task_ids: list[int], start: date, end: date) -> list[RecurringException]:
+    cutoff = archived_before(session)
+    if cutoff is None or start >= cutoff or not task_ids:
+        return []
+    return session.exec(select(ArchivedException).where(
+        ArchivedException.recurring_task_id.in_(task_ids),
+        ArchivedException.exception_date >= start,
+        ArchivedException.exception_date <= end,
+    )).all()
+
+
+def archived_entries_by_id(session: Session, ids: list[int]) -> list[ScheduleEntry]:
+    if not ids or archived_before(session) is None:
+        return []
+    return session.exec(select(ArchivedEntry).where(ArchivedEntry.id.in_(ids))).all()
+
+
+def search_archive(session: Session, expression: str, limit: int) -> list[tuple[int, float]]:
+    """(rowid, rank) of the best archived search matches; see search.py."""
+    if archived_before(session) is None:
+        return []
+    try:
+        return session.exec(
+            text("SELECT rowid, rank FROM archive.searchindex WHERE searchindex MATCH :q ORDER BY rank LIMIT :limit"),
+            params={"q": expression, "limit": limit},
+        ).all()
+    except OperationalError:  # archived before entries were indexed; the next run indexes them
+        return []
+
+
+# ─────────────────────────── ARCHIVING ───────────────────────────────────────
+
+@contextmanager
+def _archive_connection() -> Iterator:
+    """A live connection with the archive attached read-write as `archive_rw`."""
+    if db.get_engine().dialect.name != "sqlite":
+        raise ValueError("Archival is only supported for SQLite databases")
+    path = os.path.abspath(archive_path())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with db.get_engine().connect() as conn:
+        conn.exec_driver_sql("ATTACH DATABASE ? AS archive_rw", (path,))
+        conn.commit()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.exec_driver_sql("DETACH DATABASE archive_rw")
+            conn.commit()
+
+
+def _columns(conn, schema: str, table: str) -> list[str]:
+    return [row[1] for row in conn.exec_driver_sql(f"PRAGMA {schema}.table_info({table})").fetchall()]
+
+
+def _archive_table(name: str) -> Table:
+    """The archive copy of a live table: its columns and primary key, without foreign keys."""
+    live = SQLModel.metadata.tables[name]
+    columns = [Column(column.name, column.type, primary_key=column.primary_key) for column in live.columns]
+    return Table(name, MetaData(), *columns, schema="archive_rw")
+
+
+def _ensure_archive_tables(conn) -> None:
+    """Create the archive tables, adding any column the live tables gained since.
+
+    Archives written before the tables had a primary key are rebuilt with one.
+    """
+    for table, index_ddl in ARCHIVED_TABLES.items():
+        info = conn.exec_driver_sql(f"PRAGMA archive_rw.table_info({table})").fetchall()
+        unkeyed = bool(info) and not any(row[5] for row in info)
+        if unkeyed:
+            conn.exec_driver_sql(f"ALTER TABLE archive_rw.{table} RENAME TO {table}_unkeyed")
+        conn.execute(CreateTable(_archive_table(table), if_not_exists=True))
+        archived = set(_columns(conn, "archive_rw", table))
+        for column in _columns(conn, "main", table):
+            if column not in archived:
+                conn.exec_driver_sql(f"ALTER TABLE archive_rw.{table} ADD COLUMN {column}")
+        if unkeyed:
+            _rekey(conn, table)
+        conn.exec_driver_sql(index_ddl)
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS archive_rw.archivestate (id INTEGER PRIMARY KEY CHECK (id = 1), archived_before TEXT NOT NULL)"
+    )
+    if not conn.exec_driver_sql("SELECT 1 FROM archive_rw.sqlite_master WHERE name = 'searchindex'").first():
+        from .search import SEARCH_COLUMNS
+
+        conn.exec_driver_sql(f"CREATE VIRTUAL TABLE archive_rw.searchindex USING fts5({SEARCH_COLUMNS})")
+        _index_entries(conn, "archive_rw", "1")
+
+
+def _index_entries(conn, schema: str, where: str, params: dict | None = None) -> None:
+    """Add entries of `schema`.scheduleentry to the archive's search index, titled as they are now."""
+    from .search import ENTRY_TITLE_SQL
+
+    conn.execute(text(
+        f"INSERT INTO archive_rw.searchindex (rowid, title, note) "
+        f"SELECT id * 2, {ENTRY_TITLE_SQL.format(row='scheduleentry')}, note FROM {schema}.scheduleentry WHERE {where}"
+    ), params or {})
+
+
+def _rekey(conn, table: str) -> None:
+    """Copy an archive table written without a primary key into the keyed one.
+
+    The live table may have handed out ids of such archived rows again; those
+    rows, and repeats within the archive, get fresh ids past every id in use.
+    """
+    old = f"{table}_unkeyed"
+    columns = [c for c in _columns(conn, "archive_rw", old) if c in set(_columns(conn, "archive_rw", table))]
+    live_ids = set(conn.exec_driver_sql(f"SELECT id FROM main.{table}").scalars())
+    next_id = max(
+        conn.exec_driver_sql(f"SELECT MAX(id) FROM main.{table}").scalar() or 0,
+        conn.exec_driver_sql(f"SELECT MAX(id) FROM archive_rw.{old}").scalar() or 0,
+        conn.exec_driver_sql("SELECT seq FROM main.sqlite_sequence WHERE name = ?", (table,)).scalar() or 0,
+    )
+    seen, rows = set(), []
+    for row in conn.exec_driver_sql(f"SELECT {', '.join(columns)} FROM archive_rw.{old} ORDER BY rowid"):
+        values = dict(zip(columns, row))
+        if values["id"] in seen or values["id"] in live_ids:
+            next_id += 1
+            values["id"] = next_id
+        seen.add(values["id"])
+        rows.append(values)
+    if rows:
+        conn.execute(text(
+            f"INSERT INTO archive_rw.{table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})"
+        ), rows)
+    conn.exec_driver_sql(f"DROP TABLE archive_rw.{old}")
+
+
+def _reserve_ids(conn, schema: str) -> None:
+    """Raise the live id sequences past every archived id, so none is handed out again."""
+    for table in ARCHIVED_TABLES:
+        top = conn.exec_driver_sql(f"SELECT MAX(id) FROM {schema}.{table}").scalar()
+        if top is None:
+            continue
+        seq = conn.exec_driver_sql("SELECT seq FROM main.sqlite_sequence WHERE name = ?", (table,)).scalar()
+        if seq is None:
+            conn.exec_driver_sql("INSERT INTO main.sqlite_sequence (name, seq) VALUES (?, ?)", (table, top))
+        elif seq < top:
+            conn.exec_driver_sql("UPDATE main.sqlite_sequence SET seq = ? WHERE name = ?", (top, table))
+
+
+def reserve_archived_ids() -> None:
+    """Keep the live tables from reusing archived ids (at startup, for archives from before AUTOINCREMENT)."""
+    with Session(db.get_engine()) as session:
+        if not _attach(session):
+            return
+        try:
+            _reserve_ids(session.connection(), "archive")
+        except OperationalError:  # the archive has no tables yet
+            return
+        session.commit()
+
+
+def _move(conn, table: str, where: str, params: dict) -> int:
+    columns = ", ".join(_columns(conn, "main", table))
+    conn.execute(text(f"INSERT INTO archive_rw.{table} ({columns}) SELECT {columns} FROM main.{table} WHERE {where}"), params)
+    return conn.execute(text(f"DELETE FROM main.{table} WHERE {where}"), params).rowcount
+
+
+def prune_exceptions(conn) -> int:
+    """Delete live exceptions whose task is gone or that fall outside the task's date range."""
+    return conn.execute(text(
+        "DELETE FROM recurringexception WHERE NOT EXISTS ("
+        " SELECT 1 FROM recurringtask t WHERE t.id = recurringexception.recurring_task_id"
+        " AND recurringexception.exception_date >= t.start_date"
+        " AND (t.end_date IS NULL OR recurringexception.exception_date <= t.end_date))"
+    )).rowcount
+
+
+def archive_old_weeks(cutoff: date, batch_weeks: int = ARCHIVE_BATCH_WEEKS) -> dict:
+    """Move up to `batch_weeks` of the oldest weeks before `cutoff` into the archive.
+
+    Runs in its own transaction; call it again until `remaining_weeks` is 0.
+    """
+    with _archive_connection() as conn:
+        _ensure_archive_tables(conn)
+        _reserve_ids(conn, "archive_rw")
+        old_weeks = [row[0] for row in conn.execute(
+            text("SELECT DISTINCT week_start FROM scheduleentry WHERE week_start < :cutoff ORDER BY week_start"),
+            {"cutoff": cutoff.isoformat()},
+        )]
+        weeks = old_weeks[:batch_weeks]
+        moved_entries = 0
+        if weeks:
+            # Weeks sit in the live table in date order, so everything up to the
+            # end of the last moved week is archived
+            last_week = date.fromisoformat(str(weeks[-1]))
+            boundary = cutoff if len(weeks) == len(old_weeks) else last_week + timedelta(days=7)
+            moved = {"last": last_week.isoformat()}
+            _index_entries(conn, "main", "week_start <= :last", moved)
+            moved_entries = _move(conn, "scheduleentry", "week_start <= :last", moved)
+        else:
+            boundary = cutoff
+
+        previous = conn.exec_driver_sql("SELECT archived_before FROM archive_rw.archivestate WHERE id = 1").scalar()
+        boundary = max(boundary, date.fromisoformat(previous)) if previous else boundary
+        pruned = prune_exceptions(conn)
+        moved_exceptions = _move(conn, "recurringexception", "exception_date < :boundary", {"boundary": boundary.isoformat()})
+        conn.exec_driver_sql(
+            "INSERT INTO archive_rw.archivestate (id, archived_before) VALUES (1, ?) "
+            "ON CONFLICT (id) DO UPDATE SET archived_before = excluded.archived_before",
+            (boundary.isoformat(),),
+        )
+    return {
+        "archived_weeks": len(weeks),
+        "remaining_weeks": len(old_weeks) - len(weeks),
+        "archived_entries": moved_entries,
+        "archived_exceptions": moved_exceptions,
+        "pruned_exceptions": pruned,
+        "archived_before": boundary,
+    }
+
+
+def drop_restored_rows() -> None:
+    """Drop archived rows that are live again, after a restore brought them back."""
+    if not os.path.exists(archive_path()):
+        return
+    with _archive_connection() as conn:
+        _ensure_archive_tables(conn)
+        conn.exec_driver_sql(
+            "DELETE FROM archive_rw.searchindex WHERE rowid IN (SELECT id * 2 FROM main.scheduleentry)"
+        )
+        for table in ARCHIVED_TABLES:
+            conn.exec_driver_sql(f"DELETE FROM archive_rw.{table} WHERE id IN (SELECT id FROM main.{table})")
+
+
+def clear_archive() -> None:
+    """Empty the archive, after an import replaced all data."""
+    if not os.path.exists(archive_path()):
+        return
+    with _archive_connection() as conn:
+        _ensure_archive_tables(conn)
+        for table in (*ARCHIVED_TABLES, "searchindex", "archivestate"):
+            conn.exec_driver_sql(f"DELETE FROM archive_rw.{table}")
+
+
+def merge_into_snapshot(path: str) -> None:
+    """Copy archived rows into the database snapshot at `path`, so it holds the whole history.
+
+    Rows archived while the snapshot was taken are in both; they are copied once.
+    """
+    archive = os.path.abspath(archive_path())
+    if not os.path.exists(archive):
+        return
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("ATTACH DATABASE ? AS archive", (f"file:{archive}?mode=ro",))
+        archived = {row[0] for row in conn.execute("SELECT name FROM archive.sqlite_master WHERE type = 'table'")}
+        for table in ARCHIVED_TABLES:
+            if table not in archived:
+                continue
+            names = {schema: [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")] for schema in ("main", "archive")}
+            columns = ", ".join(c for c in names["main"] if c in names["archive"])
+            conn.execute(f"INSERT OR IGNORE INTO main.{table} ({columns}) SELECT {columns} FROM archive.{table}")
+        conn.commit()
+        conn.execute("DETACH DATABASE archive")
+    finally:
+        conn.close()
+
+
+def cutoff_for(today: date, after_weeks: int) -> date:
+    """Monday of the oldest week kept live."""
+    return today - timedelta(days=today.weekday(), weeks=after_weeks)
+
+
+# ─────────────────────────── REPORTING ───────────────────────────────────────
+
+def _median_ms(run, rounds: int = 5) -> float:
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(timings), 2)
+
+
+def storage_report() -> dict:
+    """Row counts and on-disk bytes of the archived tables, live and archived, plus query latency."""
+    report = {"tables": {}, "latency_ms": {}}
+    with Session(db.get_engine()) as session:
+        conn = session.connection()
+        schemas = {"main": set(ARCHIVED_TABLES)}
+        if _attach(session):
+            schemas["archive"] = {
+                row[0] for row in conn.exec_driver_sql("SELECT name FROM archive.sqlite_master WHERE type = 'table'")
+            }
+        for schema, tables in schemas.items():
+            for table in ARCHIVED_TABLES:
+                if table not in tables:
+                    continue
+                rows = conn.exec_driver_sql(f"SELECT COUNT(*) FROM {schema}.{table}").scalar()
+                try:
+                    size = conn.exec_driver_sql(
+                        f"SELECT COALESCE(SUM(pgsize), 0) FROM dbstat('{schema}') WHERE name = ?", (table,)
+                    ).scalar()
+                except OperationalError:  # dbstat is an optional SQLite module
+                    size = None
+                report["tables"][f"{schema}.{table}"] = {"rows": rows, "bytes": size}
+
+        today = date.today()
+        week = today - timedelta(days=today.weekday())
+        report["latency_ms"]["current_week_entries"] = _median_ms(lambda: session.exec(
+            select(ScheduleEntry).where(ScheduleEntry.entry_date >= week, ScheduleEntry.entry_date <= week + timedelta(days=6))
+        ).all())
+        report["latency_ms"]["current_week_exceptions"] = _median_ms(lambda: session.exec(
+            select(RecurringException).where(
+                RecurringException.exception_date >= week, RecurringException.exception_date <= week + timedelta(days=6)
+            )
+        ).all())
+        report["latency_ms"]["entry_count"] = _median_ms(
+            lambda: conn.exec_driver_sql("SELECT COUNT(*), SUM(duration_minutes) FROM scheduleentry").one()
+        )
+    return report
+
+
+def run_archival(today: date | None = None, after_weeks: int = ARCHIVE_AFTER_WEEKS) -> list[dict]:
+    """Archive in batches until every week before the cutoff is moved; one result per batch."""
+    cutoff = cutoff_for(today or date.today(), after_weeks)
+    results = [archive_old_weeks(cutoff)]
+    while results[-1]["remaining_weeks"]:
+        results.append(archive_old_weeks(cutoff))
+    return results
+
+
+async def archive_periodically() -> None:
+    """Background loop that archives one batch of old weeks per interval, in every open database."""
+    from . import tenants
+
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+        try:
+            await asyncio.to_thread(tenants.run_everywhere, archive_old_weeks, cutoff_for(date.today(), ARCHIVE_AFTER_WEEKS))
+        except Exception:  # noqa: BLE001 - e.g. "database is locked"; the next run catches up
+            logger.exception("Scheduled archival failed")
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.archive", description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("report", help="show table sizes and query latency")
+    run = commands.add_parser("run", help="archive all weeks before the cutoff and report before/after")
+    run.add_argument("--after-weeks", type=int, default=ARCHIVE_AFTER_WEEKS or 104)
+    args = parser.parse_args(argv)
+
+    db.init_db()
+    if args.command == "report":
+        _print_report(storage_report())
+        return
+    before = storage_report()
+    for result in run_archival(after_weeks=args.after_weeks):
+        print(
+            f"Archived {result['archived_weeks']} week(s), {result['archived_entries']} entries, "
+            f"{result['archived_exceptions']} exceptions; pruned {result['pruned_exceptions']} exceptions"
+        )
+    print("Before:")
+    _print_report(before)
+    print("After:")
+    _print_report(storage_report())
+
+
+def _print_report(report: dict) -> None:
+    for name, stats in report["tables"].items():
+        size = f"{stats['bytes'] / 1024:.0f} KiB" if stats["bytes"] is not None else "n/a"
+        print(f"  {name:32} {stats['rows']:>10} rows {size:>12}")
+    for name, ms in report["latency_ms"].items():
+        print(f"  {name:32} {ms:>10} ms")
+
+
+if __name__ == "__main__":
+    main()
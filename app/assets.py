@@ -0,0 +1,144 @@
+"""
+Static asset delivery: fingerprinted URLs, precompressed variants and
+response compression.
+
+Templates link assets through ``asset_url()``, which appends a content hash.
+Requests carrying the current hash are cacheable forever; anything else is
+revalidated. ``.gz`` (and ``.br`` when the optional ``brotli`` package is
+installed) variants are written next to each asset at startup or with
+``python -m app.assets``, and served when the client accepts them.
+"""
+import gzip
+import hashlib
+import os
+from pathlib import Path
+from urllib.parse import parse_qsl
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import FileResponse
+from starlette.staticfiles import StaticFiles
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional
+    brotli = None
+
+STATIC_DIR = Path(__file__).parent / "static"
+STATIC_URL = "/static"
+COMPRESSIBLE_SUFFIXES = {".css", ".js", ".svg", ".html", ".json", ".txt"}
+# Preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Responses that are compressed already (backups, export and job downloads)
+PRECOMPRESSED_TYPES = {"application/gzip", "application/x-gzip", "application/zip"}
+
+_fingerprints: dict[str, tuple[int, str]] = {}
+
+
+def fingerprint(path: str, directory: Path = STATIC_DIR) -> str:
+    """Short content hash of a static file, recomputed only when it changes."""
+    full = directory / path
+    mtime = full.stat().st_mtime_ns
+    cached = _fingerprints.get(str(full))
+    if cached and cached[0] == mtime:
+        return cached[1]
+    digest = hashlib.sha256(full.read_bytes()).hexdigest()[:12]
+    _fingerprints[str(full)] = (mtime, digest)
+    return digest
+
+
+def asset_url(path: str) -> str:
+    """URL of a static asset with its fingerprint, for use in templates."""
+    return f"{STATIC_URL}/{path}?v={fingerprint(path)}"
+
+
+def precompress_static(directory: Path = STATIC_DIR) -> int:
+    """Write compressed variants of text assets that are missing or stale. Returns how many were written."""
+    written = 0
+    for source in directory.rglob("*"):
+        if not source.is_file() or source.suffix not in COMPRESSIBLE_SUFFIXES:
+            continue
+        data = None
+        for encoding, suffix in ENCODINGS:
+            if encoding == "br" and brotli is None:
+                continue
+            target = source.with_name(source.name + suffix)
+            if target.exists() and target.stat().st_mtime_ns >= source.stat().st_mtime_ns:
+                continue
+            if data is None:
+                data = source.read_bytes()
+            compressed = brotli.compress(data) if encoding == "br" else gzip.compress(data, compresslevel=9, mtime=0)
+            target.write_bytes(compressed)
+            written += 1
+    return written
+
+
+class CompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves precompressed variants and long-lived cache headers."""
+
+    async def get_response(self, path: str, scope: Scope):
+        response = await super().get_response(path, scope)
+        request_headers = Headers(scope=scope)
+
+        if isinstance(response, FileResponse) and response.status_code == 200:
+            accepted = {part.split(";")[0].strip() for part in request_headers.get("accept-encoding", "").split(",")}
+            for encoding, suffix in ENCODINGS:
+                variant = str(response.path) + suffix
+                if encoding in accepted and os.path.isfile(variant):
+                    response = FileResponse(
+                        variant,
+                        stat_result=os.stat(variant),
+                        media_type=response.media_type,
+                        headers={"Content-Encoding": encoding},
+                    )
+                    break
+            response.headers["Vary"] = "Accept-Encoding"
+
+        version = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1"))).get("v")
+        try:
+            current = version and version == fingerprint(path, Path(self.directory))
+        except OSError:
+            current = False
+        response.headers["Cache-Control"] = IMMUTABLE if current else "no-cache"
+        return response
+
+
+class CompressionMiddleware:
+    """Gzip dynamic responses, leaving event streams, static files and archives alone.
+
+    Static files already carry precompressed variants, and compressing an
+    event stream would hold events back until the compressor flushes.
+    Responses of a PRECOMPRESSED_TYPES media type bypass the compressor.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, compresslevel: int = 6, exclude: tuple[str, ...] = ()) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+        self.exclude = exclude
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude):
+            await self.app(scope, receive, send)
+            return
+
+        async def app(scope: Scope, receive: Receive, compressing_send: Send) -> None:
+            target = compressing_send
+
+            async def route(message) -> None:
+                nonlocal target
+                if message["type"] == "http.response.start":
+                    media_type = Headers(raw=message["headers"]).get("content-type", "").split(";")[0].strip()
+                    if media_type in PRECOMPRESSED_TYPES:
+                        target = send
+                await target(message)
+
+            await self.app(scope, receive, route)
+
+        await GZipMiddleware(app, minimum_size=self.minimum_size, compresslevel=self.compresslevel)(scope, receive, send)
+
+
+if __name__ == "__main__":
+    print(f"Wrote {precompress_static()} compressed asset(s)")
@@ -0,0 +1,159 @@
+"""
+Consistent SQLite snapshots and restores.
+
+A backup copies the live database page by page with SQLite's online backup
+API. It copies BACKUP_PAGES pages per step and sleeps briefly between
+steps, so writers only wait for one step at a time. If another connection
+writes mid-copy, SQLite restarts the copy, so the result is always a
+snapshot of a single moment across all tables. Archived rows are then
+copied into the snapshot, so it holds the whole history in one file (see
+archive.py). Snapshots can be streamed gzip-compressed. A restore checks a
+snapshot (plain or gzipped) and copies it back over the live database the
+same way; archived rows it brought back are dropped from the archive, and
+the change log gets a reset above every revision the live database had
+handed out, so sync clients and ETags never see a revision number twice.
+
+Usage: python -m app.backup create <file>[.gz] | restore <file>
+"""
+import argparse
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import zlib
+from contextlib import contextmanager
+from typing import Iterator
+
+from sqlmodel import Session
+
+from . import db
+from .archive import drop_restored_rows, merge_into_snapshot
+from .sync import highest_revision, mark_reset
+
+BACKUP_PAGES = 256  # pages copied per step
+BACKUP_SLEEP_SECONDS = 0.005  # pause between steps, letting writers in
+CHUNK_BYTES = 1024 * 1024
+SQLITE_HEADER = b"SQLite format 3\x00"
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+@contextmanager
+def _live_connection() -> Iterator[sqlite3.Connection]:
+    """The sqlite3 connection behind a pooled engine connection."""
+    if db.get_engine().dialect.name != "sqlite":
+        raise ValueError("Backups are only supported for SQLite databases")
+    raw = db.get_engine().raw_connection()
+    try:
+        yield raw.driver_connection
+    finally:
+        raw.close()
+
+
+def create_backup(path: str) -> None:
+    """Write a consistent snapshot of the live database, plus the archived rows, to `path`."""
+    with _live_connection() as source:
+        target = sqlite3.connect(path)
+        try:
+            source.backup(target, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP_SECONDS)
+        finally:
+            target.close()
+    merge_into_snapshot(path)
+
+
+def _temp_path(suffix: str) -> str:
+    handle, path = tempfile.mkstemp(prefix="planner-backup-", suffix=suffix)
+    os.close(handle)
+    return path
+
+
+def backup_stream(compress: bool = True) -> Iterator[bytes]:
+    """Snapshot to a temporary file, then yield it in chunks, gzip-compressed if asked."""
+    path = _temp_path(".db")
+    try:
+        create_backup(path)
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31: gzip container
+        with open(path, "rb") as snapshot:
+            while chunk := snapshot.read(CHUNK_BYTES):
+                chunk = compressor.compress(chunk) if compressor else chunk
+                if chunk:
+                    yield chunk
+        if compressor:
+            yield compressor.flush()
+    finally:
+        os.remove(path)
+
+
+def _check_snapshot(path: str) -> None:
+    with open(path, "rb") as f:
+        if f.read(len(SQLITE_HEADER)) != SQLITE_HEADER:
+            raise ValueError("Not a SQLite database")
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = conn.execute("PRAGMA quick_check").fetchone()[0]
+        if result != "ok":
+            raise ValueError(f"Backup is damaged: {result}")
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'scheduleentry'").fetchone():
+            raise ValueError("Not a planner backup")
+    finally:
+        conn.close()
+
+
+def restore_backup(path: str) -> None:
+    """Replace the live database with the snapshot at `path` (plain or gzipped).
+
+    The snapshot is checked before anything is overwritten, and migrated to
+    the current schema afterwards.
+    """
+    with open(path, "rb") as f:
+        gzipped = f.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+    source_path = path
+    if gzipped:
+        source_path = _temp_path(".db")
+        try:
+            with gzip.open(path, "rb") as src, open(source_path, "wb") as out:
+                shutil.copyfileobj(src, out, CHUNK_BYTES)
+        except (OSError, EOFError) as exc:
+            os.remove(source_path)
+            raise ValueError("Invalid gzip file") from exc
+    try:
+        _check_snapshot(source_path)
+        with Session(db.get_engine()) as session:
+            handed_out = highest_revision(session)
+        source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+        try:
+            with _live_connection() as target:
+                source.backup(target, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP_SECONDS)
+        finally:
+            source.close()
+        db.init_db()
+        with Session(db.get_engine()) as session:
+            mark_reset(session, handed_out)
+            session.commit()
+        drop_restored_rows()
+    finally:
+        if gzipped:
+            os.remove(source_path)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.backup", description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="write a snapshot; a .gz name compresses it")
+    create.add_argument("path")
+    restore = commands.add_parser("restore", help="replace the database with a snapshot")
+    restore.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.command == "create":
+        with open(args.path, "wb") as out:
+            for chunk in backup_stream(compress=args.path.endswith(".gz")):
+                out.write(chunk)
+        print(f"Wrote {args.path}")
+    else:
+        restore_backup(args.path)
+        print(f"Restored {args.path}")
+
+
+if __name__ == "__main__":
+    main()
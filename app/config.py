@@ -22,6 +22,12 @@ def _parse_int_list(val: str | None, default: List[int]) -> List[int]:
     except ValueError:
         return default
 
+def _parse_bool(val: str | None, default: bool) -> bool:
+    """Parse a boolean flag such as 1/0, true/false, yes/no."""
+    if not val:
+        return default
+    return val.strip().lower() in ("1", "true", "yes", "on")
+
 def _parse_time(val: str | None, default: int) -> int:
     """Parse time in HH:MM format to minutes from midnight."""
     if not val:
@@ -35,6 +41,8 @@ def _parse_time(val: str | None, default: int) -> int:
         return default
 
 
+DAY_ORDER = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
 # Day boundaries (in minutes from midnight)
 DAY_START_MINUTE = _parse_time(os.getenv("PLANNER_DAY_START"), 7 * 60)  # Default 07:00
 DAY_END_MINUTE = _parse_time(os.getenv("PLANNER_DAY_END"), 22 * 60 + 30)  # Default 22:30
@@ -43,6 +51,12 @@ DAY_END_MINUTE = _parse_time(os.getenv("PLANNER_DAY_END"), 22 * 60 + 30)  # Defa
 PRODUCTION_END = _parse_time(os.getenv("PLANNER_PRODUCTION_END"), 15 * 60)  # Default 15:00
 ACTIVITY_END = _parse_time(os.getenv("PLANNER_ACTIVITY_END"), 20 * 60)  # Default 20:00
 
+PERIODS = [
+    {"name": "Production", "start": DAY_START_MINUTE, "end": PRODUCTION_END, "class": "prod"},
+    {"name": "Activity", "start": PRODUCTION_END, "end": ACTIVITY_END, "class": "act"},
+    {"name": "Night", "start": ACTIVITY_END, "end": DAY_END_MINUTE, "class": "night"},
+]
+
 # Slot configuration
 SLOT_MINUTES = _parse_int(os.getenv("PLANNER_SLOT_MINUTES"), 15)
 SLOT_HEIGHT_PX = _parse_int(os.getenv("PLANNER_SLOT_HEIGHT_PX"), 12)
@@ -62,3 +76,93 @@ PLAN_COLORS = [
     "#f59e0b",  # Amber
     "#14b8a6",  # Teal
 ]
+
+# Materialized recurring instances (optional)
+MATERIALIZE_RECURRING = _parse_bool(os.getenv("PLANNER_MATERIALIZE_RECURRING"), False)
+RECURRING_HORIZON_WEEKS_BACK = _parse_int(os.getenv("PLANNER_RECURRING_HORIZON_WEEKS_BACK"), 12)
+RECURRING_HORIZON_WEEKS_FORWARD = _parse_int(os.getenv("PLANNER_RECURRING_HORIZON_WEEKS_FORWARD"), 52)
+RECURRING_REFRESH_SECONDS = _parse_int(os.getenv("PLANNER_RECURRING_REFRESH_SECONDS"), 3600)
+
+# Live updates: "memory" delivers change events within one process, "sqlite"
+# shares them between workers through a notification table in the database.
+EVENTS_BACKEND = os.getenv("PLANNER_EVENTS_BACKEND", "memory").strip().lower()
+EVENTS_POLL_SECONDS = _parse_int(os.getenv("PLANNER_EVENTS_POLL_MS"), 500) / 1000
+EVENTS_KEEPALIVE_SECONDS = _parse_int(os.getenv("PLANNER_EVENTS_KEEPALIVE_SECONDS"), 15)
+
+# Longest date range served by /api/range
+API_MAX_RANGE_DAYS = _parse_int(os.getenv("PLANNER_API_MAX_RANGE_DAYS"), 366)
+
+# Templates: "production" turns off per-render mtime checks and keeps compiled
+# templates in a bytecode cache shared by all workers (PLANNER_TEMPLATE_CACHE_DIR,
+# defaults to a per-user directory under the system temp dir).
+TEMPLATE_MODE = os.getenv("PLANNER_TEMPLATE_MODE", "development").strip().lower()
+TEMPLATE_CACHE_DIR = os.getenv("PLANNER_TEMPLATE_CACHE_DIR") or None
+
+# Background jobs (imports and exports): worker threads, where uploads and
+# result archives are kept, and how long finished job files are kept.
+JOBS_WORKERS = _parse_int(os.getenv("PLANNER_JOBS_WORKERS"), 1)
+JOBS_DIR = os.getenv("PLANNER_JOBS_DIR", os.path.join("data", "jobs"))
+JOBS_RETENTION_HOURS = _parse_int(os.getenv("PLANNER_JOBS_RETENTION_HOURS"), 24)
+
+# Idempotency keys: how long recorded mutation responses are kept for retries,
+# after how long a request that never finished may be taken over by a retry,
+# and the largest response body stored for a replay (larger ones are replayed
+# without a body, and the client reloads the week instead).
+IDEMPOTENCY_RETENTION_HOURS = _parse_int(os.getenv("PLANNER_IDEMPOTENCY_RETENTION_HOURS"), 48)
+IDEMPOTENCY_LOCK_SECONDS = _parse_int(os.getenv("PLANNER_IDEMPOTENCY_LOCK_SECONDS"), 120)
+IDEMPOTENCY_MAX_BODY_BYTES = _parse_int(os.getenv("PLANNER_IDEMPOTENCY_MAX_BODY_BYTES"), 16384)
+
+# Profiling (see app/profiling.py): PLANNER_PROFILE_TOKEN turns on on-demand
+# profiling for requests that carry it; PLANNER_PROFILE_SAMPLE_EVERY=N profiles
+# one request in N (0 = off). Reports go to PLANNER_PROFILE_DIR.
+PROFILE_TOKEN = os.getenv("PLANNER_PROFILE_TOKEN") or None
+PROFILE_SAMPLE_EVERY = _parse_int(os.getenv("PLANNER_PROFILE_SAMPLE_EVERY"), 0)
+PROFILE_INTERVAL_MS = _parse_int(os.getenv("PLANNER_PROFILE_INTERVAL_MS"), 1)
+PROFILE_DIR = os.getenv("PLANNER_PROFILE_DIR", os.path.join("data", "profiles"))
+PROFILE_KEEP = _parse_int(os.getenv("PLANNER_PROFILE_KEEP"), 50)
+
+# Memory diagnostics (see app/diagnostics.py): /diagnostics/memory answers
+# requests carrying PLANNER_DIAGNOSTICS_TOKEN; unset turns it off.
+# PLANNER_TRACEMALLOC_FRAMES > 0 traces allocations from startup.
+DIAGNOSTICS_TOKEN = os.getenv("PLANNER_DIAGNOSTICS_TOKEN") or None
+TRACEMALLOC_FRAMES = _parse_int(os.getenv("PLANNER_TRACEMALLOC_FRAMES"), 0)
+
+# Server (`python -m app serve`, see app/server.py). PLANNER_WORKERS=0 starts
+# one worker per available CPU, at most PLANNER_MAX_WORKERS, since SQLite lets
+# one process write at a time. The keep-alive outlasts the 60 s idle timeout
+# of common reverse proxies, so the proxy closes idle connections first and
+# never reuses one the server is closing. PLANNER_MAX_REQUESTS > 0 restarts a
+# worker after that many requests. "auto" picks uvloop and httptools when
+# they are installed.
+SERVER_HOST = os.getenv("PLANNER_HOST", "127.0.0.1")
+SERVER_PORT = _parse_int(os.getenv("PLANNER_PORT"), 8000)
+SERVER_WORKERS = _parse_int(os.getenv("PLANNER_WORKERS"), 0)
+SERVER_MAX_WORKERS = _parse_int(os.getenv("PLANNER_MAX_WORKERS"), 8)
+SERVER_LOOP = os.getenv("PLANNER_LOOP", "auto").strip().lower()
+SERVER_HTTP = os.getenv("PLANNER_HTTP", "auto").strip().lower()
+SERVER_BACKLOG = _parse_int(os.getenv("PLANNER_BACKLOG"), 2048)
+SERVER_KEEPALIVE_SECONDS = _parse_int(os.getenv("PLANNER_KEEPALIVE_SECONDS"), 65)
+SERVER_GRACEFUL_TIMEOUT = _parse_int(os.getenv("PLANNER_GRACEFUL_TIMEOUT"), 30)
+SERVER_MAX_REQUESTS = _parse_int(os.getenv("PLANNER_MAX_REQUESTS"), 0)
+SERVER_ACCESS_LOG = _parse_bool(os.getenv("PLANNER_ACCESS_LOG"), True)
+
+# Multi-tenant mode (see app/tenants.py): "off" serves the one database at
+# DATABASE_URL; "header" takes the user from PLANNER_TENANT_HEADER, set by an
+# authenticating reverse proxy; "basic" checks HTTP Basic credentials against
+# PLANNER_TENANT_USERS_FILE. Each user gets PLANNER_TENANT_DIR/<user>.db. A
+# worker keeps at most PLANNER_TENANT_CACHE_SIZE databases open and closes those
+# idle for PLANNER_TENANT_IDLE_SECONDS.
+TENANT_MODE = os.getenv("PLANNER_TENANT_MODE", "off").strip().lower()
+TENANT_HEADER = os.getenv("PLANNER_TENANT_HEADER", "X-Forwarded-User")
+TENANT_USERS_FILE = os.getenv("PLANNER_TENANT_USERS_FILE", os.path.join("data", "users.txt"))
+TENANT_DIR = os.getenv("PLANNER_TENANT_DIR", os.path.join("data", "tenants"))
+TENANT_CACHE_SIZE = _parse_int(os.getenv("PLANNER_TENANT_CACHE_SIZE"), 64)
+TENANT_IDLE_SECONDS = _parse_int(os.getenv("PLANNER_TENANT_IDLE_SECONDS"), 600)
+
+# Archival: one-off entries of weeks older than PLANNER_ARCHIVE_AFTER_WEEKS
+# (0 turns scheduled archival off) are moved into a separate SQLite file,
+# at most PLANNER_ARCHIVE_BATCH_WEEKS weeks per run.
+ARCHIVE_PATH = os.getenv("PLANNER_ARCHIVE_PATH", os.path.join("data", "archive.db"))
+ARCHIVE_AFTER_WEEKS = _parse_int(os.getenv("PLANNER_ARCHIVE_AFTER_WEEKS"), 0)
+ARCHIVE_BATCH_WEEKS = _parse_int(os.getenv("PLANNER_ARCHIVE_BATCH_WEEKS"), 26)
+ARCHIVE_INTERVAL_SECONDS = _parse_int(os.getenv("PLANNER_ARCHIVE_INTERVAL_SECONDS"), 86400)
@@ -0,0 +1,44 @@
+"""
+Absolute date encoding for schedule entries.
+
+The UI addresses an entry by its week_start plus a day name. entry_date and
+start_at (minutes since 1970-01-01) give every entry an absolute, indexable
+position so cross-week range queries, sorting and aggregation stay in SQL.
+"""
+from datetime import date, timedelta
+
+from sqlalchemy import Date, case, literal
+
+from .config import DAY_ORDER
+
+EPOCH = date(1970, 1, 1)
+DAY_INDEX = {name: i for i, name in enumerate(DAY_ORDER)}
+
+
+def entry_date_for(week_start: date | None, day: str | None) -> date | None:
+    """The calendar date of `day` in the week starting `week_start`."""
+    index = DAY_INDEX.get(day)
+    if week_start is None or index is None:
+        return None
+    return week_start + timedelta(days=index)
+
+
+def epoch_minutes(d: date, minute: int) -> int:
+    """Absolute position of `minute` on `d`, in minutes since the epoch."""
+    return (d - EPOCH).days * 24 * 60 + minute
+
+
+def entry_date_sql(day_column, week_start: date):
+    """SQL expression mapping a day-name column to its date in `week_start`."""
+    return case(
+        {day: literal(week_start + timedelta(days=i), Date) for day, i in DAY_INDEX.items()},
+        value=day_column,
+    )
+
+
+def start_at_sql(day_column, minute_column, week_start: date):
+    """SQL expression for start_at of rows positioned by day name and minute in `week_start`."""
+    return case(
+        {day: literal(epoch_minutes(week_start + timedelta(days=i), 0)) for day, i in DAY_INDEX.items()},
+        value=day_column,
+    ) + minute_column
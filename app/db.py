@@ -1,22 +1,57 @@
 import os
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
 from typing import Iterator
 
-from sqlalchemy import text
+from sqlalchemy import Engine, text
+from sqlalchemy.pool import StaticPool
 from sqlmodel import SQLModel, Session, create_engine, select
 
 DB_PATH = Path("data") / "planner.db"
 DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DB_PATH}")
 
-connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
-engine = create_engine(DATABASE_URL, connect_args=connect_args)
+
+def make_engine(url: str) -> Engine:
+    connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+    # An in-memory SQLite database only lives as long as its connection, so share one.
+    engine_kwargs = {"poolclass": StaticPool} if url.endswith(":memory:") else {}
+    return create_engine(url, connect_args=connect_args, **engine_kwargs)
+
+
+engine = make_engine(DATABASE_URL)
+
+# In multi-tenant mode (see tenants.py) each request runs against its user's database
+current_engine: ContextVar[Engine | None] = ContextVar("planner_engine", default=None)
+current_tenant: ContextVar[str | None] = ContextVar("planner_tenant", default=None)
+
+
+def get_engine() -> Engine:
+    """The engine of the current tenant, or the shared database outside multi-tenant mode."""
+    return current_engine.get() or engine
+
+
+@contextmanager
+def use_engine(bind: Engine, tenant: str | None = None) -> Iterator[Engine]:
+    """Run the enclosed code, and tasks and threads started from it, against `bind`."""
+    engine_token = current_engine.set(bind)
+    tenant_token = current_tenant.set(tenant)
+    try:
+        yield bind
+    finally:
+        current_tenant.reset(tenant_token)
+        current_engine.reset(engine_token)
 
 
 def init_db() -> None:
-    from .models import BlockType, ScheduleEntry, RecurringTask, RecurringException, Plan  # noqa: F401
+    from .models import (  # noqa: F401
+        BlockType, ScheduleEntry, RecurringTask, RecurringException, Plan,
+        WeekTemplate, WeekTemplateEntry, RecurringInstance, RecurringHorizon, ChangeNotification,
+        ChangeLog, Job, IdempotencyKey,
+    )
 
-    SQLModel.metadata.create_all(engine)
+    SQLModel.metadata.create_all(get_engine())
     apply_schema_patches()
 
 
@@ -24,7 +59,7 @@ def seed_defaults() -> None:
     """Create a minimal default palette if none exists and ensure quick task template."""
     from .models import BlockType, Plan
 
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         existing = session.query(BlockType).count()
         if not existing:
             defaults = [
@@ -47,7 +82,7 @@ def seed_defaults() -> None:
 
 
 def get_session() -> Iterator[Session]:
-    session = Session(engine)
+    session = Session(get_engine())
     try:
         yield session
     finally:
@@ -58,14 +93,14 @@ def apply_schema_patches() -> None:
     """Apply simple additive schema changes when running without migrations."""
 
     def column_exists(table: str, column: str) -> bool:
-        with engine.connect() as conn:
+        with get_engine().connect() as conn:
             rows = conn.execute(text(f"PRAGMA table_info({table})")).fetchall()
         return any(row[1] == column for row in rows)
 
     def ensure_column(table: str, column: str, ddl: str) -> None:
         if column_exists(table, column):
             return
-        with engine.connect() as conn:
+        with get_engine().connect() as conn:
             conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
 
     ensure_column("blocktype", "is_quick_template", "INTEGER NOT NULL DEFAULT 0")
@@ -73,6 +108,96 @@ def apply_schema_patches() -> None:
     ensure_column("scheduleentry", "is_quick", "INTEGER NOT NULL DEFAULT 0")
     ensure_column("scheduleentry", "plan_id", "INTEGER REFERENCES plan(id)")
     ensure_column("recurringtask", "plan_id", "INTEGER REFERENCES plan(id)")
+    ensure_column("scheduleentry", "entry_date", "DATE")
+    ensure_column("scheduleentry", "start_at", "INTEGER")
+    ensure_autoincrement("scheduleentry")
+    ensure_autoincrement("recurringexception")
+    reserve_archived_ids()
+    backfill_entry_dates()
+    install_change_log_triggers()
+    install_full_text_search()
+
+
+def ensure_autoincrement(table_name: str) -> None:
+    """Rebuild a table created without AUTOINCREMENT, so ids of deleted rows are never reused.
+
+    Triggers that name the table are dropped with it; the patches that follow
+    install them again.
+    """
+    if get_engine().dialect.name != "sqlite":
+        return
+    table = SQLModel.metadata.tables[table_name]
+    with get_engine().begin() as conn:
+        ddl = conn.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table_name}
+        ).scalar()
+        if ddl is None or "AUTOINCREMENT" in ddl.upper():
+            return
+        triggers = conn.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'trigger' AND sql LIKE :pattern"),
+            {"pattern": f"%{table_name}%"},
+        ).scalars().all()
+        indexes = conn.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :name AND sql IS NOT NULL"),
+            {"name": table_name},
+        ).scalars().all()
+        for name in triggers:
+            conn.execute(text(f"DROP TRIGGER {name}"))
+        for name in indexes:
+            conn.execute(text(f"DROP INDEX {name}"))
+        conn.execute(text(f"ALTER TABLE {table_name} RENAME TO {table_name}_rebuild"))
+        table.create(conn)
+        existing = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table_name}_rebuild)"))}
+        columns = ", ".join(c.name for c in table.columns if c.name in existing)
+        conn.execute(text(f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {table_name}_rebuild"))
+        conn.execute(text(f"DROP TABLE {table_name}_rebuild"))
+
+
+def reserve_archived_ids() -> None:
+    """Keep ids of archived rows out of the live tables (see archive.py)."""
+    from .archive import reserve_archived_ids
+
+    reserve_archived_ids()
+
+
+def backfill_entry_dates() -> None:
+    """Derive entry_date/start_at for rows written before those columns existed."""
+    from .dates import DAY_INDEX
+
+    day_offset = " ".join(f"WHEN '{day}' THEN {i}" for day, i in DAY_INDEX.items())
+    with get_engine().begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_scheduleentry_entry_date ON scheduleentry (entry_date)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_scheduleentry_start_at ON scheduleentry (start_at)"))
+        conn.execute(text(
+            f"UPDATE scheduleentry SET entry_date = date(week_start, '+' || (CASE day {day_offset} END) || ' days') "
+            f"WHERE entry_date IS NULL AND day IN ({', '.join(repr(d) for d in DAY_INDEX)})"
+        ))
+        conn.execute(text(
+            "UPDATE scheduleentry SET start_at = CAST(ROUND((julianday(entry_date) - julianday('1970-01-01')) * 1440) AS INTEGER) + start_minute "
+            "WHERE start_at IS NULL AND entry_date IS NOT NULL"
+        ))
+
+
+def install_change_log_triggers() -> None:
+    """Record every write to a synced table in the changelog, including bulk SQL."""
+    from .sync import SYNCED_TABLES
+
+    with get_engine().begin() as conn:
+        for table in SYNCED_TABLES:
+            for op, when, row in (("insert", "INSERT", "NEW"), ("update", "UPDATE", "NEW"), ("delete", "DELETE", "OLD")):
+                conn.execute(text(
+                    f"CREATE TRIGGER IF NOT EXISTS changelog_{table}_{op} AFTER {when} ON {table} "
+                    f"BEGIN INSERT INTO changelog (table_name, row_id, op, changed_at) "
+                    f"VALUES ('{table}', {row}.id, '{op}', strftime('%Y-%m-%d %H:%M:%S', 'now')); END"
+                ))
+
+
+def install_full_text_search() -> None:
+    """Create the FTS5 search index over titles and notes (see search.py)."""
+    from .search import install_search_index
+
+    with get_engine().begin() as conn:
+        install_search_index(conn)
 
 
 def ensure_quick_block(session: Session):
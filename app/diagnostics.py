@@ -0,0 +1,198 @@
+"""
+Memory diagnostics for long-running workers.
+
+Off unless PLANNER_DIAGNOSTICS_TOKEN is set; ``/diagnostics/memory`` then
+answers requests that carry the token (``X-Diagnostics-Token`` header or
+``?token=``). A report has:
+
+* process: current and peak RSS, from /proc or getrusage;
+* tracemalloc: traced and peak bytes, the top allocation sites, and the
+  change at each site since the previous report. Tracing costs CPU and
+  memory, so it only runs from startup with PLANNER_TRACEMALLOC_FRAMES > 0,
+  or after ``POST /diagnostics/memory/tracing``;
+* sqlalchemy: open sessions, their identity-map sizes per model, the pool and
+  the open tenant databases in multi-tenant mode;
+* caches: entries and an estimate of the bytes held by each in-process cache;
+* objects: the most common live object types, as the garbage collector sees them.
+
+Byte estimates follow built-in containers and the attributes of plain
+objects, but never modules, classes or functions, so shared objects are
+counted at most once per cache and the numbers are lower bounds.
+"""
+import asyncio
+import gc
+import hmac
+import os
+import sys
+import threading
+import tracemalloc
+import types
+from collections import Counter, deque
+from typing import Any
+
+from fastapi import HTTPException, Request
+from jinja2 import Environment
+from sqlalchemy.orm.session import _sessions  # weak registry of live sessions
+
+from . import assets, db, jobs, profiling, tenants
+from .config import DIAGNOSTICS_TOKEN, TRACEMALLOC_FRAMES
+from .events import broker
+
+TOKEN_HEADER = "x-diagnostics-token"
+TOKEN_PARAM = "token"
+GROUPINGS = ("lineno", "filename", "traceback")
+# Shared infrastructure a cache points at but does not own
+_SKIPPED_TYPES = (
+    types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType, type,
+    asyncio.AbstractEventLoop, Environment,
+)
+_TRACE_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+)
+
+_previous_snapshot: tracemalloc.Snapshot | None = None
+_snapshot_lock = threading.Lock()
+
+
+def require_diagnostics_token(request: Request) -> None:
+    if not DIAGNOSTICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Diagnostics are disabled")
+    supplied = request.headers.get(TOKEN_HEADER) or request.query_params.get(TOKEN_PARAM) or ""
+    if not hmac.compare_digest(supplied.encode(), DIAGNOSTICS_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid diagnostics token")
+
+
+def start_tracing(frames: int = TRACEMALLOC_FRAMES) -> bool:
+    """Start tracemalloc with `frames` frames per allocation. Returns whether tracing is on."""
+    if frames > 0 and not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    return tracemalloc.is_tracing()
+
+
+def stop_tracing() -> None:
+    global _previous_snapshot
+    with _snapshot_lock:
+        _previous_snapshot = None
+    tracemalloc.stop()
+
+
+def deep_sizeof(obj: Any, seen: set[int] | None = None) -> int:
+    """Estimated bytes held by `obj` and what it references, counting each object once."""
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, _SKIPPED_TYPES):
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current, 0)
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset, deque)):
+            stack.extend(current)
+        elif hasattr(current, "__dict__") and not isinstance(current, type):
+            stack.append(vars(current))
+    return size
+
+
+def process_memory() -> dict:
+    """Resident set size now and at its peak, in bytes."""
+    report: dict[str, int | None] = {"rss_bytes": None, "peak_rss_bytes": None}
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key = "rss_bytes" if line.startswith("VmRSS:") else "peak_rss_bytes"
+                    report[key] = int(line.split()[1]) * 1024
+    except OSError:
+        try:
+            import resource
+        except ImportError:  # pragma: no cover - Windows
+            return report
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        report["peak_rss_bytes"] = peak if sys.platform == "darwin" else peak * 1024
+    return report
+
+
+def _stat_view(stat) -> dict:
+    frames = [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback]
+    return {"where": frames[0] if len(frames) == 1 else frames, "bytes": stat.size, "count": stat.count}
+
+
+def tracemalloc_report(top: int, group_by: str) -> dict:
+    """Top allocation sites, and the growth per site since the previous report."""
+    global _previous_snapshot
+    if not tracemalloc.is_tracing():
+        return {"tracing": False}
+    snapshot = tracemalloc.take_snapshot().filter_traces(_TRACE_FILTERS)
+    current, peak = tracemalloc.get_traced_memory()
+    with _snapshot_lock:
+        previous, _previous_snapshot = _previous_snapshot, snapshot
+    report = {
+        "tracing": True,
+        "frames": tracemalloc.get_traceback_limit(),
+        "traced_bytes": current,
+        "peak_traced_bytes": peak,
+        "top": [_stat_view(stat) for stat in snapshot.statistics(group_by)[:top]],
+        "growth": None,
+    }
+    if previous is not None:
+        report["growth"] = [
+            {**_stat_view(diff), "bytes_diff": diff.size_diff, "count_diff": diff.count_diff}
+            for diff in snapshot.compare_to(previous, group_by)[:top]
+            if diff.size_diff
+        ]
+    return report
+
+
+def sqlalchemy_report() -> dict:
+    sessions = list(_sessions.values())
+    by_model: Counter[str] = Counter()
+    for session in sessions:
+        for obj in session.identity_map.values():
+            by_model[type(obj).__name__] += 1
+    return {
+        "open_sessions": len(sessions),
+        "identity_map_objects": sum(by_model.values()),
+        "identity_map_by_model": dict(by_model.most_common()),
+        "pool": db.get_engine().pool.status(),
+        "tenants": tenants.registry.stats(),
+    }
+
+
+def cache_report(extra: dict[str, Any] | None = None) -> dict:
+    """Entries and estimated bytes of each in-process cache."""
+    caches = {
+        "asset_fingerprints": assets._fingerprints,
+        "event_subscriptions": broker.subscriptions,
+        "job_futures": jobs.runner.futures,
+        "job_progress": jobs.runner.live_progress,
+        "profile_aggregate": profiling.aggregate.stacks,
+        **(extra or {}),
+    }
+    return {name: {"entries": len(cache), "bytes": deep_sizeof(cache)} for name, cache in caches.items()}
+
+
+def object_report(top: int) -> dict:
+    counts = Counter(type(obj).__name__ for obj in gc.get_objects())
+    return {
+        "tracked": sum(counts.values()),
+        "gc_counts": gc.get_count(),
+        "top_types": dict(counts.most_common(top)),
+    }
+
+
+def memory_report(top: int = 15, group_by: str = "lineno", caches: dict[str, Any] | None = None) -> dict:
+    return {
+        "pid": os.getpid(),
+        "process": process_memory(),
+        "tracemalloc": tracemalloc_report(top, group_by),
+        "sqlalchemy": sqlalchemy_report(),
+        "caches": cache_report(caches),
+        "objects": object_report(top),
+    }
@@ -0,0 +1,210 @@
+"""
+Change events for live multi-tab updates over Server-Sent Events.
+
+Write endpoints publish a small ChangeEvent after committing. The broker hands
+each event to the subscriptions whose week and plan selection it touches, so a
+tab only refreshes when its own view actually changed. Delivery between
+processes is delegated to a backend: in-process by default, or a SQLite
+notification table polled by every worker.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import delete, func, insert
+from sqlmodel import Session, select
+
+from . import db
+from .config import EVENTS_BACKEND, EVENTS_POLL_SECONDS
+from .models import ChangeNotification
+
+logger = logging.getLogger("uvicorn.error")
+
+
+@dataclass(frozen=True)
+class ChangeEvent:
+    kind: str  # "entry", "recurring", "block", "plan" or "import"
+    week_start: date | None = None  # None: may affect any week
+    plan_id: int | None = None
+    entry_id: int | None = None
+    origin: str | None = None  # client id of the tab that made the change
+    tenant: str | None = None  # user whose database changed, in multi-tenant mode
+
+    def to_json(self) -> str:
+        payload = asdict(self)
+        payload["week_start"] = self.week_start.isoformat() if self.week_start else None
+        return json.dumps(payload, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, raw: str) -> "ChangeEvent":
+        payload = json.loads(raw)
+        if payload.get("week_start"):
+            payload["week_start"] = date.fromisoformat(payload["week_start"])
+        return cls(**payload)
+
+
+@dataclass(eq=False)
+class Subscription:
+    week_start: date | None
+    plan_ids: list[int] | None
+    loop: asyncio.AbstractEventLoop
+    tenant: str | None = None
+    queue: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(maxsize=100))
+
+    def matches(self, event: ChangeEvent) -> bool:
+        if event.tenant != self.tenant:
+            return False
+        if event.week_start is not None and self.week_start is not None and event.week_start != self.week_start:
+            return False
+        if event.plan_id is not None and self.plan_ids is not None and event.plan_id not in self.plan_ids:
+            return False
+        return True
+
+    def deliver(self, event: ChangeEvent) -> None:
+        # A slow client only needs to know that something changed; drop extras
+        if not self.queue.full():
+            self.queue.put_nowait(event)
+
+
+class InProcessBackend:
+    """Delivers events to subscribers in the publishing process only."""
+
+    async def start(self, broker: "EventBroker") -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def publish(self, event: ChangeEvent, broker: "EventBroker") -> None:
+        broker.dispatch(event)
+
+
+class SQLiteBackend:
+    """Shares events between worker processes through the changenotification table.
+
+    Publishing inserts a row; every worker polls for rows newer than the last
+    one it saw and dispatches them locally. Polls only read; rows older than a
+    minute are pruned once a minute, so polling does not take the write lock.
+    A failed poll (say, while an import holds the lock) is logged and retried.
+    The table is always in the shared database (``db.engine``), also in
+    multi-tenant mode, where events name their tenant instead.
+    """
+
+    retention = timedelta(minutes=1)
+
+    def __init__(self, poll_seconds: float = EVENTS_POLL_SECONDS) -> None:
+        self.poll_seconds = poll_seconds
+        self.last_id = 0
+        self.pruned_at = time.monotonic()
+        self.task: asyncio.Task | None = None
+
+    async def start(self, broker: "EventBroker") -> None:
+        self.last_id = await asyncio.to_thread(self._max_id)
+        self.task = asyncio.create_task(self._poll(broker))
+
+    async def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def publish(self, event: ChangeEvent, broker: "EventBroker") -> None:
+        with Session(db.engine) as session:
+            session.exec(insert(ChangeNotification.__table__).values(
+                payload=event.to_json(), created_at=datetime.utcnow(),
+            ))
+            session.commit()
+
+    def _max_id(self) -> int:
+        with Session(db.engine) as session:
+            return session.exec(select(func.max(ChangeNotification.id))).one() or 0
+
+    def _fetch(self) -> list[tuple[int, str]]:
+        with Session(db.engine) as session:
+            return session.exec(
+                select(ChangeNotification.id, ChangeNotification.payload)
+                .where(ChangeNotification.id > self.last_id)
+                .order_by(ChangeNotification.id)
+            ).all()
+
+    def _prune(self) -> None:
+        with Session(db.engine) as session:
+            session.exec(delete(ChangeNotification.__table__).where(
+                ChangeNotification.__table__.c.created_at < datetime.utcnow() - self.retention
+            ))
+            session.commit()
+
+    def _poll_once(self, broker: "EventBroker") -> list[tuple[int, str]]:
+        if time.monotonic() - self.pruned_at >= self.retention.total_seconds():
+            self._prune()
+            self.pruned_at = time.monotonic()
+        if not broker.subscriptions:
+            # Skip what nobody is listening for, so a first subscriber gets no stale events
+            self.last_id = self._max_id()
+            return []
+        return self._fetch()
+
+    async def _poll(self, broker: "EventBroker") -> None:
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                rows = await asyncio.to_thread(self._poll_once, broker)
+            except Exception as exc:  # noqa: BLE001 - e.g. "database is locked"; poll again
+                logger.warning("Polling change events failed: %s", exc)
+                continue
+            for row_id, payload in rows:
+                self.last_id = row_id
+                broker.dispatch(ChangeEvent.from_json(payload))
+
+
+class EventBroker:
+    """Fans published change events out to matching SSE subscriptions."""
+
+    def __init__(self, backend) -> None:
+        self.backend = backend
+        self.subscriptions: set[Subscription] = set()
+        self._lock = threading.Lock()
+
+    async def start(self) -> None:
+        await self.backend.start(self)
+
+    async def stop(self) -> None:
+        await self.backend.stop()
+
+    def subscribe(self, week_start: date | None, plan_ids: list[int] | None, tenant: str | None = None) -> Subscription:
+        """Register a subscription on the running event loop."""
+        subscription = Subscription(week_start, plan_ids, asyncio.get_running_loop(), tenant)
+        with self._lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self.subscriptions.discard(subscription)
+
+    def publish(self, event: ChangeEvent) -> None:
+        """Publish an event. Safe to call from request worker threads."""
+        self.backend.publish(event, self)
+
+    def dispatch(self, event: ChangeEvent) -> None:
+        """Deliver an event to local subscriptions on their own event loops."""
+        with self._lock:
+            targets = [s for s in self.subscriptions if s.matches(event)]
+        for subscription in targets:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The subscriber's event loop is gone
+                self.unsubscribe(subscription)
+
+
+def make_backend(name: str):
+    if name == "sqlite":
+        return SQLiteBackend()
+    return InProcessBackend()
+
+
+broker = EventBroker(make_backend(EVENTS_BACKEND))
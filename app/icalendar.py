@@ -0,0 +1,200 @@
+"""
+iCalendar (RFC 5545) feed for a plan.
+
+One-off entries become plain VEVENTs. Recurring tasks are emitted once with
+an RRULE instead of being expanded: deleted instances become EXDATEs and
+modified instances become override VEVENTs with a RECURRENCE-ID. Times are
+floating (no time zone), matching how the planner itself stores them.
+"""
+from datetime import date, datetime, timedelta
+from itertools import chain
+from typing import Iterator, Sequence
+
+from sqlmodel import Session, select
+
+from . import db
+from .archive import archived_entries, archived_exceptions
+from .dates import DAY_INDEX
+from .models import BlockType, ChangeLog, Plan, RecurringException, RecurringTask, ScheduleEntry
+from .recurring import occurs_on
+
+PRODID = "-//Planner//Planner Calendar//EN"
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+FREQUENCIES = {"daily": "DAILY", "weekly": "WEEKLY", "monthly": "MONTHLY"}
+# How far to look for the first occurrence of a rule (a monthly rule on the 31st every 12 months)
+FIRST_OCCURRENCE_SEARCH_DAYS = 366 * 12
+
+
+def escape_text(value: str) -> str:
+    return (
+        value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+        .replace("\r\n", "\\n").replace("\n", "\\n")
+    )
+
+
+def fold(line: str) -> str:
+    """Fold a content line at 75 octets without splitting UTF-8 sequences."""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line + "\r\n"
+    parts = []
+    start = 0
+    limit = 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        # Step back to a character boundary
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode("utf-8"))
+        start = end
+        limit = 74  # continuation lines start with a space
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def format_datetime(d: date, minute: int) -> str:
+    moment = datetime(d.year, d.month, d.day) + timedelta(minutes=minute)
+    return moment.strftime("%Y%m%dT%H%M%S")
+
+
+def format_utc(moment: datetime) -> str:
+    return moment.strftime("%Y%m%dT%H%M%SZ")
+
+
+def _event(uid: str, stamp: datetime, start: date, start_minute: int, duration: int, summary: str, note: str | None, extra: Sequence[str] = ()) -> str:
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{uid}",
+        f"DTSTAMP:{format_utc(stamp)}",
+        f"DTSTART:{format_datetime(start, start_minute)}",
+        f"DTEND:{format_datetime(start, start_minute + duration)}",
+        f"SUMMARY:{escape_text(summary)}",
+        *extra,
+    ]
+    if note:
+        lines.append(f"DESCRIPTION:{escape_text(note)}")
+    lines.append("END:VEVENT")
+    return "".join(fold(line) for line in lines)
+
+
+def first_occurrence(task: RecurringTask) -> date | None:
+    current = task.start_date
+    for _ in range(FIRST_OCCURRENCE_SEARCH_DAYS):
+        if task.end_date and current > task.end_date:
+            return None
+        if occurs_on(task, current):
+            return current
+        current += timedelta(days=1)
+    return None
+
+
+def recurrence_rule(task: RecurringTask) -> str:
+    parts = [f"FREQ={FREQUENCIES[task.pattern]}", f"INTERVAL={task.interval}"]
+    if task.pattern == "weekly":
+        parts.append(f"BYDAY={WEEKDAYS[task.day_of_week]}")
+    elif task.pattern == "monthly":
+        parts.append(f"BYMONTHDAY={task.day_of_month}")
+    if task.end_date:
+        parts.append(f"UNTIL={format_datetime(task.end_date, 24 * 60 - 1)}")
+    return "RRULE:" + ";".join(parts)
+
+
+def recurring_events(task: RecurringTask, exceptions: list[RecurringException]) -> str:
+    """The master VEVENT of a recurring task followed by its overrides."""
+    if task.pattern not in FREQUENCIES:
+        return ""
+    first = first_occurrence(task)
+    if first is None:
+        return ""
+    uid = f"recurring-{task.id}@planner"
+    exdates = []
+    overrides = []
+    for ex in exceptions:
+        if not occurs_on(task, ex.exception_date):
+            continue
+        original = format_datetime(ex.exception_date, task.start_minute)
+        if ex.exception_type == "deleted":
+            exdates.append(original)
+        elif ex.exception_type == "modified":
+            week_start = ex.exception_date - timedelta(days=ex.exception_date.weekday())
+            moved_to = week_start + timedelta(days=DAY_INDEX[ex.new_day]) if ex.new_day in DAY_INDEX else ex.exception_date
+            overrides.append(_event(
+                uid, ex.created_at, moved_to,
+                ex.new_start_minute if ex.new_start_minute is not None else task.start_minute,
+                ex.new_duration_minutes if ex.new_duration_minutes is not None else task.duration_minutes,
+                task.title, task.note,
+                [f"RECURRENCE-ID:{original}"],
+            ))
+    extra = [recurrence_rule(task)]
+    if exdates:
+        extra.append("EXDATE:" + ",".join(exdates))
+    master = _event(uid, task.created_at, first, task.start_minute, task.duration_minutes, task.title, task.note, extra)
+    return master + "".join(overrides)
+
+
+def _in_plan(column, plan_id: int):
+    return (column == plan_id) | (column == None)
+
+
+def plan_calendar(plan_id: int, batch_size: int = 500) -> Iterator[str]:
+    """Stream the calendar of a plan (plus entries shared by all plans) chunk by chunk.
+
+    Opens its own session because the response body is produced after the
+    request's session has been closed. Archived weeks are included, so old
+    events and exceptions do not drop out of subscribed calendars.
+    """
+    with Session(db.get_engine()) as session:
+        plan = session.get(Plan, plan_id)
+        yield "".join(fold(line) for line in (
+            "BEGIN:VCALENDAR",
+            "VERSION:2.0",
+            f"PRODID:{PRODID}",
+            "CALSCALE:GREGORIAN",
+            f"X-WR-CALNAME:{escape_text(plan.name if plan else 'Planner')}",
+        ))
+
+        block_types = {b.id: b for b in session.exec(select(BlockType)).all()}
+        # Archived entries are all older than the live ones
+        archived = sorted(archived_entries(session, date.min, date.max, [plan_id]), key=lambda e: e.start_at or 0)
+        entries = chain(archived, session.exec(
+            select(ScheduleEntry)
+            .where(_in_plan(ScheduleEntry.plan_id, plan_id), ScheduleEntry.entry_date != None)
+            .order_by(ScheduleEntry.start_at)
+            .execution_options(yield_per=batch_size)
+        ))
+        chunk = []
+        for entry in entries:
+            block_type = block_types.get(entry.block_type_id)
+            chunk.append(_event(
+                f"entry-{entry.id}@planner", entry.created_at, entry.entry_date,
+                entry.start_minute, entry.duration_minutes,
+                entry.custom_title or (block_type.name if block_type else "Planner"), entry.note,
+            ))
+            if len(chunk) >= batch_size:
+                yield "".join(chunk)
+                chunk = []
+        if chunk:
+            yield "".join(chunk)
+
+        tasks = session.exec(select(RecurringTask).where(_in_plan(RecurringTask.plan_id, plan_id))).all()
+        exceptions: dict[int, dict[date, RecurringException]] = {}
+        if tasks:
+            task_ids = [t.id for t in tasks]
+            live = session.exec(
+                select(RecurringException).where(RecurringException.recurring_task_id.in_(task_ids))
+            ).all()
+            # A live exception wins over an archived one for the same day
+            for ex in [*archived_exceptions(session, task_ids, date.min, date.max), *live]:
+                exceptions.setdefault(ex.recurring_task_id, {})[ex.exception_date] = ex
+        for task in tasks:
+            by_date = exceptions.get(task.id, {})
+            yield recurring_events(task, [by_date[d] for d in sorted(by_date)])
+
+        yield "END:VCALENDAR\r\n"
+
+
+def feed_validators(session: Session, plan_id: int) -> tuple[str, datetime | None]:
+    """ETag and Last-Modified of a plan's feed, derived from the change log."""
+    rev, changed_at = session.exec(
+        select(ChangeLog.rev, ChangeLog.changed_at).order_by(ChangeLog.rev.desc()).limit(1)
+    ).first() or (0, None)
+    return f'"plan-{plan_id}-rev-{rev}"', changed_at
@@ -0,0 +1,195 @@
+"""
+Safe retries for mutations through the Idempotency-Key header.
+
+The client's outbox replays queued changes after a dropped connection, so it
+may send a request the server already handled. A mutation that carries an
+``Idempotency-Key`` header runs once: the key is reserved before the route
+runs, the response is stored with it, and any later request with the same
+key gets the stored response back (marked ``Idempotent-Replayed: true``)
+without running the route again. Bodies over IDEMPOTENCY_MAX_BODY_BYTES
+(most rendered weeks) are not stored. Their replay has the original status
+and headers but an empty body, and the client reloads the week instead of
+swapping it in; replays are rare, so recording stays a small write. Reusing
+a key for a different request is a 422. A retry that arrives while the first
+request is still running gets a 409 with ``Retry-After``. 5xx responses are
+not stored, so the request can be retried later. Requests without the header
+are not affected.
+"""
+import asyncio
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import db
+from .config import IDEMPOTENCY_LOCK_SECONDS, IDEMPOTENCY_MAX_BODY_BYTES, IDEMPOTENCY_RETENTION_HOURS
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+UNSAFE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+MAX_KEY_LENGTH = 64
+# Headers that describe the body; dropped when the body is not stored
+BODY_HEADERS = {b"content-length", b"content-encoding", b"etag"}
+
+
+def request_fingerprint(method: str, path: str, query: bytes, body: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in (method.encode(), path.encode(), query, body):
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def prune_idempotency_keys(session: Session) -> None:
+    """Forget recorded responses past the retention period."""
+    cutoff = datetime.utcnow() - timedelta(hours=IDEMPOTENCY_RETENTION_HOURS)
+    session.exec(delete(IdempotencyKey).where(IdempotencyKey.created_at < cutoff))
+
+
+def reserve_key(key: str, fingerprint: str) -> IdempotencyKey | None:
+    """Claim `key` for a new request. Returns None if claimed, else the existing record.
+
+    A record whose request never finished (its process died) is taken over
+    once it is older than IDEMPOTENCY_LOCK_SECONDS.
+    """
+    with Session(db.get_engine()) as session:
+        prune_idempotency_keys(session)
+        session.add(IdempotencyKey(key=key, fingerprint=fingerprint))
+        try:
+            session.commit()
+            return None
+        except IntegrityError:
+            session.rollback()
+
+        stale = datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+        taken = session.exec(
+            update(IdempotencyKey)
+            .where(
+                IdempotencyKey.key == key,
+                IdempotencyKey.fingerprint == fingerprint,
+                IdempotencyKey.status_code == None,
+                IdempotencyKey.created_at < stale,
+            )
+            .values(created_at=datetime.utcnow())
+        )
+        session.commit()
+        if taken.rowcount:
+            return None
+        return session.get(IdempotencyKey, key)
+
+
+def record_response(key: str, status_code: int, headers: list[tuple[bytes, bytes]], body: bytes) -> None:
+    if len(body) > IDEMPOTENCY_MAX_BODY_BYTES:
+        headers = [(name, value) for name, value in headers if name.lower() not in BODY_HEADERS]
+        headers.append((b"content-length", b"0"))
+        body = None
+    with Session(db.get_engine()) as session:
+        record = session.get(IdempotencyKey, key)
+        if record is None:
+            return
+        record.status_code = status_code
+        record.headers = json.dumps([[name.decode("latin-1"), value.decode("latin-1")] for name, value in headers])
+        record.body = body
+        session.add(record)
+        session.commit()
+
+
+def release_key(key: str) -> None:
+    """Drop an unfinished reservation so the request can be retried."""
+    with Session(db.get_engine()) as session:
+        session.exec(delete(IdempotencyKey).where(IdempotencyKey.key == key, IdempotencyKey.status_code == None))
+        session.commit()
+
+
+class IdempotencyMiddleware:
+    """Run unsafe requests that carry an Idempotency-Key at most once, replaying the stored response."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] not in UNSAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+        key = Headers(scope=scope).get(IDEMPOTENCY_HEADER)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        if not key or len(key) > MAX_KEY_LENGTH:
+            await JSONResponse({"detail": "Invalid Idempotency-Key"}, status_code=400)(scope, receive, send)
+            return
+
+        body = bytearray()
+        while True:
+            message = await receive()
+            body.extend(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body = bytes(body)
+        fingerprint = request_fingerprint(scope["method"], scope["path"], scope.get("query_string", b""), body)
+
+        existing = await asyncio.to_thread(reserve_key, key, fingerprint)
+        if existing is not None:
+            await self._answer_existing(existing, fingerprint, scope, receive, send)
+            return
+
+        replayed = False
+
+        async def replay_body() -> Message:
+            # The buffered body once, then the real channel (for http.disconnect)
+            nonlocal replayed
+            if replayed:
+                return await receive()
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        status_code = 500
+        response_headers: list[tuple[bytes, bytes]] = []
+        response_body = bytearray()
+
+        async def capture(message: Message) -> None:
+            nonlocal status_code, response_headers
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                response_headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                response_body.extend(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_body, capture)
+        except BaseException:
+            await asyncio.to_thread(release_key, key)
+            raise
+        if status_code >= 500:
+            await asyncio.to_thread(release_key, key)
+        else:
+            await asyncio.to_thread(record_response, key, status_code, response_headers, bytes(response_body))
+
+    async def _answer_existing(
+        self, record: IdempotencyKey, fingerprint: str, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        if record.fingerprint != fingerprint:
+            response = JSONResponse({"detail": "Idempotency-Key was used for a different request"}, status_code=422)
+        elif record.status_code is None:
+            response = JSONResponse(
+                {"detail": "A request with this Idempotency-Key is in progress"},
+                status_code=409,
+                headers={"Retry-After": "1"},
+            )
+        else:
+            headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(record.headers)]
+            await send({
+                "type": "http.response.start",
+                "status": record.status_code,
+                "headers": headers + [(b"idempotent-replayed", b"true")],
+            })
+            await send({"type": "http.response.body", "body": record.body or b""})
+            return
+        await response(scope, receive, send)
@@ -0,0 +1,153 @@
+"""
+In-process background jobs for long imports and exports.
+
+Jobs are recorded in the job table and run on a small thread pool, so a
+request only has to submit the work and return. Rows-per-table progress is
+kept in memory while a job runs, because an import holds SQLite's write lock
+until it commits. It is written to the job row when the job finishes. Result
+files live in PLANNER_JOBS_DIR (in multi-tenant mode, in
+PLANNER_TENANT_DIR/<user>.jobs) and are removed together with their job once
+they are older than PLANNER_JOBS_RETENTION_HOURS. Jobs run against the
+database of the request that submitted them.
+"""
+import contextvars
+import json
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable
+
+from sqlmodel import Session, select
+
+from . import db
+from .config import JOBS_DIR, JOBS_RETENTION_HOURS, JOBS_WORKERS
+from .models import Job
+
+# work(session, job_id, progress) -> path of the result file, or None
+Work = Callable[[Session, int, Callable[[str, int], None]], str | None]
+
+
+def job_path(name: str) -> str:
+    from .tenants import tenant_path
+
+    tenant = db.current_tenant.get()
+    directory = tenant_path(tenant, ".jobs") if tenant else JOBS_DIR
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+def _job_key(job_id: int) -> tuple[str | None, int]:
+    """Job ids are only unique within one tenant's database."""
+    return db.current_tenant.get(), job_id
+
+
+class JobRunner:
+    def __init__(self, workers: int = JOBS_WORKERS) -> None:
+        self.workers = workers
+        self.executor: ThreadPoolExecutor | None = None
+        self.futures: dict[tuple[str | None, int], Future] = {}
+        self.live_progress: dict[tuple[str | None, int], dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, work: Work) -> Job:
+        """Record a job and queue `work` for a worker thread."""
+        with Session(db.get_engine()) as session:
+            prune_jobs(session)
+            job = Job(kind=kind)
+            session.add(job)
+            session.commit()
+            session.refresh(job)
+        with self._lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="planner-job")
+            # The worker thread keeps the submitting request's database
+            future = self.executor.submit(contextvars.copy_context().run, self._run, job.id, work)
+            self.futures[_job_key(job.id)] = future
+        future.add_done_callback(lambda _, key=_job_key(job.id): self.futures.pop(key, None))
+        return job
+
+    def wait(self, job_id: int, timeout: float | None = None) -> None:
+        future = self.futures.get(_job_key(job_id))
+        if future:
+            future.result(timeout=timeout)
+
+    def progress_of(self, job: Job) -> dict[str, int]:
+        live = self.live_progress.get(_job_key(job.id))
+        return dict(live) if live is not None else json.loads(job.progress or "{}")
+
+    def shutdown(self) -> None:
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def _run(self, job_id: int, work: Work) -> None:
+        progress: dict[str, int] = {}
+        self.live_progress[_job_key(job_id)] = progress
+
+        def report(table: str, rows: int) -> None:
+            progress[table] = rows
+
+        self._update(job_id, status="running")
+        try:
+            with Session(db.get_engine()) as session:
+                result_path = work(session, job_id, report)
+        except Exception as exc:  # noqa: BLE001 - any failure is reported on the job
+            self._update(job_id, status="failed", error=str(exc) or type(exc).__name__, progress=progress)
+        else:
+            self._update(job_id, status="done", result_path=result_path, progress=progress)
+        finally:
+            self.live_progress.pop(_job_key(job_id), None)
+
+    def _update(self, job_id: int, progress: dict | None = None, **fields) -> None:
+        with Session(db.get_engine()) as session:
+            job = session.get(Job, job_id)
+            for key, value in fields.items():
+                setattr(job, key, value)
+            if progress is not None:
+                job.progress = json.dumps(progress)
+            if fields.get("status") in ("done", "failed"):
+                job.finished_at = datetime.utcnow()
+            session.add(job)
+            session.commit()
+
+
+def job_view(job: Job, runner: "JobRunner") -> dict:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": runner.progress_of(job),
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+        "download_url": f"/jobs/{job.id}/download" if job.status == "done" and job.result_path else None,
+    }
+
+
+def prune_jobs(session: Session) -> None:
+    """Delete finished jobs past the retention period, with their files."""
+    cutoff = datetime.utcnow() - timedelta(hours=JOBS_RETENTION_HOURS)
+    for job in session.exec(select(Job).where(Job.finished_at != None, Job.finished_at < cutoff)).all():
+        if job.result_path and os.path.exists(job.result_path):
+            os.remove(job.result_path)
+        session.delete(job)
+
+
+def fail_interrupted_jobs(session: Session, before: datetime | None = None) -> None:
+    """Jobs run in-process, so any job still pending at startup was lost with the old process.
+
+    `before` limits this to jobs created earlier, for databases opened while
+    other workers may already be running jobs on them.
+    """
+    query = select(Job).where(Job.status.in_(("queued", "running")))
+    if before is not None:
+        query = query.where(Job.created_at < before)
+    for job in session.exec(query).all():
+        job.status = "failed"
+        job.error = "Interrupted by a restart"
+        job.finished_at = datetime.utcnow()
+        session.add(job)
+
+
+runner = JobRunner()
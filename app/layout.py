@@ -0,0 +1,71 @@
+"""
+Side-by-side layout of overlapping entries in a day column.
+
+Entries of one day are swept in start order. A cluster is a run of
+transitively overlapping entries. Each entry takes the lowest lane that is
+free at its start, and every entry of a cluster gets the cluster's lane
+count, so any overlap depth renders without stacking. In multi-plan view an
+entry first tries the lane its plan already uses in the cluster, which
+keeps a plan's blocks in one column where possible.
+"""
+import heapq
+from typing import Any, Sequence
+
+
+def _field(item: Any, name: str):
+    return item[name] if isinstance(item, dict) else getattr(item, name)
+
+
+def assign_lanes(items: Sequence[Any], by_plan: bool = False) -> list[tuple[int, int]]:
+    """(lane, lane count) for each entry or instance of one day, in input order. O(n log n)."""
+    layout = [(0, 1)] * len(items)
+    order = sorted(range(len(items)), key=lambda i: _field(items[i], "start_minute"))
+
+    cluster: list[tuple[int, int]] = []  # (item index, lane)
+    cluster_end = -1
+    busy: list[tuple[int, int]] = []  # heap of (end minute, lane)
+    free: list[int] = []  # heap of released lanes; stale entries are skipped
+    free_set: set[int] = set()
+    plan_lanes: dict[Any, int] = {}
+    lane_count = 0
+
+    def close_cluster() -> None:
+        for index, lane in cluster:
+            layout[index] = (lane, lane_count)
+
+    for index in order:
+        start = _field(items[index], "start_minute")
+        end = start + _field(items[index], "duration_minutes")
+        if start >= cluster_end and cluster:
+            close_cluster()
+            cluster, busy, free, plan_lanes = [], [], [], {}
+            free_set.clear()
+            lane_count = 0
+        cluster_end = max(cluster_end, end)
+
+        while busy and busy[0][0] <= start:
+            _, released = heapq.heappop(busy)
+            heapq.heappush(free, released)
+            free_set.add(released)
+
+        plan_id = _field(items[index], "plan_id") if by_plan else None
+        preferred = plan_lanes.get(plan_id)
+        if preferred is not None and preferred in free_set:
+            lane = preferred
+        else:
+            while free and free[0] not in free_set:
+                heapq.heappop(free)
+            if free:
+                lane = heapq.heappop(free)
+            else:
+                lane = lane_count
+                lane_count += 1
+        free_set.discard(lane)
+        if by_plan:
+            plan_lanes.setdefault(plan_id, lane)
+        heapq.heappush(busy, (end, lane))
+        cluster.append((index, lane))
+
+    if cluster:
+        close_cluster()
+    return layout
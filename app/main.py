@@ -1,27 +1,62 @@
-from datetime import datetime, date, timedelta
+from datetime import datetime, date, timedelta, timezone
+from email.utils import format_datetime as format_http_date, parsedate_to_datetime as parse_http_date
+from pathlib import Path
 from typing import Annotated
-import csv
+import asyncio
+import hashlib
 import io
 import json
+import os
+import uuid
 
-from fastapi import Depends, FastAPI, Form, HTTPException, Request, Query, UploadFile, File
-from fastapi.responses import HTMLResponse, StreamingResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import Depends, FastAPI, Form, HTTPException, Request, Response, Query, UploadFile, File
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from sqlmodel import Session, select
 
+from . import db, jobs
+from .archive import archive_periodically, archived_before, archived_entries, clear_archive
+from .assets import STATIC_DIR, CompressedStaticFiles, CompressionMiddleware, fingerprint, precompress_static
+from .templating import TEMPLATES_DIR, make_environment
 from .db import get_session, init_db, seed_defaults, ensure_quick_block, ensure_default_plan
-from .models import BlockType, ScheduleEntry, RecurringTask, RecurringException, Plan
+from .models import BlockType, ScheduleEntry, RecurringTask, RecurringException, Plan, WeekTemplate, Job
+from .events import ChangeEvent, broker
+from .serialization import FastJSONResponse, block_type_table, entry_columns, plan_table, recurring_columns
+from .search import search
+from .stats import time_stats
+from .sync import changes_since, current_revision
+from .icalendar import feed_validators, plan_calendar
+from .idempotency import IdempotencyMiddleware
+from . import profiling
+from .profiling import ProfilingMiddleware, require_profile_token
+from . import tenants
+from .tenants import TenantMiddleware, evict_idle_tenants_periodically
+from .backup import backup_stream, restore_backup
+from .diagnostics import GROUPINGS, memory_report, require_diagnostics_token, start_tracing, stop_tracing
+from .layout import assign_lanes
+from .jobs import fail_interrupted_jobs, job_path, job_view
+from .transfer import export_archive, import_archive, validate_archive
+from .recurring import (
+    ensure_horizon, instances_in_range, refresh_horizon_periodically, refresh_task_instances,
+)
+from .weeks import CONFLICT_POLICIES, MAX_WEEKS, copy_weeks, save_week_template, apply_week_template, delete_week_template
 from .config import (
-    DAY_START_MINUTE, DAY_END_MINUTE, SLOT_MINUTES, SLOT_HEIGHT_PX,
-    PRODUCTION_END, ACTIVITY_END, DURATION_OPTIONS, PLAN_COLORS
+    DAY_ORDER, DAY_START_MINUTE, DAY_END_MINUTE, SLOT_MINUTES, SLOT_HEIGHT_PX,
+    PERIODS, DURATION_OPTIONS, PLAN_COLORS, MATERIALIZE_RECURRING,
+    EVENTS_KEEPALIVE_SECONDS, API_MAX_RANGE_DAYS, ARCHIVE_AFTER_WEEKS, TENANT_MODE,
 )
 
 app = FastAPI(title="Planner")
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
-templates = Jinja2Templates(directory="app/templates")
+# Inside the compression middleware, so recorded responses are stored uncompressed
+app.add_middleware(IdempotencyMiddleware)
+# Outside idempotency, whose keys live in each user's database
+app.add_middleware(TenantMiddleware)
+app.add_middleware(CompressionMiddleware, exclude=("/events", "/static"))
+app.add_middleware(ProfilingMiddleware)
+app.mount("/static", CompressedStaticFiles(directory="app/static"), name="static")
+templates = Jinja2Templates(env=make_environment())
 
-DAY_ORDER = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+UPLOAD_CHUNK_BYTES = 1024 * 1024
 
 ICON_CHOICES = [
     {"name": "calendar", "label": "Calendar"},
@@ -76,100 +111,69 @@ def get_quick_block_type(session: Session) -> BlockType:
 
 def get_recurring_instances_for_week(session: Session, week_start: date, plan_ids: list[int] | None = None) -> list[dict]:
     """Generate virtual entries for recurring tasks that fall within the given week."""
-    week_end = week_start + timedelta(days=6)
-    
-    # Get all active recurring tasks
-    query = select(RecurringTask).where(
-        RecurringTask.start_date <= week_end,
-        (RecurringTask.end_date == None) | (RecurringTask.end_date >= week_start)
-    )
-    
-    # Filter by plan_ids if provided
-    if plan_ids is not None:
-        query = query.where(RecurringTask.plan_id.in_(plan_ids) | (RecurringTask.plan_id == None))
-    
-    recurring_tasks = session.exec(query).all()
-    
-    instances = []
-    
-    for task in recurring_tasks:
-        # Get exceptions for this task in this week
-        exceptions = session.exec(
-            select(RecurringException).where(
-                RecurringException.recurring_task_id == task.id,
-                RecurringException.exception_date >= week_start,
-                RecurringException.exception_date <= week_end,
-            )
-        ).all()
-        exception_map = {ex.exception_date: ex for ex in exceptions}
-        
-        # Generate instances for each day in the week
-        for day_offset in range(7):
-            current_date = week_start + timedelta(days=day_offset)
-            
-            # Skip if before task start date
-            if current_date < task.start_date:
-                continue
-            # Skip if after task end date
-            if task.end_date and current_date > task.end_date:
-                continue
-            
-            # Check if this date matches the recurrence pattern
-            matches = False
-            if task.pattern == "daily":
-                days_since_start = (current_date - task.start_date).days
-                matches = (days_since_start % task.interval) == 0
-            elif task.pattern == "weekly":
-                if task.day_of_week is not None and current_date.weekday() == task.day_of_week:
-                    weeks_since_start = (current_date - task.start_date).days // 7
-                    matches = (weeks_since_start % task.interval) == 0
-            elif task.pattern == "monthly":
-                if task.day_of_month is not None and current_date.day == task.day_of_month:
-                    months_since_start = (current_date.year - task.start_date.year) * 12 + (current_date.month - task.start_date.month)
-                    matches = (months_since_start % task.interval) == 0
-            
-            if not matches:
-                continue
-            
-            # Check for exceptions
-            exception = exception_map.get(current_date)
-            if exception and exception.exception_type == "deleted":
-                continue  # This instance was deleted
-            
-            # Get the day name
-            day_name = DAY_ORDER[current_date.weekday()]
-            start_minute = task.start_minute
-            duration = task.duration_minutes
-            
-            # Apply modifications if this instance was modified
-            if exception and exception.exception_type == "modified":
-                if exception.new_day:
-                    day_name = exception.new_day
-                if exception.new_start_minute is not None:
-                    start_minute = exception.new_start_minute
-                if exception.new_duration_minutes is not None:
-                    duration = exception.new_duration_minutes
-            
-            instances.append({
-                "recurring_task_id": task.id,
-                "instance_date": current_date,
-                "title": task.title,
-                "note": task.note,
-                "day": day_name,
-                "start_minute": start_minute,
-                "duration_minutes": duration,
-                "block_type": task.block_type,
-                "is_recurring": True,
-                "plan_id": task.plan_id,
-            })
-    
-    return instances
+    return instances_in_range(session, week_start, week_start + timedelta(days=6), plan_ids)
 
 
-@app.on_event("startup")
-def on_startup() -> None:
+# Set once the one-time startup work has run; `python -m app serve` does it
+# before forking, so workers inherit the flag and skip it.
+database_prepared = False
+
+
+def prepare_database() -> None:
+    """Create and patch the schema, seed defaults and recover from the previous run."""
+    global database_prepared
     init_db()
     seed_defaults()
+    try:
+        precompress_static()
+    except OSError:
+        pass  # Read-only install; assets are served uncompressed
+    with Session(db.get_engine()) as session:
+        ensure_horizon(session)
+        fail_interrupted_jobs(session)
+        session.commit()
+    database_prepared = True
+
+
+@app.on_event("startup")
+def on_startup() -> None:
+    start_tracing()
+    if not database_prepared:
+        prepare_database()
+
+
+@app.on_event("startup")
+async def start_background_tasks() -> None:
+    await broker.start()
+    if MATERIALIZE_RECURRING:
+        asyncio.create_task(refresh_horizon_periodically())
+    if ARCHIVE_AFTER_WEEKS:
+        asyncio.create_task(archive_periodically())
+    if TENANT_MODE != "off":
+        asyncio.create_task(evict_idle_tenants_periodically())
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks() -> None:
+    await broker.stop()
+    jobs.runner.shutdown()
+    tenants.registry.close_all()
+
+
+def entries_in_range(session: Session, start: date, end: date, plan_ids: list[int] | None = None) -> list[ScheduleEntry]:
+    """One-off entries dated between `start` and `end` (inclusive), in chronological order."""
+    query = (
+        select(ScheduleEntry)
+        .where(ScheduleEntry.entry_date >= start, ScheduleEntry.entry_date <= end)
+        .order_by(ScheduleEntry.start_at)
+    )
+    if plan_ids is not None:
+        query = query.where(ScheduleEntry.plan_id.in_(plan_ids) | (ScheduleEntry.plan_id == None))
+    entries = session.exec(query).all()
+    archived = archived_entries(session, start, end, plan_ids)
+    if archived:
+        entries = sorted([*archived, *entries], key=lambda e: e.start_at or 0)
+    return entries
 
 
 def _schedule_data(session: Session, week_start: date, plan_ids: list[int] | None = None):
@@ -179,11 +183,7 @@ def _schedule_data(session: Session, week_start: date, plan_ids: list[int] | Non
         .order_by(BlockType.name)
     ).all()
     
-    # Build entry query with optional plan filtering
-    entry_query = select(ScheduleEntry).where(ScheduleEntry.week_start == week_start)
-    if plan_ids is not None:
-        entry_query = entry_query.where(ScheduleEntry.plan_id.in_(plan_ids) | (ScheduleEntry.plan_id == None))
-    entries = session.exec(entry_query).all()
+    entries = entries_in_range(session, week_start, week_start + timedelta(days=6), plan_ids)
     
     entries_by_day: dict[str, list] = {d: [] for d in DAY_ORDER}
     for entry in entries:
@@ -198,6 +198,14 @@ def _schedule_data(session: Session, week_start: date, plan_ids: list[int] | Non
     for day_entries in entries_by_day.values():
         day_entries.sort(key=lambda e: e.start_minute if hasattr(e, 'start_minute') else e["start_minute"])
     
+    # Get all plans for the selector
+    all_plans = session.exec(select(Plan).order_by(Plan.name)).all()
+    selected_plan_ids = plan_ids or [p.id for p in all_plans]  # Default: show all
+    multi_plan = len(all_plans) > 1 and len(selected_plan_ids) > 1
+
+    # Side-by-side lanes for overlapping entries, parallel to entries_by_day
+    layout_by_day = {day: assign_lanes(day_entries, by_plan=multi_plan) for day, day_entries in entries_by_day.items()}
+
     week_dates = get_week_dates(week_start)
     
     # Check if this is current week and compute current time line position
@@ -210,36 +218,78 @@ def _schedule_data(session: Session, week_start: date, plan_ids: list[int] | Non
         if DAY_START_MINUTE <= current_minute <= DAY_END_MINUTE:
             current_time_top = ((current_minute - DAY_START_MINUTE) / SLOT_MINUTES) * SLOT_HEIGHT_PX
     
-    # Get all plans for the selector
-    all_plans = session.exec(select(Plan).order_by(Plan.name)).all()
+    archive_cutoff = archived_before(session)
     
     return {
         "blocks": blocks,
         "entries_by_day": entries_by_day,
+        "layout_by_day": layout_by_day,
         "day_order": DAY_ORDER,
         "day_start": DAY_START_MINUTE,
         "day_end": DAY_END_MINUTE,
         "slot_minutes": SLOT_MINUTES,
         "slot_height": SLOT_HEIGHT_PX,
-        "periods": [
-            {"name": "Production", "start": DAY_START_MINUTE, "end": PRODUCTION_END, "class": "prod"},
-            {"name": "Activity", "start": PRODUCTION_END, "end": ACTIVITY_END, "class": "act"},
-            {"name": "Night", "start": ACTIVITY_END, "end": DAY_END_MINUTE, "class": "night"},
-        ],
+        "periods": PERIODS,
         "week_start": week_start,
+        "this_week": get_week_start(today),
         "week_dates": week_dates,
         "prev_week": week_start - timedelta(days=7),
         "next_week": week_start + timedelta(days=7),
         "duration_options": DURATION_OPTIONS,
         "icon_choices": ICON_CHOICES,
         "is_current_week": is_current_week,
+        "is_archived_week": archive_cutoff is not None and week_start < archive_cutoff,
         "current_time_top": current_time_top,
         "plans": all_plans,
-        "selected_plan_ids": plan_ids or [p.id for p in all_plans],  # Default: show all
+        "selected_plan_ids": selected_plan_ids,
         "plan_colors": PLAN_COLORS,
     }
 
 
+def publish_change(
+    request: Request,
+    kind: str,
+    week_start: date | None = None,
+    plan_id: int | None = None,
+    entry_id: int | None = None,
+) -> None:
+    """Notify live subscribers (other tabs and devices) about a committed change."""
+    broker.publish(ChangeEvent(
+        kind, week_start, plan_id, entry_id, request.headers.get("X-Client-Id"), db.current_tenant.get(),
+    ))
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether If-None-Match names `etag`, compared weakly as RFC 9110 asks for GET."""
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return bare in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+
+def schedule_etag(session: Session, week_start: date, plan_ids: list[int] | None) -> str:
+    """Validator for a rendered week: the change log revision, the day and the template.
+
+    The current week also varies by minute, because it draws the current time line.
+    """
+    now = datetime.now()
+    parts = [
+        current_revision(session),
+        week_start,
+        ",".join(str(p) for p in sorted(plan_ids or [])),
+        now.date(),
+        fingerprint("partials/schedule.html", TEMPLATES_DIR),
+    ]
+    if get_week_start(now.date()) == week_start:
+        parts.append(now.hour * 60 + now.minute)
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode()).hexdigest()[:16]
+    # Weak: the compression middleware may re-encode the body
+    return f'W/"week-{digest}"'
+
+
 def parse_plan_ids(plans_param: str | None) -> list[int] | None:
     """Parse comma-separated plan IDs from query param."""
     if not plans_param:
@@ -250,6 +300,45 @@ def parse_plan_ids(plans_param: str | None) -> list[int] | None:
         return None
 
 
+def parse_id_filter(param: str | None, name: str) -> list[int] | None:
+    """Parse comma-separated ids of a filter; unlike parse_plan_ids, malformed input is a 400, not "all"."""
+    if not param:
+        return None
+    try:
+        return [int(p.strip()) for p in param.split(",") if p.strip()]
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}") from exc
+
+
+def parse_week(week_param: str) -> date:
+    """Parse an ISO date into the Monday of its week, rejecting invalid input."""
+    try:
+        return get_week_start(date.fromisoformat(week_param.strip()))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="Invalid week") from exc
+
+
+def parse_date_range(start: str, end: str) -> tuple[date, date]:
+    """Parse an inclusive ISO date range, rejecting reversed or overly long ones."""
+    try:
+        range_start = date.fromisoformat(start)
+        range_end = date.fromisoformat(end)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="Invalid date") from exc
+    if range_end < range_start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    if (range_end - range_start).days >= API_MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range longer than {API_MAX_RANGE_DAYS} days")
+    return range_start, range_end
+
+
+def parse_week_list(weeks_param: str | None) -> list[date]:
+    """Parse comma-separated ISO dates into the Mondays of their weeks."""
+    if not weeks_param:
+        return []
+    return [parse_week(w) for w in weeks_param.split(",") if w.strip()]
+
+
 @app.get("/", response_class=HTMLResponse)
 def index(
     request: Request,
@@ -289,9 +378,67 @@ def get_schedule(
         week_start = get_week_start(date.today())
     
     plan_ids = parse_plan_ids(plans)
+    # Cached and prefetched weeks in the client revalidate here without a render
+    etag = schedule_etag(session, week_start, plan_ids)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
     ctx = _schedule_data(session, week_start, plan_ids)
     ctx["request"] = request
-    return templates.TemplateResponse("partials/schedule.html", ctx)
+    return templates.TemplateResponse("partials/schedule.html", ctx, headers=headers)
+
+
+@app.get("/sw.js")
+def service_worker():
+    """The service worker, served from the root so its scope covers the whole app."""
+    return FileResponse(
+        STATIC_DIR / "js" / "sw.js",
+        media_type="application/javascript",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.get("/events")
+async def schedule_events(
+    request: Request,
+    week: str | None = Query(default=None),
+    plans: str | None = Query(default=None),
+):
+    """Server-Sent Events stream of changes affecting one week and plan selection."""
+    week_start = parse_week(week) if week else None
+    subscription = broker.subscribe(week_start, parse_plan_ids(plans), db.current_tenant.get())
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: change\ndata: {event.to_json()}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/sync")
+def sync_changes(
+    response: Response,
+    since: int = Query(default=0, ge=0),
+    session: Session = Depends(get_session),
+):
+    """Rows created, changed or deleted after revision `since`, collapsed per row."""
+    payload = changes_since(session, since)
+    response.headers["ETag"] = f'"rev-{payload["rev"]}"'
+    response.headers["Cache-Control"] = "no-cache"
+    return payload
 
 
 @app.post("/blocks", response_class=HTMLResponse)
@@ -311,6 +458,7 @@ def create_block(
     session.add(block)
     session.commit()
     session.refresh(block)
+    publish_change(request, "block")
     
     week_start = get_week_start(date.today())
     ctx = _schedule_data(session, week_start)
@@ -337,6 +485,7 @@ def delete_block(
             session.delete(entry)
         session.delete(block)
         session.commit()
+        publish_change(request, "block")
     
     week_start = get_week_start(date.today())
     ctx = _schedule_data(session, week_start)
@@ -389,6 +538,7 @@ def create_entry(
     )
     session.add(entry)
     session.commit()
+    publish_change(request, "entry", week_start, plan_id, entry.id)
 
     plan_ids = parse_plan_ids(selected_plans)
     ctx = _schedule_data(session, week_start, plan_ids)
@@ -459,6 +609,7 @@ def create_quick_task(
     )
     session.add(entry)
     session.commit()
+    publish_change(request, "entry", week_start, plan_id, entry.id)
 
     plan_ids = parse_plan_ids(selected_plans)
     ctx = _schedule_data(session, week_start, plan_ids)
@@ -497,6 +648,7 @@ def save_entry_note(
     entry.note = clean_note
     session.add(entry)
     session.commit()
+    publish_change(request, "entry", entry.week_start, entry.plan_id, entry.id)
 
     week_start = entry.week_start
     plan_ids = parse_plan_ids(selected_plans)
@@ -534,6 +686,7 @@ def move_entry(
     entry.duration_minutes = duration_clamped
     session.add(entry)
     session.commit()
+    publish_change(request, "entry", entry.week_start, entry.plan_id, entry.id)
 
     plan_ids = parse_plan_ids(selected_plans)
     ctx = _schedule_data(session, entry.week_start, plan_ids)
@@ -551,8 +704,10 @@ def delete_entry(
     entry = session.get(ScheduleEntry, entry_id)
     week_start = entry.week_start if entry else get_week_start(date.today())
     if entry:
+        plan_id = entry.plan_id
         session.delete(entry)
         session.commit()
+        publish_change(request, "entry", week_start, plan_id, entry_id)
     plan_ids = parse_plan_ids(plans)
     ctx = _schedule_data(session, week_start, plan_ids)
     ctx["request"] = request
@@ -630,7 +785,10 @@ def create_recurring_task(
         plan_id=plan_id,
     )
     session.add(task)
+    session.flush()
+    refresh_task_instances(session, task.id)
     session.commit()
+    publish_change(request, "recurring", plan_id=plan_id)
     
     try:
         week_start = date.fromisoformat(week) if week else get_week_start(date.today())
@@ -663,8 +821,11 @@ def delete_recurring_task(
         ).all()
         for ex in exceptions:
             session.delete(ex)
+        plan_id = task.plan_id
         session.delete(task)
+        refresh_task_instances(session, task_id)
         session.commit()
+        publish_change(request, "recurring", plan_id=plan_id)
     
     try:
         week_start = date.fromisoformat(week) if week else get_week_start(date.today())
@@ -733,7 +894,9 @@ def create_recurring_exception(
         )
         session.add(exception)
     
+    refresh_task_instances(session, task_id, exc_date)
     session.commit()
+    publish_change(request, "recurring", get_week_start(exc_date), task.plan_id)
     
     try:
         week_start = date.fromisoformat(week) if week else get_week_start(date.today())
@@ -794,7 +957,9 @@ def move_all_recurring_instances(
         except ValueError:
             pass
     
+    refresh_task_instances(session, task_id)
     session.commit()
+    publish_change(request, "recurring", plan_id=task.plan_id)
     
     try:
         week_start = date.fromisoformat(week) if week else get_week_start(date.today())
@@ -849,6 +1014,7 @@ def save_recurring_task_note(
     task.note = (note or "").strip() or None
     session.add(task)
     session.commit()
+    publish_change(request, "recurring", plan_id=task.plan_id)
     
     try:
         week_start = date.fromisoformat(week) if week else get_week_start(date.today())
@@ -864,203 +1030,392 @@ def save_recurring_task_note(
     return response
 
 
+# ─────────────────────────── WEEK COPY / TEMPLATES ───────────────────────────
+
+@app.post("/weeks/copy", response_class=HTMLResponse)
+def copy_week(
+    request: Request,
+    source_week: Annotated[str, Form(...)],
+    target_week: Annotated[str, Form(...)],
+    weeks: Annotated[int, Form(...)] = 1,
+    plans: Annotated[str | None, Form(...)] = None,
+    block_types: Annotated[str | None, Form(...)] = None,
+    conflict: Annotated[str, Form(...)] = "skip",
+    selected_plans: Annotated[str | None, Form(...)] = None,
+    session: Session = Depends(get_session),
+):
+    """Copy one or more consecutive weeks of blocks onto another week in one statement per week."""
+    if conflict not in CONFLICT_POLICIES:
+        raise HTTPException(status_code=400, detail="Invalid conflict policy")
+    source_start = parse_week(source_week)
+    target_start = parse_week(target_week)
+    try:
+        copy_weeks(
+            session,
+            source_start,
+            target_start,
+            weeks=weeks,
+            plan_ids=parse_id_filter(plans, "plans"),
+            block_type_ids=parse_id_filter(block_types, "block types"),
+            conflict=conflict,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    session.commit()
+    for i in range(weeks):
+        publish_change(request, "entry", target_start + timedelta(days=7 * i))
+
+    plan_ids = parse_plan_ids(selected_plans)
+    ctx = _schedule_data(session, target_start, plan_ids)
+    ctx["request"] = request
+    if request.headers.get("HX-Request"):
+        return templates.TemplateResponse("partials/schedule.html", ctx)
+    return templates.TemplateResponse("index.html", ctx)
+
+
+@app.get("/templates")
+def list_week_templates(session: Session = Depends(get_session)):
+    """List saved week templates."""
+    return [
+        {"id": t.id, "name": t.name, "entries": len(t.entries), "created_at": t.created_at.isoformat()}
+        for t in session.exec(select(WeekTemplate).order_by(WeekTemplate.name)).all()
+    ]
+
+
+@app.post("/templates")
+def create_week_template(
+    name: Annotated[str, Form(...)],
+    week: Annotated[str, Form(...)],
+    plans: Annotated[str | None, Form(...)] = None,
+    block_types: Annotated[str | None, Form(...)] = None,
+    session: Session = Depends(get_session),
+):
+    """Save the blocks of a week as a reusable template."""
+    clean_name = name.strip()
+    if not clean_name:
+        raise HTTPException(status_code=400, detail="Name required")
+    week_start = parse_week(week)
+    template = save_week_template(
+        session,
+        clean_name,
+        week_start,
+        plan_ids=parse_id_filter(plans, "plans"),
+        block_type_ids=parse_id_filter(block_types, "block types"),
+    )
+    session.commit()
+    session.refresh(template)
+    return {"id": template.id, "name": template.name, "entries": len(template.entries)}
+
+
+@app.post("/templates/{template_id}/apply")
+def apply_template(
+    request: Request,
+    template_id: int,
+    weeks: Annotated[str, Form(...)],
+    conflict: Annotated[str, Form(...)] = "skip",
+    session: Session = Depends(get_session),
+):
+    """Stamp a template onto any number of weeks (comma-separated ISO dates)."""
+    if not session.get(WeekTemplate, template_id):
+        raise HTTPException(status_code=404, detail="Template not found")
+    if conflict not in CONFLICT_POLICIES:
+        raise HTTPException(status_code=400, detail="Invalid conflict policy")
+    target_weeks = list(dict.fromkeys(parse_week_list(weeks)))
+    if not target_weeks:
+        raise HTTPException(status_code=400, detail="No target weeks")
+    if len(target_weeks) > MAX_WEEKS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_WEEKS} target weeks")
+    created = apply_week_template(session, template_id, target_weeks, conflict=conflict)
+    session.commit()
+    for week_start in target_weeks:
+        publish_change(request, "entry", week_start)
+    return {"created": created, "weeks": [w.isoformat() for w in target_weeks]}
+
+
+@app.delete("/templates/{template_id}")
+def remove_week_template(template_id: int, session: Session = Depends(get_session)):
+    """Delete a week template and its blocks."""
+    if not session.get(WeekTemplate, template_id):
+        raise HTTPException(status_code=404, detail="Template not found")
+    delete_week_template(session, template_id)
+    session.commit()
+    return {"deleted": template_id}
+
+
+# ─────────────────────────── JSON API ────────────────────────────────────────
+
+def _api_schedule(session: Session, start: date, end: date, plan_ids: list[int] | None) -> FastJSONResponse:
+    """Columnar schedule payload for `start`..`end`, tagged with the change log revision."""
+    rev = current_revision(session)
+    payload = {
+        "start": start,
+        "end": end,
+        "rev": rev,
+        "block_types": block_type_table(session.exec(select(BlockType).order_by(BlockType.id)).all()),
+        "plans": plan_table(session.exec(select(Plan).order_by(Plan.id)).all()),
+        "entries": entry_columns(entries_in_range(session, start, end, plan_ids)),
+        "recurring": recurring_columns(instances_in_range(session, start, end, plan_ids)),
+    }
+    return FastJSONResponse(payload, headers={"ETag": f'"rev-{rev}"', "Cache-Control": "no-cache"})
+
+
+@app.get("/api/weeks/{week_start}")
+def api_week(
+    week_start: str,
+    plans: str | None = Query(default=None),
+    session: Session = Depends(get_session),
+):
+    """One week of entries and recurring instances as columnar JSON."""
+    start = parse_week(week_start)
+    return _api_schedule(session, start, start + timedelta(days=6), parse_plan_ids(plans))
+
+
+@app.get("/api/range")
+def api_range(
+    start: str,
+    end: str,
+    plans: str | None = Query(default=None),
+    session: Session = Depends(get_session),
+):
+    """Entries and recurring instances between two ISO dates (inclusive) as columnar JSON."""
+    range_start, range_end = parse_date_range(start, end)
+    return _api_schedule(session, range_start, range_end, parse_plan_ids(plans))
+
+
+@app.get("/stats")
+def schedule_stats(
+    start: str,
+    end: str,
+    plans: str | None = Query(default=None),
+    session: Session = Depends(get_session),
+):
+    """Minutes per block type, plan, day period and weekday between two ISO dates (inclusive)."""
+    range_start, range_end = parse_date_range(start, end)
+    return FastJSONResponse(time_stats(session, range_start, range_end, parse_plan_ids(plans)))
+
+
+@app.get("/search")
+def search_schedule(
+    q: str = Query(default=""),
+    page: int = Query(default=1, ge=1),
+    per_page: int = Query(default=20, ge=1, le=100),
+    session: Session = Depends(get_session),
+):
+    """Ranked full-text matches in entry and recurring task titles and notes."""
+    payload = search(session, q, limit=per_page, offset=(page - 1) * per_page)
+    payload["page"] = page
+    return FastJSONResponse(payload)
+
+
 # ─────────────────────────── EXPORT / IMPORT ─────────────────────────────────
 
+def _export_range(start: str | None, end: str | None) -> tuple[date | None, date | None]:
+    try:
+        return (date.fromisoformat(start) if start else None, date.fromisoformat(end) if end else None)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="Invalid date") from exc
+
+
+def _export_filename() -> str:
+    return f"planner_export_{date.today().isoformat()}.zip"
+
+
 @app.get("/export/csv")
-def export_csv(session: Session = Depends(get_session)):
-    """Export all data to a ZIP containing multiple CSV files."""
-    import zipfile
-    
+def export_csv(
+    start: str | None = Query(default=None),
+    end: str | None = Query(default=None),
+    session: Session = Depends(get_session),
+):
+    """Export all data to a ZIP containing multiple CSV files, in the request.
+
+    `start`/`end` (ISO dates) limit the exported schedule entries to a date range.
+    Large exports should use POST /export/csv, which runs as a background job.
+    """
+    range_start, range_end = _export_range(start, end)
     output = io.BytesIO()
-    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as zf:
-        # Plans
-        plan_csv = io.StringIO()
-        writer = csv.writer(plan_csv)
-        writer.writerow(["id", "name", "color", "created_at"])
-        for p in session.exec(select(Plan)).all():
-            writer.writerow([p.id, p.name, p.color, p.created_at.isoformat()])
-        zf.writestr("plans.csv", plan_csv.getvalue())
-        
-        # Block Types
-        block_csv = io.StringIO()
-        writer = csv.writer(block_csv)
-        writer.writerow(["id", "name", "color", "icon", "duration_minutes", "is_quick_template", "created_at"])
-        for bt in session.exec(select(BlockType)).all():
-            writer.writerow([bt.id, bt.name, bt.color, bt.icon, bt.duration_minutes, bt.is_quick_template, bt.created_at.isoformat()])
-        zf.writestr("block_types.csv", block_csv.getvalue())
-        
-        # Schedule Entries
-        entry_csv = io.StringIO()
-        writer = csv.writer(entry_csv)
-        writer.writerow(["id", "week_start", "day", "start_minute", "duration_minutes", "note", "block_type_id", "plan_id", "custom_title", "is_quick", "created_at"])
-        for e in session.exec(select(ScheduleEntry)).all():
-            writer.writerow([e.id, e.week_start.isoformat(), e.day, e.start_minute, e.duration_minutes, e.note or "", e.block_type_id, e.plan_id or "", e.custom_title or "", e.is_quick, e.created_at.isoformat()])
-        zf.writestr("schedule_entries.csv", entry_csv.getvalue())
-        
-        # Recurring Tasks
-        rec_csv = io.StringIO()
-        writer = csv.writer(rec_csv)
-        writer.writerow(["id", "title", "note", "block_type_id", "plan_id", "pattern", "interval", "day_of_week", "day_of_month", "start_minute", "duration_minutes", "start_date", "end_date", "created_at"])
-        for rt in session.exec(select(RecurringTask)).all():
-            writer.writerow([rt.id, rt.title, rt.note or "", rt.block_type_id, rt.plan_id or "", rt.pattern, rt.interval, rt.day_of_week, rt.day_of_month, rt.start_minute, rt.duration_minutes, rt.start_date.isoformat(), rt.end_date.isoformat() if rt.end_date else "", rt.created_at.isoformat()])
-        zf.writestr("recurring_tasks.csv", rec_csv.getvalue())
-        
-        # Recurring Exceptions
-        exc_csv = io.StringIO()
-        writer = csv.writer(exc_csv)
-        writer.writerow(["id", "recurring_task_id", "exception_date", "exception_type", "new_day", "new_start_minute", "new_duration_minutes", "created_at"])
-        for ex in session.exec(select(RecurringException)).all():
-            writer.writerow([ex.id, ex.recurring_task_id, ex.exception_date.isoformat(), ex.exception_type, ex.new_day or "", ex.new_start_minute or "", ex.new_duration_minutes or "", ex.created_at.isoformat()])
-        zf.writestr("recurring_exceptions.csv", exc_csv.getvalue())
-    
+    export_archive(session, output, range_start, range_end)
     output.seek(0)
-    filename = f"planner_export_{date.today().isoformat()}.zip"
     return StreamingResponse(
         output,
         media_type="application/zip",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+        headers={"Content-Disposition": f"attachment; filename={_export_filename()}"}
     )
 
 
-@app.post("/import/csv")
+@app.post("/export/csv", status_code=202)
+def start_export_job(
+    start: str | None = Form(default=None),
+    end: str | None = Form(default=None),
+):
+    """Write the export archive to disk in a background job; poll /jobs/{id} for the download."""
+    range_start, range_end = _export_range(start, end)
+
+    def work(session: Session, job_id: int, progress) -> str:
+        path = job_path(f"export-{job_id}.zip")
+        with open(path + ".part", "wb") as fileobj:
+            export_archive(session, fileobj, range_start, range_end, progress)
+        os.replace(path + ".part", path)
+        return path
+
+    job = jobs.runner.submit("export", work)
+    return job_view(job, jobs.runner)
+
+
+@app.post("/import/csv", status_code=202)
 async def import_csv(
     request: Request,
     file: UploadFile = File(...),
-    session: Session = Depends(get_session),
 ):
-    """Import data from a ZIP file containing CSV files. Replaces all existing data."""
-    import zipfile
-    
+    """Import data from a ZIP file containing CSV files. Replaces all existing data.
+
+    The upload is spooled to disk and imported by a background job; poll
+    /jobs/{id} for progress.
+    """
     if not file.filename.endswith(".zip"):
         raise HTTPException(status_code=400, detail="Please upload a .zip file")
-    
-    contents = await file.read()
+
+    upload_path = job_path(f"upload-{uuid.uuid4().hex}.zip")
+    with open(upload_path, "wb") as out:
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            out.write(chunk)
     try:
-        zf = zipfile.ZipFile(io.BytesIO(contents))
-    except zipfile.BadZipFile:
-        raise HTTPException(status_code=400, detail="Invalid ZIP file")
-    
-    # Delete all existing data (order matters due to foreign keys)
-    for ex in session.exec(select(RecurringException)).all():
-        session.delete(ex)
-    for rt in session.exec(select(RecurringTask)).all():
-        session.delete(rt)
-    for e in session.exec(select(ScheduleEntry)).all():
-        session.delete(e)
-    for bt in session.exec(select(BlockType)).all():
-        session.delete(bt)
-    for p in session.exec(select(Plan)).all():
-        session.delete(p)
-    session.commit()
-    
-    # Import Plans first
-    if "plans.csv" in zf.namelist():
-        reader = csv.DictReader(io.StringIO(zf.read("plans.csv").decode("utf-8")))
-        for row in reader:
-            p = Plan(
-                id=int(row["id"]),
-                name=row["name"],
-                color=row["color"],
-                created_at=datetime.fromisoformat(row["created_at"]),
-            )
-            session.add(p)
-        session.commit()
-    
-    # Import Block Types
-    if "block_types.csv" in zf.namelist():
-        reader = csv.DictReader(io.StringIO(zf.read("block_types.csv").decode("utf-8")))
-        for row in reader:
-            bt = BlockType(
-                id=int(row["id"]),
-                name=row["name"],
-                color=row["color"],
-                icon=row["icon"],
-                duration_minutes=int(row["duration_minutes"]),
-                is_quick_template=row["is_quick_template"].lower() == "true",
-                created_at=datetime.fromisoformat(row["created_at"]),
-            )
-            session.add(bt)
-        session.commit()
-    
-    # Import Schedule Entries
-    if "schedule_entries.csv" in zf.namelist():
-        reader = csv.DictReader(io.StringIO(zf.read("schedule_entries.csv").decode("utf-8")))
-        for row in reader:
-            entry = ScheduleEntry(
-                id=int(row["id"]),
-                week_start=date.fromisoformat(row["week_start"]),
-                day=row["day"],
-                start_minute=int(row["start_minute"]),
-                duration_minutes=int(row["duration_minutes"]),
-                note=row["note"] or None,
-                block_type_id=int(row["block_type_id"]),
-                plan_id=int(row["plan_id"]) if row.get("plan_id") else None,
-                custom_title=row["custom_title"] or None,
-                is_quick=row["is_quick"].lower() == "true",
-                created_at=datetime.fromisoformat(row["created_at"]),
-            )
-            session.add(entry)
-        session.commit()
-    
-    # Import Recurring Tasks
-    if "recurring_tasks.csv" in zf.namelist():
-        reader = csv.DictReader(io.StringIO(zf.read("recurring_tasks.csv").decode("utf-8")))
-        for row in reader:
-            rt = RecurringTask(
-                id=int(row["id"]),
-                title=row["title"],
-                note=row["note"] or None,
-                block_type_id=int(row["block_type_id"]),
-                plan_id=int(row["plan_id"]) if row.get("plan_id") else None,
-                pattern=row["pattern"],
-                interval=int(row["interval"]),
-                day_of_week=int(row["day_of_week"]) if row["day_of_week"] else None,
-                day_of_month=int(row["day_of_month"]) if row["day_of_month"] else None,
-                start_minute=int(row["start_minute"]),
-                duration_minutes=int(row["duration_minutes"]),
-                start_date=date.fromisoformat(row["start_date"]),
-                end_date=date.fromisoformat(row["end_date"]) if row["end_date"] else None,
-                created_at=datetime.fromisoformat(row["created_at"]),
-            )
-            session.add(rt)
-        session.commit()
-    
-    # Import Recurring Exceptions
-    if "recurring_exceptions.csv" in zf.namelist():
-        reader = csv.DictReader(io.StringIO(zf.read("recurring_exceptions.csv").decode("utf-8")))
-        for row in reader:
-            ex = RecurringException(
-                id=int(row["id"]),
-                recurring_task_id=int(row["recurring_task_id"]),
-                exception_date=date.fromisoformat(row["exception_date"]),
-                exception_type=row["exception_type"],
-                new_day=row["new_day"] or None,
-                new_start_minute=int(row["new_start_minute"]) if row["new_start_minute"] else None,
-                new_duration_minutes=int(row["new_duration_minutes"]) if row["new_duration_minutes"] else None,
-                created_at=datetime.fromisoformat(row["created_at"]),
-            )
-            session.add(ex)
+        validate_archive(upload_path)
+    except ValueError as exc:
+        os.remove(upload_path)
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+    origin = request.headers.get("X-Client-Id")
+    tenant = db.current_tenant.get()
+
+    def work(session: Session, job_id: int, progress) -> None:
+        try:
+            import_archive(session, upload_path, progress)
+            session.commit()
+        finally:
+            os.remove(upload_path)
+        # The import replaced everything, archived weeks included
+        clear_archive()
+        ensure_quick_block(session)
+        ensure_default_plan(session)
+        ensure_horizon(session, rebuild=True)
         session.commit()
-    
-    # Ensure quick block exists
-    ensure_quick_block(session)
-    ensure_default_plan(session)
-    
-    # Redirect to home
-    week_start = get_week_start(date.today())
-    ctx = _schedule_data(session, week_start)
-    ctx["request"] = request
-    ctx.update({
-        "duration_options": DURATION_OPTIONS,
-        "icon_choices": ICON_CHOICES,
-    })
-    # Return full page refresh notice
-    return HTMLResponse(
-        content='<html><head><meta http-equiv="refresh" content="0;url=/"></head><body>Import successful! Redirecting...</body></html>',
-        status_code=200
+        broker.publish(ChangeEvent("import", origin=origin, tenant=tenant))
+
+    job = await asyncio.to_thread(jobs.runner.submit, "import", work)
+    return job_view(job, jobs.runner)
+
+
+@app.get("/backup")
+def download_backup(compress: bool = Query(default=True)):
+    """Consistent snapshot of the whole SQLite database, gzip-compressed by default."""
+    if db.get_engine().dialect.name != "sqlite":
+        raise HTTPException(status_code=400, detail="Backups are only supported for SQLite databases")
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    filename = f"planner-{stamp}.db" + (".gz" if compress else "")
+    return StreamingResponse(
+        backup_stream(compress),
+        media_type="application/gzip" if compress else "application/vnd.sqlite3",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
     )
 
 
+@app.post("/backup/restore")
+async def restore_database(request: Request, file: UploadFile = File(...)):
+    """Replace the database with a snapshot from GET /backup (plain or gzipped)."""
+    upload_path = job_path(f"restore-{uuid.uuid4().hex}.db")
+    with open(upload_path, "wb") as out:
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            out.write(chunk)
+
+    def restore() -> int:
+        restore_backup(upload_path)
+        with Session(db.get_engine()) as session:
+            ensure_horizon(session, rebuild=True)
+            session.commit()
+            return current_revision(session)
+
+    try:
+        revision = await asyncio.to_thread(restore)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    finally:
+        os.remove(upload_path)
+    publish_change(request, "import")
+    # Sync clients from before the restore get a reset on their next /sync
+    return {"restored": True, "revision": revision}
+
+
+# ─────────────────────────── JOBS ────────────────────────────────────────────
+
+def _get_job(session: Session, job_id: int) -> Job:
+    job = session.get(Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: int, session: Session = Depends(get_session)):
+    """Status and rows processed per table of a background import or export."""
+    return job_view(_get_job(session, job_id), jobs.runner)
+
+
+@app.get("/jobs/{job_id}/download")
+def download_job_result(job_id: int, session: Session = Depends(get_session)):
+    job = _get_job(session, job_id)
+    if job.status != "done" or not job.result_path or not os.path.isfile(job.result_path):
+        raise HTTPException(status_code=404, detail="No download for this job")
+    return FileResponse(job.result_path, media_type="application/zip", filename=_export_filename())
+
+
+# ─────────────────────────── PROFILING ───────────────────────────────────────
+
+@app.get("/profiles", dependencies=[Depends(require_profile_token)])
+def list_profiles():
+    """Stored profile reports, newest first."""
+    directory = Path(profiling.PROFILE_DIR)
+    paths = sorted(directory.glob("*.*"), key=lambda p: p.stat().st_mtime, reverse=True) if directory.is_dir() else []
+    return [
+        {"name": p.name, "bytes": p.stat().st_size, "url": f"/profiles/{p.name}"}
+        for p in paths if profiling.REPORT_NAME.match(p.name)
+    ]
+
+
+@app.get("/profiles/{name}", dependencies=[Depends(require_profile_token)])
+def get_profile(name: str):
+    """A folded-stack report (or the aggregate timings), ready for flamegraph tools."""
+    path = Path(profiling.PROFILE_DIR) / name
+    if not profiling.REPORT_NAME.match(name) or not path.is_file():
+        raise HTTPException(status_code=404, detail="Report not found")
+    media_type = "application/json" if name.endswith(".json") else "text/plain; charset=utf-8"
+    return FileResponse(path, media_type=media_type)
+
+
+# ─────────────────────────── DIAGNOSTICS ─────────────────────────────────────
+
+@app.get("/diagnostics/memory", dependencies=[Depends(require_diagnostics_token)])
+def get_memory_report(
+    top: int = Query(default=15, ge=1, le=100),
+    group_by: str = Query(default="lineno"),
+):
+    """RSS, tracemalloc top sites and growth, identity maps, cache sizes and object counts."""
+    if group_by not in GROUPINGS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(GROUPINGS)}")
+    return memory_report(top, group_by, caches={"templates": templates.env.cache._mapping})
+
+
+@app.post("/diagnostics/memory/tracing", dependencies=[Depends(require_diagnostics_token)])
+def start_memory_tracing(frames: int = Query(default=1, ge=1, le=50)):
+    """Start tracemalloc in this worker without a restart."""
+    return {"tracing": start_tracing(frames)}
+
+
+@app.delete("/diagnostics/memory/tracing", dependencies=[Depends(require_diagnostics_token)])
+def stop_memory_tracing():
+    stop_tracing()
+    return {"tracing": False}
+
+
 # ─────────────────────────── PLANS MANAGEMENT ────────────────────────────────
 
 @app.get("/plans", response_class=HTMLResponse)
@@ -1092,6 +1447,7 @@ def create_plan(
     plan = Plan(name=clean_name, color=color)
     session.add(plan)
     session.commit()
+    publish_change(request, "plan")
     
     plans = session.exec(select(Plan).order_by(Plan.name)).all()
     response = templates.TemplateResponse("partials/plans_list.html", {
@@ -1127,9 +1483,11 @@ def delete_plan(
         for exc in session.exec(select(RecurringException).where(RecurringException.recurring_task_id == task.id)).all():
             session.delete(exc)
         session.delete(task)
+        refresh_task_instances(session, task.id)
     
     session.delete(plan)
     session.commit()
+    publish_change(request, "plan")
     
     plans = session.exec(select(Plan).order_by(Plan.name)).all()
     response = templates.TemplateResponse("partials/plans_list.html", {
@@ -1141,6 +1499,31 @@ def delete_plan(
     return response
 
 
+@app.get("/plans/{plan_id}/calendar.ics")
+def plan_calendar_feed(request: Request, plan_id: int, session: Session = Depends(get_session)):
+    """Subscribable iCalendar feed of a plan, answering unchanged polls with 304."""
+    if not session.get(Plan, plan_id):
+        raise HTTPException(status_code=404, detail="Plan not found")
+
+    etag, changed_at = feed_validators(session, plan_id)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    last_modified = changed_at.replace(microsecond=0, tzinfo=timezone.utc) if changed_at else None
+    if last_modified:
+        headers["Last-Modified"] = format_http_date(last_modified, usegmt=True)
+
+    if request.headers.get("If-None-Match"):
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+    elif last_modified and request.headers.get("If-Modified-Since"):
+        try:
+            if last_modified <= parse_http_date(request.headers["If-Modified-Since"]):
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+
+    return StreamingResponse(plan_calendar(plan_id), media_type="text/calendar; charset=utf-8", headers=headers)
+
+
 @app.patch("/plans/{plan_id}", response_class=HTMLResponse)
 def update_plan(
     request: Request,
@@ -1163,6 +1546,7 @@ def update_plan(
     
     session.add(plan)
     session.commit()
+    publish_change(request, "plan")
     
     plans = session.exec(select(Plan).order_by(Plan.name)).all()
     response = templates.TemplateResponse("partials/plans_list.html", {
@@ -1,7 +1,10 @@
 from datetime import datetime, date
 from typing import Optional, List
+from sqlalchemy import Index, UniqueConstraint, event
 from sqlmodel import SQLModel, Field, Relationship
 
+from .dates import entry_date_for, epoch_minutes
+
 
 class Plan(SQLModel, table=True):
     """A plan represents a separate schedule (e.g., Work, Family, Personal)."""
@@ -28,6 +31,8 @@ class BlockType(SQLModel, table=True):
 
 
 class ScheduleEntry(SQLModel, table=True):
+    # Ids of archived rows must not be handed out again (see archive.py)
+    __table_args__ = ({"sqlite_autoincrement": True},)
     id: Optional[int] = Field(default=None, primary_key=True)
     week_start: date = Field(index=True)  # Monday of the week
     day: str = Field(index=True)
@@ -40,10 +45,21 @@ class ScheduleEntry(SQLModel, table=True):
     custom_title: Optional[str] = Field(default=None, max_length=80)
     is_quick: bool = Field(default=False)
 
+    # Absolute position derived from week_start + day, kept in sync on every flush
+    entry_date: Optional[date] = Field(default=None, index=True)
+    start_at: Optional[int] = Field(default=None, index=True)  # minutes since 1970-01-01
+
     block_type: Optional[BlockType] = Relationship(back_populates="entries")
     plan: Optional[Plan] = Relationship(back_populates="entries")
 
 
+@event.listens_for(ScheduleEntry, "before_insert")
+@event.listens_for(ScheduleEntry, "before_update")
+def _sync_entry_date(mapper, connection, target: ScheduleEntry) -> None:
+    target.entry_date = entry_date_for(target.week_start, target.day)
+    target.start_at = epoch_minutes(target.entry_date, target.start_minute) if target.entry_date else None
+
+
 class RecurringTask(SQLModel, table=True):
     """A recurring task template that generates instances on matching days."""
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -77,6 +93,7 @@ class RecurringTask(SQLModel, table=True):
 
 class RecurringException(SQLModel, table=True):
     """Tracks exceptions (deletions or modifications) to recurring task instances."""
+    __table_args__ = ({"sqlite_autoincrement": True},)
     id: Optional[int] = Field(default=None, primary_key=True)
     recurring_task_id: int = Field(foreign_key="recurringtask.id", index=True)
     
@@ -93,4 +110,95 @@ class RecurringException(SQLModel, table=True):
     
     created_at: datetime = Field(default_factory=datetime.utcnow)
     
-    recurring_task: Optional[RecurringTask] = Relationship(back_populates="exceptions")
\ No newline at end of file
+    recurring_task: Optional[RecurringTask] = Relationship(back_populates="exceptions")
+
+class RecurringInstance(SQLModel, table=True):
+    """A materialized occurrence of a recurring task inside the rolling horizon."""
+    __table_args__ = (
+        UniqueConstraint("recurring_task_id", "instance_date"),
+        Index("ix_recurringinstance_week_plan", "week_start", "plan_id"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    recurring_task_id: int = Field(foreign_key="recurringtask.id", index=True)
+    # The date the recurrence produced; modifications may move it to another day of the same week
+    instance_date: date
+    week_start: date
+    day: str = Field(max_length=16)
+    start_minute: int
+    duration_minutes: int
+    plan_id: Optional[int] = Field(default=None)
+
+
+class RecurringHorizon(SQLModel, table=True):
+    """Date range currently covered by the recurringinstance table (a single row)."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    start_date: date
+    end_date: date
+
+
+class ChangeNotification(SQLModel, table=True):
+    """A published change event, used to fan events out across worker processes."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    payload: str
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+
+class ChangeLog(SQLModel, table=True):
+    """One insert/update/delete of a synced row, written by SQLite triggers.
+
+    `rev` only ever grows, so clients can ask for everything after the last
+    revision they saw.
+    """
+    __table_args__ = ({"sqlite_autoincrement": True},)
+    rev: Optional[int] = Field(default=None, primary_key=True)
+    table_name: str = Field(max_length=32)
+    row_id: int
+    op: str = Field(max_length=8)  # "insert", "update", "delete", or "reset" after a restore
+    changed_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class Job(SQLModel, table=True):
+    """A background import or export run by the in-process job runner."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str = Field(max_length=16)  # "import" or "export"
+    status: str = Field(default="queued", max_length=16)  # queued, running, done, failed
+    progress: str = Field(default="{}")  # JSON: rows processed per table
+    error: Optional[str] = Field(default=None)
+    result_path: Optional[str] = Field(default=None)
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    finished_at: Optional[datetime] = Field(default=None)
+
+
+class IdempotencyKey(SQLModel, table=True):
+    """The recorded response to a mutation sent with an Idempotency-Key header."""
+    key: str = Field(primary_key=True, max_length=64)
+    fingerprint: str = Field(max_length=64)  # sha256 of method, path, query and body
+    status_code: Optional[int] = Field(default=None)  # None while the first request runs
+    headers: str = Field(default="[]")  # JSON: [[name, value], ...]
+    body: Optional[bytes] = Field(default=None)
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+
+class WeekTemplate(SQLModel, table=True):
+    """A saved week layout that can be stamped onto other weeks."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str = Field(max_length=80)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+    entries: List["WeekTemplateEntry"] = Relationship(back_populates="template")
+
+
+class WeekTemplateEntry(SQLModel, table=True):
+    """A block inside a week template, positioned by day and time only."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    template_id: int = Field(foreign_key="weektemplate.id", index=True)
+    day: str
+    start_minute: int = Field(ge=0, le=24 * 60)
+    duration_minutes: int = Field(default=60, ge=15, le=24 * 60)
+    note: Optional[str] = Field(default=None, max_length=255)
+    block_type_id: int = Field(foreign_key="blocktype.id")
+    plan_id: Optional[int] = Field(default=None, foreign_key="plan.id")
+    custom_title: Optional[str] = Field(default=None, max_length=80)
+    is_quick: bool = Field(default=False)
+
+    template: Optional[WeekTemplate] = Relationship(back_populates="entries")
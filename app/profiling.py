@@ -0,0 +1,211 @@
+"""
+Opt-in request profiling with a stack sampler.
+
+Two modes, both off by default:
+
+* On demand: with PLANNER_PROFILE_TOKEN set, a request carrying that token
+  (``X-Profile-Token`` header or ``?profile=<token>``) is profiled. Its report
+  is stored under PLANNER_PROFILE_DIR and named in the ``X-Profile-Report``
+  response header. Reports are read back through ``/profiles`` with the same
+  token.
+* Sampled: with PLANNER_PROFILE_SAMPLE_EVERY=N, one request in N is profiled
+  and merged into per-route totals: ``aggregate.folded`` and
+  ``aggregate.json`` (request count, total and slowest duration per route).
+
+While a request runs, a background thread samples the stacks of all threads
+every PLANNER_PROFILE_INTERVAL_MS. Only stacks that pass through planner code
+are kept, which covers sync routes that run on worker threads. Reports use the
+folded stack format (``root;caller;callee count`` per line), which
+flamegraph.pl, speedscope and inferno read directly. The sampler sees the
+whole process, so concurrent requests can appear in a report; profile a quiet
+worker for clean numbers.
+"""
+import asyncio
+import hmac
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from urllib.parse import parse_qsl
+
+from fastapi import HTTPException, Request
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import PROFILE_DIR, PROFILE_INTERVAL_MS, PROFILE_KEEP, PROFILE_SAMPLE_EVERY, PROFILE_TOKEN
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOKEN_HEADER = "x-profile-token"
+TOKEN_PARAM = "profile"
+REPORT_HEADER = "X-Profile-Report"
+REPORT_NAME = re.compile(r"^[\w.-]+\.(folded|json)$")
+AGGREGATE_NAME = "aggregate"
+# Event streams never finish, and report downloads would profile themselves
+EXCLUDED_PATHS = ("/events", "/profiles", "/static")
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    if filename.startswith(APP_DIR):
+        filename = "app/" + os.path.relpath(filename, APP_DIR)
+    elif "site-packages" in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[-1]
+    else:
+        filename = os.path.basename(filename)
+    # Semicolons and spaces separate frames and counts in the folded format
+    return f"{filename}:{code.co_qualname}".replace(";", ":").replace(" ", "_")
+
+
+class StackSampler:
+    """Counts the stacks of threads running planner code until stopped."""
+
+    def __init__(self, interval_ms: int = PROFILE_INTERVAL_MS) -> None:
+        self.interval = max(interval_ms, 1) / 1000
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="planner-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                labels = []
+                in_app = False
+                while frame is not None:
+                    labels.append(_frame_label(frame.f_code))
+                    in_app = in_app or frame.f_code.co_filename.startswith(APP_DIR)
+                    frame = frame.f_back
+                if in_app:
+                    labels.append(names.get(ident, "thread").replace(" ", "_"))
+                    self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+
+def write_folded(path: Path, stacks: Counter, root: str | None = None) -> None:
+    prefix = f"{root};" if root else ""
+    with open(path, "w") as out:
+        for stack, count in stacks.most_common():
+            out.write(f"{prefix}{stack} {count}\n")
+
+
+def prune_reports(directory: Path, keep: int = PROFILE_KEEP) -> None:
+    """Keep the newest `keep` on-demand reports."""
+    reports = sorted(
+        (p for p in directory.glob("*.folded") if not p.name.startswith(AGGREGATE_NAME)),
+        key=lambda p: p.stat().st_mtime,
+    )
+    for path in reports[:-keep] if keep else reports:
+        path.unlink(missing_ok=True)
+
+
+class ProfileAggregate:
+    """Merged stacks and timings of sampled requests, per route."""
+
+    def __init__(self) -> None:
+        self.stacks: Counter[str] = Counter()
+        self.routes: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def add(self, route: str, sampler: StackSampler, elapsed_ms: float) -> None:
+        with self._lock:
+            for stack, count in sampler.stacks.items():
+                self.stacks[f"{route};{stack}"] += count
+            stats = self.routes.setdefault(route, {"requests": 0, "total_ms": 0.0, "max_ms": 0.0, "samples": 0})
+            stats["requests"] += 1
+            stats["total_ms"] = round(stats["total_ms"] + elapsed_ms, 3)
+            stats["max_ms"] = max(stats["max_ms"], round(elapsed_ms, 3))
+            stats["samples"] += sampler.samples
+
+    def flush(self, directory: Path) -> None:
+        with self._lock:
+            directory.mkdir(parents=True, exist_ok=True)
+            write_folded(directory / f"{AGGREGATE_NAME}.folded", self.stacks)
+            (directory / f"{AGGREGATE_NAME}.json").write_text(json.dumps(self.routes, indent=2, sort_keys=True))
+
+
+def token_valid(supplied: str | None) -> bool:
+    return bool(PROFILE_TOKEN and supplied and hmac.compare_digest(supplied.encode(), PROFILE_TOKEN.encode()))
+
+
+def _supplied_token(scope: Scope) -> str | None:
+    token = Headers(scope=scope).get(TOKEN_HEADER)
+    if token:
+        return token
+    return dict(parse_qsl(scope.get("query_string", b"").decode("latin-1"))).get(TOKEN_PARAM)
+
+
+def require_profile_token(request: Request) -> None:
+    """Guard for the report routes: hidden unless profiling is on, and admin-only."""
+    if not PROFILE_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    if not token_valid(request.headers.get(TOKEN_HEADER) or request.query_params.get(TOKEN_PARAM)):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+
+
+aggregate = ProfileAggregate()
+
+
+class ProfilingMiddleware:
+    """Profile requests that carry the admin token, and one in PROFILE_SAMPLE_EVERY of all requests."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self.counter = itertools.count(1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not (PROFILE_TOKEN or PROFILE_SAMPLE_EVERY) or scope["path"].startswith(EXCLUDED_PATHS):
+            await self.app(scope, receive, send)
+            return
+        on_demand = token_valid(_supplied_token(scope))
+        sampled = not on_demand and PROFILE_SAMPLE_EVERY > 0 and next(self.counter) % PROFILE_SAMPLE_EVERY == 0
+        if not (on_demand or sampled):
+            await self.app(scope, receive, send)
+            return
+
+        directory = Path(PROFILE_DIR)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.folded"
+
+        async def send_with_report(message: Message) -> None:
+            if on_demand and message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((REPORT_HEADER.lower().encode(), f"/profiles/{name}".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        sampler = StackSampler()
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_report)
+        finally:
+            sampler.stop()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            route = scope.get("route")
+            label = f"{scope['method']}_{route.path if route else scope['path']}".replace(" ", "_")
+            await asyncio.to_thread(self._store, directory, name if on_demand else None, label, sampler, elapsed_ms)
+
+    def _store(self, directory: Path, name: str | None, label: str, sampler: StackSampler, elapsed_ms: float) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        if name:
+            write_folded(directory / name, sampler.stacks, root=label)
+            prune_reports(directory)
+        else:
+            aggregate.add(label, sampler, elapsed_ms)
+            aggregate.flush(directory)
@@ -0,0 +1,291 @@
+"""
+Recurring task expansion and the optional materialized instance horizon.
+
+Instances are normally expanded from RecurringTask + RecurringException on
+every read. With PLANNER_MATERIALIZE_RECURRING enabled, expanded instances for
+a rolling horizon around today are kept in the recurringinstance table, updated
+whenever a task or exception changes and extended as time moves on, so a week
+read becomes one indexed range query.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import date, timedelta
+
+from sqlalchemy import delete, insert, update
+from sqlmodel import Session, select
+
+from . import db
+from .archive import archived_exceptions
+from .dates import entry_date_for
+from .config import (
+    DAY_ORDER, MATERIALIZE_RECURRING, RECURRING_HORIZON_WEEKS_BACK,
+    RECURRING_HORIZON_WEEKS_FORWARD, RECURRING_REFRESH_SECONDS,
+)
+from .models import BlockType, RecurringException, RecurringHorizon, RecurringInstance, RecurringTask
+
+instance_table = RecurringInstance.__table__
+horizon_table = RecurringHorizon.__table__
+logger = logging.getLogger("uvicorn.error")
+
+
+def occurs_on(task: RecurringTask, current_date: date) -> bool:
+    """Return True if the recurrence pattern of `task` produces an instance on `current_date`."""
+    if current_date < task.start_date:
+        return False
+    if task.end_date and current_date > task.end_date:
+        return False
+    if task.pattern == "daily":
+        days_since_start = (current_date - task.start_date).days
+        return (days_since_start % task.interval) == 0
+    if task.pattern == "weekly":
+        if task.day_of_week is not None and current_date.weekday() == task.day_of_week:
+            weeks_since_start = (current_date - task.start_date).days // 7
+            return (weeks_since_start % task.interval) == 0
+        return False
+    if task.pattern == "monthly":
+        if task.day_of_month is not None and current_date.day == task.day_of_month:
+            months_since_start = (current_date.year - task.start_date.year) * 12 + (current_date.month - task.start_date.month)
+            return (months_since_start % task.interval) == 0
+    return False
+
+
+def expand_task(
+    task: RecurringTask,
+    start: date,
+    end: date,
+    exception_map: dict[date, RecurringException],
+) -> list[dict]:
+    """Expand `task` into instance positions between `start` and `end` (inclusive)."""
+    instances = []
+    current = max(start, task.start_date)
+    last = min(end, task.end_date) if task.end_date else end
+    while current <= last:
+        if occurs_on(task, current):
+            exception = exception_map.get(current)
+            if not (exception and exception.exception_type == "deleted"):
+                day_name = DAY_ORDER[current.weekday()]
+                start_minute = task.start_minute
+                duration = task.duration_minutes
+                if exception and exception.exception_type == "modified":
+                    if exception.new_day:
+                        day_name = exception.new_day
+                    if exception.new_start_minute is not None:
+                        start_minute = exception.new_start_minute
+                    if exception.new_duration_minutes is not None:
+                        duration = exception.new_duration_minutes
+                instances.append({
+                    "recurring_task_id": task.id,
+                    "instance_date": current,
+                    "week_start": current - timedelta(days=current.weekday()),
+                    "day": day_name,
+                    "start_minute": start_minute,
+                    "duration_minutes": duration,
+                    "plan_id": task.plan_id,
+                })
+        current += timedelta(days=1)
+    return instances
+
+
+def load_exceptions(session: Session, task_ids: list[int], start: date, end: date) -> dict[int, dict[date, RecurringException]]:
+    """Fetch exceptions of several tasks in a date range with one query, keyed by task then date."""
+    by_task: dict[int, dict[date, RecurringException]] = defaultdict(dict)
+    if not task_ids:
+        return by_task
+    exceptions = session.exec(
+        select(RecurringException).where(
+            RecurringException.recurring_task_id.in_(task_ids),
+            RecurringException.exception_date >= start,
+            RecurringException.exception_date <= end,
+        )
+    ).all()
+    for ex in [*archived_exceptions(session, task_ids, start, end), *exceptions]:
+        by_task[ex.recurring_task_id][ex.exception_date] = ex
+    return by_task
+
+
+def instance_view(instance: dict, task: RecurringTask, block_type: BlockType | None) -> dict:
+    """Shape an instance position into the dict the schedule templates render."""
+    return {
+        "recurring_task_id": task.id,
+        "instance_date": instance["instance_date"],
+        "entry_date": entry_date_for(instance["week_start"], instance["day"]),
+        "title": task.title,
+        "note": task.note,
+        "day": instance["day"],
+        "start_minute": instance["start_minute"],
+        "duration_minutes": instance["duration_minutes"],
+        "block_type": block_type,
+        "is_recurring": True,
+        "plan_id": task.plan_id,
+    }
+
+
+# ─────────────────────────── MATERIALIZED HORIZON ────────────────────────────
+
+def horizon_for(today: date) -> tuple[date, date]:
+    """The (first, last) day kept materialized around `today`."""
+    week_start = today - timedelta(days=today.weekday())
+    return (
+        week_start - timedelta(weeks=RECURRING_HORIZON_WEEKS_BACK),
+        week_start + timedelta(weeks=RECURRING_HORIZON_WEEKS_FORWARD, days=6),
+    )
+
+
+def _materialize(session: Session, tasks: list[RecurringTask], start: date, end: date) -> None:
+    if not tasks or start > end:
+        return
+    exceptions = load_exceptions(session, [t.id for t in tasks], start, end)
+    rows = [
+        instance
+        for task in tasks
+        for instance in expand_task(task, start, end, exceptions[task.id])
+    ]
+    if rows:
+        session.exec(insert(instance_table), params=rows)
+
+
+def ensure_horizon(session: Session, today: date | None = None, rebuild: bool = False) -> None:
+    """Bring the materialized horizon up to date, extending or trimming it incrementally.
+
+    When materialization is disabled the table is emptied, so enabling it later
+    triggers a full rebuild instead of serving stale rows. The caller commits.
+    Safe to run from several workers at once: the horizon is read under the
+    write lock, so only the first one slides it.
+    """
+    # A no-op write takes the write lock before the horizon is read
+    session.exec(update(horizon_table).where(horizon_table.c.id == 1).values(id=horizon_table.c.id))
+    horizon = session.get(RecurringHorizon, 1, populate_existing=True)
+    if not MATERIALIZE_RECURRING:
+        if horizon:
+            session.exec(delete(instance_table))
+            session.delete(horizon)
+        return
+
+    start, end = horizon_for(today or date.today())
+    if horizon is None or rebuild:
+        session.exec(delete(instance_table))
+        _materialize(session, session.exec(select(RecurringTask)).all(), start, end)
+        if horizon is None:
+            horizon = RecurringHorizon(id=1, start_date=start, end_date=end)
+    else:
+        if horizon.start_date == start and horizon.end_date == end:
+            return
+        tasks = session.exec(select(RecurringTask)).all()
+        # Trim what fell out of the window, then fill whatever is new on either side
+        session.exec(delete(instance_table).where(
+            (instance_table.c.instance_date < start) | (instance_table.c.instance_date > end)
+        ))
+        _materialize(session, tasks, start, min(end, horizon.start_date - timedelta(days=1)))
+        _materialize(session, tasks, max(start, horizon.end_date + timedelta(days=1)), end)
+    horizon.start_date = start
+    horizon.end_date = end
+    session.add(horizon)
+
+
+def refresh_task_instances(session: Session, task_id: int, instance_date: date | None = None) -> None:
+    """Re-materialize one task (or one of its dates) after the task or an exception changed.
+
+    Call after applying the change and before committing; deleted tasks simply lose their rows.
+    """
+    if not MATERIALIZE_RECURRING:
+        return
+    session.flush()
+    horizon = session.get(RecurringHorizon, 1)
+    if horizon is None:
+        return
+    start, end = horizon.start_date, horizon.end_date
+    if instance_date is not None:
+        if not (start <= instance_date <= end):
+            return
+        start = end = instance_date
+
+    session.exec(delete(instance_table).where(
+        instance_table.c.recurring_task_id == task_id,
+        instance_table.c.instance_date >= start,
+        instance_table.c.instance_date <= end,
+    ))
+    task = session.get(RecurringTask, task_id)
+    if task:
+        _materialize(session, [task], start, end)
+
+
+def materialized_instances(
+    session: Session,
+    first_week: date,
+    last_week: date,
+    plan_ids: list[int] | None = None,
+) -> list[dict] | None:
+    """Read the instances of weeks `first_week`..`last_week` from the horizon table.
+
+    Returns None if any of those weeks is not covered, so the caller can fall
+    back to expanding on the fly.
+    """
+    if not MATERIALIZE_RECURRING:
+        return None
+    horizon = session.get(RecurringHorizon, 1)
+    if horizon is None or not (horizon.start_date <= first_week and last_week + timedelta(days=6) <= horizon.end_date):
+        return None
+
+    query = (
+        select(RecurringInstance, RecurringTask, BlockType)
+        .join(RecurringTask, RecurringInstance.recurring_task_id == RecurringTask.id)
+        .join(BlockType, RecurringTask.block_type_id == BlockType.id)
+        .where(RecurringInstance.week_start >= first_week, RecurringInstance.week_start <= last_week)
+    )
+    if plan_ids is not None:
+        query = query.where(RecurringInstance.plan_id.in_(plan_ids) | (RecurringInstance.plan_id == None))
+    return [
+        instance_view(instance.model_dump(), task, block_type)
+        for instance, task, block_type in session.exec(query).all()
+    ]
+
+
+def instances_in_range(session: Session, start: date, end: date, plan_ids: list[int] | None = None) -> list[dict]:
+    """Recurring instances landing between `start` and `end` (inclusive), ready to render.
+
+    Whole weeks are expanded because a modified instance may move to another
+    day of its week; instances are then kept by the date they land on.
+    """
+    first_week = start - timedelta(days=start.weekday())
+    last_week = end - timedelta(days=end.weekday())
+    instances = materialized_instances(session, first_week, last_week, plan_ids)
+    if instances is None:
+        week_end = last_week + timedelta(days=6)
+
+        # Get all active recurring tasks
+        query = select(RecurringTask).where(
+            RecurringTask.start_date <= week_end,
+            (RecurringTask.end_date == None) | (RecurringTask.end_date >= first_week)
+        )
+
+        # Filter by plan_ids if provided
+        if plan_ids is not None:
+            query = query.where(RecurringTask.plan_id.in_(plan_ids) | (RecurringTask.plan_id == None))
+
+        recurring_tasks = session.exec(query).all()
+        exceptions = load_exceptions(session, [task.id for task in recurring_tasks], first_week, week_end)
+        instances = [
+            instance_view(instance, task, task.block_type)
+            for task in recurring_tasks
+            for instance in expand_task(task, first_week, week_end, exceptions[task.id])
+        ]
+    return [i for i in instances if i["entry_date"] and start <= i["entry_date"] <= end]
+
+
+async def refresh_horizon_periodically() -> None:
+    """Background loop that keeps the horizon moving with the calendar, for every open database."""
+    from . import tenants
+
+    while True:
+        await asyncio.sleep(RECURRING_REFRESH_SECONDS)
+        try:
+            await asyncio.to_thread(tenants.run_everywhere, _refresh_horizon_once)
+        except Exception:  # noqa: BLE001 - keep refreshing; the next run may succeed
+            logger.exception("Recurring horizon refresh failed")
+
+
+def _refresh_horizon_once() -> None:
+    with Session(db.get_engine()) as session:
+        ensure_horizon(session)
+        session.commit()
@@ -0,0 +1,178 @@
+"""
+Full-text search over entry and recurring task titles and notes.
+
+An FTS5 table, searchindex, holds one row per schedule entry and per
+recurring task. SQLite triggers keep it in sync, so bulk SQL writes are
+indexed too. Rowids encode the source row: ``2 * id`` for entries and
+``2 * id + 1`` for recurring tasks. That lets the triggers update the index
+by rowid instead of scanning it. An entry without a custom title is indexed
+under its block type name. Archived entries are indexed in the archive's own
+searchindex when they are moved (see archive.py) and searched alongside.
+"""
+import re
+from datetime import date, timedelta
+
+from sqlalchemy import text
+from sqlmodel import Session, select
+
+from .archive import archived_entries_by_id, search_archive
+from .models import BlockType, RecurringTask, ScheduleEntry
+
+ENTRY_TITLE_SQL = (
+    "COALESCE(NULLIF({row}.custom_title, ''), "
+    "(SELECT name FROM blocktype WHERE blocktype.id = {row}.block_type_id))"
+)
+
+SEARCH_COLUMNS = "title, note, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'"
+
+SEARCH_TRIGGERS = {
+    "searchindex_entry_insert": f"""
+        AFTER INSERT ON scheduleentry BEGIN
+            INSERT INTO searchindex (rowid, title, note)
+            VALUES (NEW.id * 2, {ENTRY_TITLE_SQL.format(row="NEW")}, NEW.note);
+        END""",
+    "searchindex_entry_update": f"""
+        AFTER UPDATE OF custom_title, note, block_type_id ON scheduleentry BEGIN
+            DELETE FROM searchindex WHERE rowid = OLD.id * 2;
+            INSERT INTO searchindex (rowid, title, note)
+            VALUES (NEW.id * 2, {ENTRY_TITLE_SQL.format(row="NEW")}, NEW.note);
+        END""",
+    "searchindex_entry_delete": """
+        AFTER DELETE ON scheduleentry BEGIN
+            DELETE FROM searchindex WHERE rowid = OLD.id * 2;
+        END""",
+    "searchindex_task_insert": """
+        AFTER INSERT ON recurringtask BEGIN
+            INSERT INTO searchindex (rowid, title, note) VALUES (NEW.id * 2 + 1, NEW.title, NEW.note);
+        END""",
+    "searchindex_task_update": """
+        AFTER UPDATE OF title, note ON recurringtask BEGIN
+            DELETE FROM searchindex WHERE rowid = OLD.id * 2 + 1;
+            INSERT INTO searchindex (rowid, title, note) VALUES (NEW.id * 2 + 1, NEW.title, NEW.note);
+        END""",
+    "searchindex_task_delete": """
+        AFTER DELETE ON recurringtask BEGIN
+            DELETE FROM searchindex WHERE rowid = OLD.id * 2 + 1;
+        END""",
+    # Entries without a custom title are found by their block type name
+    "searchindex_blocktype_rename": f"""
+        AFTER UPDATE OF name ON blocktype BEGIN
+            DELETE FROM searchindex WHERE rowid IN (
+                SELECT id * 2 FROM scheduleentry
+                WHERE block_type_id = NEW.id AND NULLIF(custom_title, '') IS NULL
+            );
+            INSERT INTO searchindex (rowid, title, note)
+            SELECT id * 2, {ENTRY_TITLE_SQL.format(row="scheduleentry")}, note FROM scheduleentry
+            WHERE block_type_id = NEW.id AND NULLIF(custom_title, '') IS NULL;
+        END""",
+}
+
+
+def install_search_index(conn) -> None:
+    """Create the FTS5 table and its triggers, indexing existing rows the first time."""
+    exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'searchindex'")).first()
+    if not exists:
+        conn.execute(text(f"CREATE VIRTUAL TABLE searchindex USING fts5({SEARCH_COLUMNS})"))
+        conn.execute(text(
+            f"INSERT INTO searchindex (rowid, title, note) "
+            f"SELECT id * 2, {ENTRY_TITLE_SQL.format(row='scheduleentry')}, note FROM scheduleentry"
+        ))
+        conn.execute(text(
+            "INSERT INTO searchindex (rowid, title, note) SELECT id * 2 + 1, title, note FROM recurringtask"
+        ))
+    for name, body in SEARCH_TRIGGERS.items():
+        conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS {name} {body}"))
+
+
+def match_expression(query: str) -> str | None:
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix."""
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def _task_jump_week(task: RecurringTask, today: date) -> date:
+    """The week to open for a recurring task: this week while it runs, else its first or last week."""
+    if task.start_date > today:
+        anchor = task.start_date
+    elif task.end_date and task.end_date < today:
+        anchor = task.end_date
+    else:
+        anchor = today
+    return anchor - timedelta(days=anchor.weekday())
+
+
+def search(session: Session, query: str, limit: int = 20, offset: int = 0) -> dict:
+    """Ranked matches for `query`, one page at a time."""
+    expression = match_expression(query)
+    if expression is None:
+        return {"query": query, "results": [], "has_more": False}
+
+    # Archived entries have their own index; the best of both are merged by rank
+    wanted = offset + limit + 1
+    matches = session.exec(
+        text("SELECT rowid, rank FROM searchindex WHERE searchindex MATCH :q ORDER BY rank LIMIT :limit"),
+        params={"q": expression, "limit": wanted},
+    ).all()
+    archived = search_archive(session, expression, wanted)
+    if archived:
+        matches = sorted([*matches, *archived], key=lambda match: match[1])
+    rowids = [rowid for rowid, _ in matches[offset:wanted]]
+    has_more = len(rowids) > limit
+    rowids = rowids[:limit]
+
+    entry_ids = [r // 2 for r in rowids if r % 2 == 0]
+    task_ids = [r // 2 for r in rowids if r % 2 == 1]
+    entries = {
+        e.id: (e, b)
+        for e, b in session.exec(
+            select(ScheduleEntry, BlockType)
+            .join(BlockType, ScheduleEntry.block_type_id == BlockType.id)
+            .where(ScheduleEntry.id.in_(entry_ids))
+        ).all()
+    } if entry_ids else {}
+    if archived:
+        missing = [i for i in entry_ids if i not in entries]
+        block_types = {b.id: b for b in session.exec(select(BlockType)).all()}
+        for entry in archived_entries_by_id(session, missing):
+            if entry.block_type_id in block_types:
+                entries[entry.id] = (entry, block_types[entry.block_type_id])
+    tasks = {
+        t.id: t for t in session.exec(select(RecurringTask).where(RecurringTask.id.in_(task_ids))).all()
+    } if task_ids else {}
+
+    today = date.today()
+    results = []
+    for rowid in rowids:
+        if rowid % 2 == 0 and rowid // 2 in entries:
+            entry, block_type = entries[rowid // 2]
+            results.append({
+                "kind": "entry",
+                "id": entry.id,
+                "title": entry.custom_title or block_type.name,
+                "note": entry.note,
+                "week_start": entry.week_start,
+                "day": entry.day,
+                "date": entry.entry_date,
+                "start_minute": entry.start_minute,
+                "plan_id": entry.plan_id,
+                "url": f"/?week={entry.week_start.isoformat()}",
+            })
+        elif rowid % 2 == 1 and rowid // 2 in tasks:
+            task = tasks[rowid // 2]
+            week = _task_jump_week(task, today)
+            results.append({
+                "kind": "recurring",
+                "id": task.id,
+                "title": task.title,
+                "note": task.note,
+                "week_start": week,
+                "pattern": task.pattern,
+                "start_minute": task.start_minute,
+                "plan_id": task.plan_id,
+                "url": f"/?week={week.isoformat()}",
+            })
+    return {"query": query, "results": results, "has_more": has_more}
@@ -0,0 +1,79 @@
+"""
+Compact JSON for the /api routes.
+
+Schedule data is sent column-wise: every field is one array with a value per
+row, and block types and plans are sent once as lookup tables referenced by
+id. Responses are encoded with orjson when it is installed and fall back to
+the standard library otherwise.
+"""
+import json
+from datetime import date, datetime
+from typing import Any, Iterable
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+from .models import BlockType, Plan, ScheduleEntry
+
+ENTRY_COLUMNS = ("id", "date", "start_minute", "duration_minutes", "block_type_id", "plan_id", "title", "note", "is_quick")
+RECURRING_COLUMNS = ("recurring_task_id", "instance_date", "date", "start_minute", "duration_minutes", "block_type_id", "plan_id", "title", "note")
+
+
+def _default(value: Any):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with the fastest encoder available."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _columns(names: Iterable[str], rows: Iterable[tuple]) -> dict[str, list]:
+    columns = {name: [] for name in names}
+    lists = list(columns.values())
+    for row in rows:
+        for column, value in zip(lists, row):
+            column.append(value)
+    return columns
+
+
+def block_type_table(block_types: list[BlockType]) -> dict[str, list]:
+    return _columns(
+        ("id", "name", "color", "icon", "is_quick_template"),
+        ((b.id, b.name, b.color, b.icon, b.is_quick_template) for b in block_types),
+    )
+
+
+def plan_table(plans: list[Plan]) -> dict[str, list]:
+    return _columns(("id", "name", "color"), ((p.id, p.name, p.color) for p in plans))
+
+
+def entry_columns(entries: list[ScheduleEntry]) -> dict[str, list]:
+    return _columns(ENTRY_COLUMNS, (
+        (e.id, e.entry_date, e.start_minute, e.duration_minutes, e.block_type_id, e.plan_id, e.custom_title, e.note, e.is_quick)
+        for e in entries
+    ))
+
+
+def recurring_columns(instances: list[dict]) -> dict[str, list]:
+    return _columns(RECURRING_COLUMNS, (
+        (
+            i["recurring_task_id"], i["instance_date"], i["entry_date"], i["start_minute"], i["duration_minutes"],
+            i["block_type"].id if i["block_type"] else None, i["plan_id"], i["title"], i["note"],
+        )
+        for i in instances
+    ))
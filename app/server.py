@@ -0,0 +1,198 @@
+"""
+Production server: ``python -m app serve``.
+
+The parent process imports the app and prepares the database once. That means
+the schema and its patches, default rows, compressed assets, the recurring
+horizon and failing jobs lost in the last shutdown. It then compiles the
+templates, binds the listening socket and forks the workers. Workers share
+the parent's loaded code and compiled templates, and none of them repeats the
+startup work. That work is not safe to race: a worker starting late would
+otherwise fail jobs another worker is running.
+
+The parent supervises the workers. A worker that exits is replaced, whether
+it crashed or reached PLANNER_MAX_REQUESTS. SIGTERM or SIGINT stops them
+gracefully. Workers stop accepting connections, finish in-flight requests
+for up to PLANNER_GRACEFUL_TIMEOUT seconds, and are killed after that.
+Platforms without fork run a single worker.
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+
+from .config import (
+    EVENTS_BACKEND, SERVER_ACCESS_LOG, SERVER_BACKLOG, SERVER_GRACEFUL_TIMEOUT, SERVER_HOST, SERVER_HTTP,
+    SERVER_KEEPALIVE_SECONDS, SERVER_LOOP, SERVER_MAX_REQUESTS, SERVER_MAX_WORKERS, SERVER_PORT, SERVER_WORKERS,
+)
+
+logger = logging.getLogger("uvicorn.error")
+
+# A worker that dies sooner than this after starting is restarted after a pause
+MIN_WORKER_LIFETIME = 1.0
+# How long after the graceful timeout stragglers get before SIGKILL
+KILL_GRACE_SECONDS = 5
+POLL_SECONDS = 0.2
+
+
+def default_workers() -> int:
+    """One worker per CPU this process may run on, up to SERVER_MAX_WORKERS."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS, Windows
+        cpus = os.cpu_count() or 1
+    return max(1, min(cpus, SERVER_MAX_WORKERS))
+
+
+def resolve_loop(loop: str = SERVER_LOOP) -> str:
+    if loop == "auto":
+        return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    return loop
+
+
+def resolve_http(http: str = SERVER_HTTP) -> str:
+    if http == "auto":
+        return "httptools" if importlib.util.find_spec("httptools") else "h11"
+    return http
+
+
+def make_config(app, host: str, port: int, log_level: str = "info") -> uvicorn.Config:
+    return uvicorn.Config(
+        app,
+        host=host,
+        port=port,
+        loop=resolve_loop(),
+        http=resolve_http(),
+        backlog=SERVER_BACKLOG,
+        timeout_keep_alive=SERVER_KEEPALIVE_SECONDS,
+        timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT,
+        limit_max_requests=SERVER_MAX_REQUESTS or None,
+        access_log=SERVER_ACCESS_LOG,
+        log_level=log_level,
+    )
+
+
+class Supervisor:
+    """Forks workers that serve a shared socket, replaces those that exit and stops them on a signal."""
+
+    def __init__(self, config: uvicorn.Config, sock: socket.socket, workers: int) -> None:
+        self.config = config
+        self.sock = sock
+        self.workers = workers
+        self.children: dict[int, float] = {}  # pid -> start time
+        self.stopping = False
+
+    def spawn(self) -> None:
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.monotonic()
+            return
+        # Worker: default signal handling (uvicorn installs its own while serving)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, signal.SIG_DFL)
+        code = 0
+        try:
+            from . import db
+
+            # Pooled connections were opened by the parent and must not be shared
+            db.engine.dispose(close=False)
+            uvicorn.Server(self.config).run(sockets=[self.sock])
+        except BaseException:
+            logger.exception("Worker %s failed", os.getpid())
+            code = 1
+        finally:
+            os._exit(code)
+
+    def stop(self, signum, frame) -> None:
+        self.stopping = True
+
+    def run(self) -> None:
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        logger.info("Starting %d workers (pid %d)", self.workers, os.getpid())
+        for _ in range(self.workers):
+            self.spawn()
+
+        deadline = None
+        while self.children:
+            self.reap()
+            if self.stopping and deadline is None:
+                logger.info("Stopping workers (graceful timeout %d s)", SERVER_GRACEFUL_TIMEOUT)
+                self.signal_children(signal.SIGTERM)
+                deadline = time.monotonic() + SERVER_GRACEFUL_TIMEOUT + KILL_GRACE_SECONDS
+            elif deadline is not None and time.monotonic() > deadline:
+                logger.warning("Killing %d workers that did not stop in time", len(self.children))
+                self.signal_children(signal.SIGKILL)
+                deadline = float("inf")
+            time.sleep(POLL_SECONDS)
+        self.sock.close()
+
+    def reap(self) -> None:
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                return
+            started = self.children.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if code:
+                logger.warning("Worker %d exited with %d; restarting it", pid, code)
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            self.spawn()
+
+    def signal_children(self, sig: int) -> None:
+        for pid in list(self.children):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                self.children.pop(pid, None)
+
+
+def serve(host: str = SERVER_HOST, port: int = SERVER_PORT, workers: int = SERVER_WORKERS, log_level: str = "info") -> None:
+    from . import db
+    from .main import app, prepare_database, templates
+    from .templating import precompile
+
+    config = make_config(app, host, port, log_level)
+    prepare_database()
+    compiled = precompile(templates.env)
+    workers = workers or default_workers()
+    if workers > 1 and not hasattr(os, "fork"):
+        logger.warning("This platform cannot fork; running one worker")
+        workers = 1
+    if workers > 1 and EVENTS_BACKEND == "memory":
+        logger.warning("Live updates only reach tabs on the same worker; set PLANNER_EVENTS_BACKEND=sqlite")
+    logger.info(
+        "Prepared database and %d templates; loop %s, HTTP parser %s, keep-alive %d s, backlog %d",
+        compiled, config.loop, config.http, SERVER_KEEPALIVE_SECONDS, SERVER_BACKLOG,
+    )
+    db.engine.dispose()
+
+    if workers == 1:
+        uvicorn.Server(config).run()
+        return
+    Supervisor(config, config.bind_socket(), workers).run()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app", description="Hinz Personal Planner")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("serve", help="run the production server")
+    run.add_argument("--host", default=SERVER_HOST)
+    run.add_argument("--port", type=int, default=SERVER_PORT)
+    run.add_argument("--workers", type=int, default=SERVER_WORKERS, help="0 = one per CPU")
+    run.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(args.host, args.port, args.workers, args.log_level)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,10 @@
+// Identifies this tab so live updates can skip changes it made itself
+const CLIENT_ID = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : String(Math.random()).slice(2);
+
+function mutationHeaders() {
+  return { "HX-Request": "true", "X-Client-Id": CLIENT_ID };
+}
+
 document.addEventListener("DOMContentLoaded", () => {
   // Check if we need to redirect to apply saved plan selection
   applySavedPlanSelection();
@@ -7,6 +14,7 @@ document.addEventListener("DOMContentLoaded", () => {
   
   // Intercept HTMX requests to add plan filter
   document.body.addEventListener("htmx:configRequest", (evt) => {
+    evt.detail.headers["X-Client-Id"] = CLIENT_ID;
     // Add plan_ids to requests that target the schedule
     const target = evt.detail.target;
     if (target && target.id === "schedule") {
@@ -23,11 +31,16 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   });
   
-  document.body.addEventListener("htmx:afterSwap", (evt) => {
-    if (evt.target && evt.target.id === "schedule") {
-      setupEntries();
-      computeOverlaps();
+  // Schedule responses from htmx are morphed in place like every other refresh
+  document.body.addEventListener("htmx:beforeSwap", (evt) => {
+    const target = evt.detail.target;
+    if (target && target.id === "schedule" && evt.detail.shouldSwap && !evt.detail.isError) {
+      evt.detail.shouldSwap = false;
+      replaceScheduleHtml(evt.detail.serverResponse);
     }
+  });
+
+  document.body.addEventListener("htmx:afterSwap", (evt) => {
     if (evt.target && evt.target.id === "palette") {
       setupPalette();
     }
@@ -127,7 +140,11 @@ function init() {
   setupPlanControls();
   setupSettingsDropdown();
   setupPlansModal();
-  computeOverlaps();
+  rememberEntryHtml(document);
+  setupWeekNavigation();
+  setupOutbox();
+  registerServiceWorker();
+  connectLiveUpdates();
 }
 
 /* ---------- TOUCH HELPERS ---------- */
@@ -135,17 +152,15 @@ function isTouchDevice() {
   return 'ontouchstart' in window || navigator.maxTouchPoints > 0;
 }
 
-function getEventCoords(e) {
-  if (e.touches && e.touches.length > 0) {
-    return { clientX: e.touches[0].clientX, clientY: e.touches[0].clientY };
-  }
-  if (e.changedTouches && e.changedTouches.length > 0) {
-    return { clientX: e.changedTouches[0].clientX, clientY: e.changedTouches[0].clientY };
-  }
-  return { clientX: e.clientX, clientY: e.clientY };
+function beginDrag() {
+  buildDragIndex(window.dragState);
+  addDragListeners();
 }
 
 function addDragListeners() {
+  // Column rectangles are cached for the drag; scrolling or resizing moves them
+  window.addEventListener("scroll", invalidateDragColumns, true);
+  window.addEventListener("resize", invalidateDragColumns);
   window.addEventListener("mousemove", onDragMove);
   window.addEventListener("mouseup", onDragEnd);
   window.addEventListener("touchmove", onDragMove, { passive: false });
@@ -154,6 +169,8 @@ function addDragListeners() {
 }
 
 function removeDragListeners() {
+  window.removeEventListener("scroll", invalidateDragColumns, true);
+  window.removeEventListener("resize", invalidateDragColumns);
   window.removeEventListener("mousemove", onDragMove);
   window.removeEventListener("mouseup", onDragEnd);
   window.removeEventListener("touchmove", onDragMove);
@@ -208,7 +225,7 @@ function setupPalette() {
           () => {
             fetch(`/blocks/${blockId}`, {
               method: "DELETE",
-              headers: { "HX-Request": "true" },
+              headers: mutationHeaders(),
             })
               .then((r) => r.text())
               .then((html) => {
@@ -274,6 +291,7 @@ function startPaletteDrag(event, card) {
   window.dragState = {
     mode: "create",
     blockId: card.dataset.blockId,
+    name: card.dataset.name || "",
     duration: getSelectedDuration(),
     color: card.dataset.color || "#0ea5e9",
     meta,
@@ -283,7 +301,7 @@ function startPaletteDrag(event, card) {
 
   document.body.style.cursor = "grabbing";
   document.body.style.userSelect = "none";
-  addDragListeners();
+  beginDrag();
 }
 
 /* ---------- SEARCH ---------- */
@@ -313,7 +331,6 @@ function setupDeleteButtons() {
     const entryId = btn.dataset.entryId;
     const recurringTaskId = btn.dataset.recurringTaskId;
     const instanceDate = btn.dataset.instanceDate;
-    const weekStart = getWeekStart();
 
     // Prevent double-click issues
     if (btn.disabled) return;
@@ -323,102 +340,104 @@ function setupDeleteButtons() {
       window.openRecurringConfirm(
         "Do you want to delete only this instance or all occurrences?",
         // Delete single instance
-        () => {
-          btn.disabled = true;
-          const formData = new FormData();
-          formData.append("exception_date", instanceDate);
-          formData.append("exception_type", "deleted");
-          if (weekStart) formData.append("week", weekStart);
-          formData.append("selected_plans", getSelectedPlanIds().join(","));
-
-          fetch(`/recurring-tasks/${recurringTaskId}/exception`, {
-            method: "POST",
-            headers: { "HX-Request": "true" },
-            body: formData,
-          })
-            .then((r) => r.text())
-            .then(replaceScheduleHtml)
-            .catch(console.error);
-        },
+        () => deleteRecurringInstance(recurringTaskId, instanceDate),
         // Delete all instances
-        () => {
-          btn.disabled = true;
-          let url = `/recurring-tasks/${recurringTaskId}`;
-          if (weekStart) url += `?week=${weekStart}`;
-          url = getScheduleUrl(url);
-
-          fetch(url, {
-            method: "DELETE",
-            headers: { "HX-Request": "true" },
-          })
-            .then((r) => r.text())
-            .then(replaceScheduleHtml)
-            .catch(console.error);
-        }
+        () => deleteRecurringTask(recurringTaskId)
       );
     } else if (entryId) {
       // Regular entry - delete directly
       btn.disabled = true;
-      let url = `/entries/${entryId}`;
-      if (weekStart) url += `?week_start=${weekStart}`;
-      url = getScheduleUrl(url);
-
-      fetch(url, {
-        method: "DELETE",
-        headers: { "HX-Request": "true" },
-      })
-        .then((r) => r.text())
-        .then(replaceScheduleHtml)
-        .catch(console.error);
+      deleteEntry(entryId);
     }
   });
 }
 
+function deleteEntry(entryId) {
+  removeEntries(`.entry[data-entry-id="${entryId}"]`);
+  const weekStart = getWeekStart();
+  let url = `/entries/${entryId}`;
+  if (weekStart) url += `?week_start=${weekStart}`;
+  queueMutation("DELETE", getScheduleUrl(url), null, { label: "Delete entry" });
+}
+
+function deleteRecurringInstance(taskId, instanceDate) {
+  removeEntries(`.entry[data-recurring-task-id="${taskId}"][data-instance-date="${instanceDate}"]`);
+  const weekStart = getWeekStart();
+  const fields = { exception_date: instanceDate, exception_type: "deleted", selected_plans: getSelectedPlanIds().join(",") };
+  if (weekStart) fields.week = weekStart;
+  queueMutation("POST", `/recurring-tasks/${taskId}/exception`, fields, {
+    coalesce: `exception:${taskId}:${instanceDate}`,
+    label: "Delete occurrence",
+  });
+}
+
+function deleteRecurringTask(taskId) {
+  removeEntries(`.entry[data-recurring-task-id="${taskId}"]`);
+  const weekStart = getWeekStart();
+  let url = `/recurring-tasks/${taskId}`;
+  if (weekStart) url += `?week=${weekStart}`;
+  queueMutation("DELETE", getScheduleUrl(url), null, { label: "Delete recurring task" });
+}
+
 /* ---------- ENTRIES ---------- */
+// Entry listeners are delegated to the scroll container, which outlives every
+// schedule swap, so entries never need binding after a refresh.
 function setupEntries() {
-  const schedule = document.getElementById("schedule");
-  if (!schedule) return;
-  const meta = extractMeta(schedule);
-  if (!meta) return;
+  const root = document.querySelector(".schedule-scroll-container");
+  if (!root || root.dataset.bound === "true") return;
+
+  function entryTarget(e) {
+    const entry = e.target.closest(".entry");
+    if (!entry || !root.contains(entry) || isPlaceholderEntry(entry)) return null;
+    const schedule = document.getElementById("schedule");
+    const meta = schedule && extractMeta(schedule);
+    return meta ? { entry, meta } : null;
+  }
 
-  schedule.querySelectorAll(".entry").forEach((entry) => {
-    entry.addEventListener("mousedown", (e) => {
-      if (e.button !== 0) return;
-      if (e.target.closest(".entry-delete-btn")) return;
-      if (e.target.closest(".entry-resize-handle")) {
-        e.preventDefault();
-        e.stopPropagation();
-        startResize(e, entry, meta);
-        return;
-      }
-      if (e.target.closest(".entry-title-text")) {
-        // Let title clicks pass through to open notes without starting drag
-        return;
-      }
+  root.addEventListener("mousedown", (e) => {
+    if (e.button !== 0) return;
+    const hit = entryTarget(e);
+    if (!hit) return;
+    if (e.target.closest(".entry-delete-btn")) return;
+    if (e.target.closest(".entry-resize-handle")) {
       e.preventDefault();
-      startEntryDrag(e, entry, meta);
-    });
+      e.stopPropagation();
+      startResize(e, hit.entry, hit.meta);
+      return;
+    }
+    if (e.target.closest(".entry-title-text")) {
+      // Let title clicks pass through to open notes without starting drag
+      return;
+    }
+    e.preventDefault();
+    startEntryDrag(e, hit.entry, hit.meta);
+  });
 
-    // Touch support for entries
-    let touchStartTimer = null;
-    entry.addEventListener("touchstart", (e) => {
-      if (e.target.closest(".entry-delete-btn")) return;
-      if (e.target.closest(".entry-title-text")) return;
-      
-      if (e.target.closest(".entry-resize-handle")) {
-        e.preventDefault();
-        e.stopPropagation();
-        startResize(e, entry, meta);
-        return;
-      }
-      
-      // Start drag immediately for touch
+  // Touch support for entries
+  root.addEventListener("touchstart", (e) => {
+    const hit = entryTarget(e);
+    if (!hit) return;
+    if (e.target.closest(".entry-delete-btn")) return;
+    if (e.target.closest(".entry-title-text")) return;
+
+    if (e.target.closest(".entry-resize-handle")) {
       e.preventDefault();
-      startEntryDrag(e, entry, meta);
-    }, { passive: false });
+      e.stopPropagation();
+      startResize(e, hit.entry, hit.meta);
+      return;
+    }
+
+    // Start drag immediately for touch
+    e.preventDefault();
+    startEntryDrag(e, hit.entry, hit.meta);
+  }, { passive: false });
 
-    entry.addEventListener("click", (e) => handleEntryClick(e, entry));
+  root.addEventListener("click", (e) => {
+    const entry = e.target.closest(".entry");
+    if (entry && root.contains(entry)) handleEntryClick(e, entry);
   });
+
+  root.dataset.bound = "true";
 }
 
 function startEntryDrag(event, entry, meta) {
@@ -442,7 +461,7 @@ function startEntryDrag(event, entry, meta) {
   entry.classList.add("dragging");
   document.body.style.cursor = "grabbing";
   document.body.style.userSelect = "none";
-  addDragListeners();
+  beginDrag();
 }
 
 function startResize(event, entry, meta) {
@@ -466,61 +485,82 @@ function startResize(event, entry, meta) {
   entry.classList.add("dragging");
   document.body.style.cursor = "ns-resize";
   document.body.style.userSelect = "none";
-  addDragListeners();
+  beginDrag();
 }
 
 /* ---------- COLLISION DETECTION ---------- */
-function getEntriesInCol(col, excludeInfo) {
-  const entries = col.querySelectorAll(".entry");
-  const result = [];
-  entries.forEach((entry) => {
-    const id = entry.dataset.entryId;
-    const recurringTaskId = entry.dataset.recurringTaskId;
-    const instanceDate = entry.dataset.instanceDate;
-    const planId = entry.dataset.planId;
-    
-    // Exclude the entry being dragged
-    if (excludeInfo) {
-      if (excludeInfo.entryId && id === String(excludeInfo.entryId)) return;
-      // For recurring tasks, exclude by recurring task ID and instance date
-      if (excludeInfo.recurringTaskId && 
-          recurringTaskId === String(excludeInfo.recurringTaskId) && 
-          instanceDate === excludeInfo.instanceDate) return;
-    }
-    
-    result.push({
-      id,
-      recurringTaskId,
-      instanceDate,
-      planId,
-      start: parseInt(entry.dataset.startMinute, 10),
-      end: parseInt(entry.dataset.endMinute, 10),
+// Built once when a drag starts: per day column, the intervals the dragged
+// block may not overlap, sorted by start with a running maximum of ends, so a
+// collision check is one binary search. In multi-plan view entries of other
+// plans are left out, since blocks of different plans may overlap.
+function buildDragIndex(ds) {
+  const schedule = document.getElementById("schedule");
+  const isMultiPlan = schedule !== null && schedule.classList.contains("multi-plan-view");
+  const dragPlanId = (ds.mode === "create" ? getActivePlanId() : ds.planId) || null;
+
+  ds.columns = Array.from(document.querySelectorAll("#schedule .day-col")).map((col) => {
+    const intervals = [];
+    col.querySelectorAll(".entry").forEach((entry) => {
+      if (entry === ds.entry) return;
+      const planId = entry.dataset.planId || null;
+      if (isMultiPlan && dragPlanId && planId && planId !== dragPlanId) return;
+      intervals.push([parseInt(entry.dataset.startMinute, 10), parseInt(entry.dataset.endMinute, 10)]);
     });
+    intervals.sort((a, b) => a[0] - b[0]);
+    const starts = new Int32Array(intervals.length);
+    const maxEnds = new Int32Array(intervals.length);
+    let maxEnd = -1;
+    intervals.forEach(([start, end], i) => {
+      starts[i] = start;
+      maxEnd = Math.max(maxEnd, end);
+      maxEnds[i] = maxEnd;
+    });
+    return { col, day: col.dataset.day, starts, maxEnds, left: 0, right: 0, top: 0, bottom: 0 };
   });
-  return result;
+  ds.columnsMeasured = false;
+  ds.frame = 0;
+  ds.pointerX = 0;
+  ds.pointerY = 0;
+  ds.placed = { col: null, startMinute: -1, duration: -1, invalid: false };
+  ds.targetSlot = { day: "", startMinute: 0, duration: 0 };
 }
 
-function hasCollision(entries, startMinute, endMinute, dragPlanId) {
-  // In multi-plan view, entries from different plans can overlap
-  const isMultiPlan = document.querySelector(".schedule-wrapper.multi-plan-view") !== null;
-  
-  // Normalize planId - treat empty string as null
-  const normalizedDragPlanId = dragPlanId || null;
-  
-  for (const e of entries) {
-    const normalizedEntryPlanId = e.planId || null;
-    
-    // Skip entries from different plans in multi-plan view
-    // Both must have a planId for this to work
-    if (isMultiPlan && normalizedDragPlanId && normalizedEntryPlanId && normalizedDragPlanId !== normalizedEntryPlanId) {
-      continue;
-    }
-    // Check if ranges overlap
-    if (startMinute < e.end && endMinute > e.start) {
-      return true;
+function invalidateDragColumns() {
+  if (window.dragState) window.dragState.columnsMeasured = false;
+}
+
+function measureDragColumns(ds) {
+  for (const column of ds.columns) {
+    const rect = column.col.getBoundingClientRect();
+    column.left = rect.left;
+    column.right = rect.right;
+    column.top = rect.top;
+    column.bottom = rect.bottom;
+  }
+  ds.columnsMeasured = true;
+}
+
+function columnAt(ds, clientX, clientY) {
+  if (!ds.columnsMeasured) measureDragColumns(ds);
+  for (const column of ds.columns) {
+    if (clientX >= column.left && clientX < column.right && clientY >= column.top && clientY < column.bottom) {
+      return column;
     }
   }
-  return false;
+  return null;
+}
+
+function collidesInColumn(column, startMinute, endMinute) {
+  // Last interval starting before endMinute; any interval up to it that ends
+  // after startMinute overlaps, which the running maximum answers at once
+  let lo = 0;
+  let hi = column.starts.length;
+  while (lo < hi) {
+    const mid = (lo + hi) >>> 1;
+    if (column.starts[mid] < endMinute) lo = mid + 1;
+    else hi = mid;
+  }
+  return lo > 0 && column.maxEnds[lo - 1] > startMinute;
 }
 
 /* ---------- DRAG LOGIC ---------- */
@@ -531,19 +571,30 @@ function onDragMove(event) {
   // Prevent default for touch events to avoid scrolling
   if (event.cancelable) event.preventDefault();
 
-  const coords = getEventCoords(event);
-  const col = findDayCol(coords.clientX, coords.clientY);
-  if (!col) {
+  // Only remember the pointer here; the work happens once per frame
+  const point = event.touches && event.touches.length > 0 ? event.touches[0] : event;
+  ds.pointerX = point.clientX;
+  ds.pointerY = point.clientY;
+  if (!ds.frame) ds.frame = requestAnimationFrame(applyDragFrame);
+}
+
+function applyDragFrame() {
+  const ds = window.dragState;
+  if (!ds) return;
+  ds.frame = 0;
+
+  const column = columnAt(ds, ds.pointerX, ds.pointerY);
+  if (!column) {
     ds.indicator.style.display = "none";
+    ds.placed.col = null;
     ds.target = null;
     return;
   }
   ds.indicator.style.display = "";
 
   const { meta, mode } = ds;
-  const rect = col.getBoundingClientRect();
-  const y = Math.max(0, coords.clientY - rect.top);
-  
+  const y = Math.max(0, ds.pointerY - column.top);
+
   // Snap to slot grid
   const slots = Math.floor(y / meta.slotHeight);
   let startMinute = meta.dayStart + slots * meta.slotMinutes;
@@ -567,41 +618,39 @@ function onDragMove(event) {
     duration = meta.dayEnd - startMinute;
   }
 
-  const endMinute = startMinute + duration;
-
-  // Check for collision
-  let excludeInfo = null;
-  if (mode === "move" || mode === "resize") {
-    excludeInfo = {
-      entryId: ds.id,
-      recurringTaskId: ds.recurringTaskId,
-      instanceDate: ds.instanceDate,
-    };
-  }
-  const existingEntries = getEntriesInCol(col, excludeInfo);
-  // For create mode, use active plan; for move/resize, use entry's plan
-  const dragPlanId = ds.mode === "create" ? getActivePlanId() : ds.planId;
-  const collision = hasCollision(existingEntries, startMinute, endMinute, dragPlanId);
-
+  const collision = collidesInColumn(column, startMinute, startMinute + duration);
   if (collision) {
-    ds.indicator.classList.add("invalid");
     ds.target = null; // Prevent drop
   } else {
-    ds.indicator.classList.remove("invalid");
-    ds.target = {
-      day: col.dataset.day,
-      startMinute,
-      duration,
-    };
+    ds.targetSlot.day = column.day;
+    ds.targetSlot.startMinute = startMinute;
+    ds.targetSlot.duration = duration;
+    ds.target = ds.targetSlot;
   }
 
-  placeIndicator(ds.indicator, col, startMinute, duration, meta, collision ? "#ef4444" : ds.color);
+  // Touch the indicator only when the snapped position changes
+  const placed = ds.placed;
+  if (placed.col === column.col && placed.startMinute === startMinute && placed.duration === duration && placed.invalid === collision) {
+    return;
+  }
+  placed.col = column.col;
+  placed.startMinute = startMinute;
+  placed.duration = duration;
+  placed.invalid = collision;
+  ds.indicator.classList.toggle("invalid", collision);
+  placeIndicator(ds.indicator, column.col, startMinute, duration, meta, collision ? "#ef4444" : ds.color);
 }
 
 function onDragEnd() {
   const ds = window.dragState;
   if (!ds) return;
 
+  // Apply the last pointer position if its frame hasn't run yet
+  if (ds.frame) {
+    cancelAnimationFrame(ds.frame);
+    applyDragFrame();
+  }
+
   // Cleanup
   if (ds.entry) ds.entry.classList.remove("dragging");
   if (ds.indicator) ds.indicator.remove();
@@ -620,6 +669,7 @@ function onDragEnd() {
   const { target, mode } = ds;
   const weekStart = getWeekStart();
   const selectedPlans = getSelectedPlanIds().join(",");
+  window.dragState = null;
 
   if (mode === "move" || mode === "resize") {
     if (ds.isRecurring) {
@@ -630,93 +680,68 @@ function onDragEnd() {
         "Do you want to change only this instance or all occurrences?",
         // Change single instance
         () => {
-          const fd = new FormData();
-          fd.append("exception_date", ds.instanceDate);
-          fd.append("exception_type", "modified");
-          fd.append("new_day", target.day);
-          fd.append("new_start_minute", String(target.startMinute));
-          fd.append("new_duration_minutes", String(target.duration));
-          if (weekStart) fd.append("week", weekStart);
-          fd.append("selected_plans", selectedPlans);
-
-          fetch(`/recurring-tasks/${ds.recurringTaskId}/exception`, {
-            method: "POST",
-            headers: { "HX-Request": "true" },
-            body: fd,
-          })
-            .then((r) => r.text())
-            .then(replaceScheduleHtml)
-            .catch(console.error)
-            .finally(() => {
-              window.dragState = null;
-            });
+          placeEntry(ds.entry, target.day, target.startMinute, target.duration);
+          const fields = {
+            exception_date: ds.instanceDate,
+            exception_type: "modified",
+            new_day: target.day,
+            new_start_minute: String(target.startMinute),
+            new_duration_minutes: String(target.duration),
+            selected_plans: selectedPlans,
+          };
+          if (weekStart) fields.week = weekStart;
+          queueMutation("POST", `/recurring-tasks/${ds.recurringTaskId}/exception`, fields, {
+            coalesce: `exception:${ds.recurringTaskId}:${ds.instanceDate}`,
+            label: "Move occurrence",
+          });
         },
         // Change all instances
         () => {
-          const fd = new FormData();
-          fd.append("day_of_week", String(newDayOfWeek));
-          fd.append("start_minute", String(target.startMinute));
-          fd.append("duration_minutes", String(target.duration));
-          if (weekStart) fd.append("week", weekStart);
+          placeEntry(ds.entry, target.day, target.startMinute, target.duration);
+          const fields = {
+            day_of_week: String(newDayOfWeek),
+            start_minute: String(target.startMinute),
+            duration_minutes: String(target.duration),
+            selected_plans: selectedPlans,
+          };
+          if (weekStart) fields.week = weekStart;
           // Clear any exception for the instance being dragged so it reflects the new base values
-          if (ds.instanceDate) fd.append("clear_exception_date", ds.instanceDate);
-          fd.append("selected_plans", selectedPlans);
-
-          fetch(`/recurring-tasks/${ds.recurringTaskId}/move-all`, {
-            method: "PATCH",
-            headers: { "HX-Request": "true" },
-            body: fd,
-          })
-            .then((r) => r.text())
-            .then(replaceScheduleHtml)
-            .catch(console.error)
-            .finally(() => {
-              window.dragState = null;
-            });
+          if (ds.instanceDate) fields.clear_exception_date = ds.instanceDate;
+          queueMutation("PATCH", `/recurring-tasks/${ds.recurringTaskId}/move-all`, fields, {
+            coalesce: `move-all:${ds.recurringTaskId}`,
+            label: "Move recurring task",
+          });
         }
       );
     } else {
       // Regular entry
-      const fd = new FormData();
-      fd.append("day", target.day);
-      fd.append("start_minute", String(target.startMinute));
-      fd.append("duration_minutes", String(target.duration));
-      if (weekStart) fd.append("week", weekStart);
-      fd.append("selected_plans", selectedPlans);
-      fetch(`/entries/${ds.id}/move`, {
-        method: "POST",
-        headers: { "HX-Request": "true" },
-        body: fd,
-      })
-        .then((r) => r.text())
-        .then(replaceScheduleHtml)
-        .catch(console.error)
-        .finally(() => {
-          window.dragState = null;
-        });
+      placeEntry(ds.entry, target.day, target.startMinute, target.duration);
+      const fields = {
+        day: target.day,
+        start_minute: String(target.startMinute),
+        duration_minutes: String(target.duration),
+        selected_plans: selectedPlans,
+      };
+      if (weekStart) fields.week = weekStart;
+      queueMutation("POST", `/entries/${ds.id}/move`, fields, {
+        coalesce: `move:${ds.id}`,
+        label: "Move entry",
+      });
     }
   } else if (mode === "create") {
     const activePlanId = getActivePlanId();
-    const fd = new FormData();
-    fd.append("day", target.day);
-    fd.append("start_time", minutesToTime(target.startMinute));
-    fd.append("duration_minutes", String(ds.duration));
-    fd.append("block_type_id", ds.blockId);
-    fd.append("note", "");
-    fd.append("week", weekStart || "");
-    if (activePlanId) fd.append("plan_id", activePlanId);
-    fd.append("selected_plans", selectedPlans);
-    fetch("/entries", {
-      method: "POST",
-      headers: { "HX-Request": "true" },
-      body: fd,
-    })
-      .then((r) => r.text())
-      .then(replaceScheduleHtml)
-      .catch(console.error)
-      .finally(() => {
-        window.dragState = null;
-      });
+    addPendingEntry(target.day, target.startMinute, ds.duration, ds.name, ds.color);
+    const fields = {
+      day: target.day,
+      start_time: minutesToTime(target.startMinute),
+      duration_minutes: String(ds.duration),
+      block_type_id: ds.blockId,
+      note: "",
+      week: weekStart || "",
+      selected_plans: selectedPlans,
+    };
+    if (activePlanId) fields.plan_id = activePlanId;
+    queueMutation("POST", "/entries", fields, { label: "Add block" });
   }
 }
 
@@ -750,26 +775,143 @@ function placeIndicator(indicator, col, startMinute, duration, meta, color) {
   }
 }
 
-function findDayCol(clientX, clientY) {
-  const els = document.elementsFromPoint(clientX, clientY);
-  for (const el of els) {
-    const col = el.closest(".day-col");
-    if (col) return col;
+/* ---------- SCHEDULE SWAPS ---------- */
+// Entries are matched by key between the current and the new schedule, and
+// only the ones whose server HTML changed are replaced. Anything else that
+// differs in the grid (another week, other days) falls back to a full swap.
+window.scheduleSwapTimings = [];
+
+function entryKey(el) {
+  if (el.dataset.pendingId) return `pending:${el.dataset.pendingId}`;
+  if (el.dataset.entryId) return `entry:${el.dataset.entryId}`;
+  return `recurring:${el.dataset.recurringTaskId}:${el.dataset.instanceDate}`;
+}
+
+function rememberEntryHtml(root) {
+  // Captured before any drag state classes are added, so it matches the server's markup
+  root.querySelectorAll(".entry").forEach((el) => {
+    el.morphHtml = el.outerHTML;
+  });
+}
+
+function syncAttributes(current, next) {
+  for (const { name } of Array.from(current.attributes)) {
+    if (!next.hasAttribute(name)) current.removeAttribute(name);
   }
-  return null;
+  for (const { name, value } of Array.from(next.attributes)) {
+    if (current.getAttribute(name) !== value) current.setAttribute(name, value);
+  }
+}
+
+function morphSchedule(current, next) {
+  const sameGrid = current.dataset.weekStart === next.dataset.weekStart &&
+    current.dataset.dayOrder === next.dataset.dayOrder &&
+    current.dataset.dayStart === next.dataset.dayStart &&
+    current.dataset.dayEnd === next.dataset.dayEnd;
+  const currentCols = Array.from(current.querySelectorAll(".day-col"));
+  const nextCols = Array.from(next.querySelectorAll(".day-col"));
+  if (!sameGrid || currentCols.length !== nextCols.length) return null;
+  if (currentCols.some((col, i) => col.dataset.day !== nextCols[i].dataset.day)) return null;
+
+  const staticParts = [".time-col", ".grid-header"].map((selector) => [
+    current.querySelector(selector), next.querySelector(selector),
+  ]);
+  if (staticParts.some(([a, b]) => !a || !b)) return null;
+
+  // Static parts of the grid: time labels, day headers, current time line
+  staticParts.forEach(([a, b]) => {
+    if (!a.isEqualNode(b)) a.replaceWith(b);
+  });
+  const line = current.querySelector(".current-time-line");
+  const nextLine = next.querySelector(".current-time-line");
+  if (line && nextLine) line.replaceWith(nextLine);
+  else if (line) line.remove();
+  else if (nextLine) current.querySelector(".grid-body").before(nextLine);
+  syncAttributes(current, next);
+
+  const existing = new Map();
+  current.querySelectorAll(".entry").forEach((el) => existing.set(entryKey(el), el));
+  const stats = { patched: 0, added: 0, removed: 0, kept: 0 };
+
+  nextCols.forEach((nextCol, i) => {
+    const col = currentCols[i];
+    syncAttributes(col, nextCol);
+    const periods = col.querySelectorAll(".day-period");
+    let anchor = periods.length ? periods[periods.length - 1] : null;
+
+    Array.from(nextCol.querySelectorAll(".entry")).forEach((nextEntry) => {
+      const key = entryKey(nextEntry);
+      const html = nextEntry.outerHTML;
+      let node = existing.get(key);
+      existing.delete(key);
+      if (node && node.morphHtml === html) {
+        stats.kept += 1;
+      } else {
+        if (node) {
+          node.remove();
+          stats.patched += 1;
+        } else {
+          stats.added += 1;
+        }
+        node = nextEntry;
+        node.morphHtml = html;
+      }
+      const slot = anchor ? anchor.nextElementSibling : col.firstElementChild;
+      if (slot !== node) col.insertBefore(node, slot);
+      anchor = node;
+    });
+  });
+
+  existing.forEach((el) => {
+    el.remove();
+    stats.removed += 1;
+  });
+  return stats;
+}
+
+function reportScheduleSwap(mode, started, stats) {
+  const parsedAt = performance.now();
+  // The second frame runs after style and layout of the swapped DOM
+  requestAnimationFrame(() => requestAnimationFrame(() => {
+    const timing = {
+      mode,
+      ...stats,
+      scriptMs: Math.round((parsedAt - started) * 10) / 10,
+      totalMs: Math.round((performance.now() - started) * 10) / 10,
+    };
+    if (performance.measure) {
+      try {
+        performance.measure("schedule-swap", { start: started, detail: timing });
+      } catch (e) { /* older browsers: no options argument */ }
+    }
+    window.scheduleSwapTimings.push(timing);
+    if (window.scheduleSwapTimings.length > 50) window.scheduleSwapTimings.shift();
+    document.dispatchEvent(new CustomEvent("schedule:swapped", { detail: timing }));
+  }));
 }
 
-function replaceScheduleHtml(html) {
+function replaceScheduleHtml(html, options = {}) {
+  const started = performance.now();
   const current = document.getElementById("schedule");
   if (!current) return;
-  const wrapper = document.createElement("div");
-  wrapper.innerHTML = html;
-  const next = wrapper.querySelector("#schedule") || wrapper.firstElementChild;
-  if (next) {
+  const template = document.createElement("template");
+  template.innerHTML = html;
+  const next = template.content.querySelector("#schedule") || template.content.firstElementChild;
+  if (!next) return;
+  // Anything but a week load is a mutation response, which makes every cached week suspect
+  if (!options.fromWeekCache) weekCache.clear();
+
+  // The morph takes entries out of `next`, so bail out before it starts on a mismatch
+  const stats = morphSchedule(current, next);
+  if (stats) {
+    reportScheduleSwap("morph", started, stats);
+  } else {
+    rememberEntryHtml(next);
     current.replaceWith(next);
-    setupEntries();
-    computeOverlaps();
+    reportScheduleSwap("replace", started, { added: next.querySelectorAll(".entry").length });
   }
+  syncWeekHeader();
+  scheduleWeekPrefetch();
 }
 
 function minutesToTime(mins) {
@@ -847,7 +989,7 @@ function setupQuickTaskModal() {
     }
   });
 
-  // Listen for successful HTMX request from the quick task form
+  // The quick task goes through the outbox; only a clash visible in the grid is reported inline
   if (form) {
     // Get or create error message element
     let errorEl = form.querySelector(".quick-task-error");
@@ -857,16 +999,25 @@ function setupQuickTaskModal() {
       form.insertBefore(errorEl, form.firstChild);
     }
     
-    form.addEventListener("htmx:afterRequest", (evt) => {
-      if (evt.detail.successful) {
-        errorEl.textContent = "";
-        errorEl.style.display = "none";
-        handleSuccess();
-      } else if (evt.detail.xhr && evt.detail.xhr.status === 409) {
+    form.addEventListener("submit", (e) => {
+      e.preventDefault();
+      const fields = Object.fromEntries(new FormData(form));
+      const [hours, minutes] = (fields.start_time || "").split(":").map(Number);
+      const startMinute = hours * 60 + minutes;
+      const occupied = Array.from(document.querySelectorAll(`#schedule .day-col[data-day="${fields.day}"] .entry`))
+        .some((el) => startMinute < Number(el.dataset.endMinute) && Number(el.dataset.startMinute) < startMinute + 60);
+      if (occupied) {
         // Collision detected - time slot occupied
         errorEl.textContent = "This time slot is already occupied. Please choose a different time.";
         errorEl.style.display = "block";
+        return;
       }
+      errorEl.textContent = "";
+      errorEl.style.display = "none";
+      fields.selected_plans = getSelectedPlanIds().join(",");
+      addPendingEntry(fields.day, startMinute, 60, fields.title, "#6b7280");
+      queueMutation("POST", "/quick-task", fields, { label: `Quick task "${fields.title}"` });
+      handleSuccess();
     });
     
     // Clear error when form inputs change
@@ -884,7 +1035,7 @@ function setupQuickTaskModal() {
 
 /* ---------- ENTRY NOTES ---------- */
 function handleEntryClick(event, entry) {
-  if (event.defaultPrevented) return;
+  if (event.defaultPrevented || isPlaceholderEntry(entry)) return;
   if (event.target.closest(".entry-delete-btn") || event.target.closest(".entry-resize-handle")) return;
   // Only open note modal when clicking on the title text
   const titleText = event.target.closest(".entry-title-text");
@@ -959,19 +1110,8 @@ function setupEntryNoteModal() {
           "Delete Entry",
           "Are you sure you want to delete this entry?",
           () => {
-            const weekStart = getWeekStart();
-            let url = `/entries/${entryId}`;
-            if (weekStart) url += `?week_start=${weekStart}`;
-            fetch(url, {
-              method: "DELETE",
-              headers: { "HX-Request": "true" },
-            })
-              .then((r) => r.text())
-              .then((html) => {
-                replaceScheduleHtml(html);
-                closeModal();
-              })
-              .catch(console.error);
+            deleteEntry(entryId);
+            closeModal();
           }
         );
       }
@@ -987,44 +1127,53 @@ function setupEntryNoteModal() {
           "Do you want to delete only this instance or all occurrences?",
           // Delete single instance
           () => {
-            const weekStart = getWeekStart();
-            const fd = new FormData();
-            fd.append("exception_date", instanceDate);
-            fd.append("exception_type", "deleted");
-            if (weekStart) fd.append("week", weekStart);
-
-            fetch(`/recurring-tasks/${taskId}/exception`, {
-              method: "POST",
-              headers: { "HX-Request": "true" },
-              body: fd,
-            })
-              .then((r) => r.text())
-              .then((html) => {
-                replaceScheduleHtml(html);
-                closeModal();
-              })
-              .catch(console.error);
+            deleteRecurringInstance(taskId, instanceDate);
+            closeModal();
           },
           // Delete all instances
           () => {
-            const weekStart = getWeekStart();
-            let url = `/recurring-tasks/${taskId}`;
-            if (weekStart) url += `?week_start=${weekStart}`;
-            fetch(url, {
-              method: "DELETE",
-              headers: { "HX-Request": "true" },
-            })
-              .then((r) => r.text())
-              .then((html) => {
-                replaceScheduleHtml(html);
-                closeModal();
-              })
-              .catch(console.error);
+            deleteRecurringTask(taskId);
+            closeModal();
           }
         );
       }
     }
   });
+  // Note saves go through the outbox like every other schedule change
+  modal.addEventListener("submit", (e) => {
+    const form = e.target.closest(".entry-note-form");
+    if (!form) return;
+    e.preventDefault();
+    const fields = Object.fromEntries(new FormData(form));
+    fields.selected_plans = getSelectedPlanIds().join(",");
+    if (!fields.week) fields.week = getWeekStart() || "";
+    const note = (fields.note || "").trim();
+    const entryMatch = form.getAttribute("action").match(/^\/entries\/(\d+)\/note$/);
+    const selector = entryMatch
+      ? `.entry[data-entry-id="${entryMatch[1]}"]`
+      : `.entry[data-recurring-task-id="${form.dataset.taskId}"]`;
+    document.querySelectorAll(`#schedule ${selector}`).forEach((el) => {
+      let noteEl = el.querySelector(".entry-note");
+      if (note && !noteEl) {
+        noteEl = document.createElement("div");
+        noteEl.className = "entry-note";
+        el.querySelector(".entry-content").appendChild(noteEl);
+      }
+      if (noteEl) {
+        if (note) noteEl.textContent = note;
+        else noteEl.remove();
+      }
+      const titleText = el.querySelector(".entry-title-text");
+      if (!entryMatch && fields.title && fields.title.trim() && titleText) titleText.textContent = fields.title.trim();
+      el.classList.add("is-pending");
+      el.morphHtml = null;
+    });
+    queueMutation("POST", form.getAttribute("action"), fields, {
+      coalesce: `note:${form.getAttribute("action")}`,
+      label: "Save note",
+    });
+    closeModal();
+  });
   if (overlay) {
     overlay.addEventListener("click", closeModal);
   }
@@ -1304,6 +1453,53 @@ function setupConfirmDialog() {
   modal.dataset.bound = "true";
 }
 
+/* ─────────────────────────────────────────────────────────
+   Background jobs - imports and exports run on the server
+   and are polled until they finish
+───────────────────────────────────────────────────────── */
+function describeJobProgress(job) {
+  const rows = Object.values(job.progress || {}).reduce((sum, n) => sum + n, 0);
+  return rows ? `${rows.toLocaleString()} rows` : "";
+}
+
+async function waitForJob(job, onProgress) {
+  while (job.status === "queued" || job.status === "running") {
+    if (onProgress) onProgress(job);
+    await new Promise((resolve) => setTimeout(resolve, 500));
+    const resp = await fetch(`/jobs/${job.id}`);
+    if (!resp.ok) throw new Error(await resp.text());
+    job = await resp.json();
+  }
+  if (job.status === "failed") throw new Error(job.error || "Job failed");
+  return job;
+}
+
+(function setupExport() {
+  const exportBtn = document.getElementById("export-btn");
+  if (!exportBtn || exportBtn.dataset.bound) return;
+
+  const label = exportBtn.textContent;
+  exportBtn.addEventListener("click", async () => {
+    if (exportBtn.disabled) return;
+    exportBtn.disabled = true;
+    try {
+      const resp = await fetch("/export/csv", { method: "POST" });
+      if (!resp.ok) throw new Error(await resp.text());
+      const job = await waitForJob(await resp.json(), (j) => {
+        exportBtn.textContent = `📥 Exporting… ${describeJobProgress(j)}`;
+      });
+      window.location.href = job.download_url;
+    } catch (err) {
+      alert("Export failed: " + err.message);
+    } finally {
+      exportBtn.textContent = label;
+      exportBtn.disabled = false;
+    }
+  });
+
+  exportBtn.dataset.bound = "true";
+})();
+
 /* ─────────────────────────────────────────────────────────
    Import button handler
 ───────────────────────────────────────────────────────── */
@@ -1334,9 +1530,14 @@ function setupConfirmDialog() {
           const resp = await fetch("/import/csv", {
             method: "POST",
             body: fd,
+            headers: { "X-Client-Id": CLIENT_ID },
           });
           
           if (resp.ok) {
+            const label = importBtn.textContent;
+            await waitForJob(await resp.json(), (job) => {
+              importBtn.textContent = `📤 Importing… ${describeJobProgress(job)}`;
+            }).finally(() => { importBtn.textContent = label; });
             window.location.href = "/";
           } else {
             const text = await resp.text();
@@ -1457,17 +1658,9 @@ function getActivePlanId() {
 }
 
 function refreshScheduleWithPlans() {
-  const schedule = document.getElementById("schedule");
-  if (!schedule) return;
-  
-  const weekStart = schedule.dataset.weekStart;
-  const planIds = getSelectedPlanIds();
-  
-  const url = new URL("/schedule", window.location.origin);
-  if (weekStart) url.searchParams.set("week", weekStart);
-  if (planIds.length > 0) url.searchParams.set("plans", planIds.join(","));
-  
-  htmx.ajax("GET", url.toString(), { target: "#schedule", swap: "outerHTML" });
+  const weekStart = getWeekStart();
+  if (!weekStart) return;
+  showWeek(weekStart);
 }
 
 function updatePlanSelectors() {
@@ -1568,95 +1761,455 @@ function closePlansModal() {
 }
 
 /* ─────────────────────────────────────────────────────────
-   Overlap Computation
+   Outbox - schedule changes are applied to the grid at once and
+   sent in order from a queue that survives reloads and offline spells
 ───────────────────────────────────────────────────────── */
-function computeOverlaps() {
-  const dayCols = document.querySelectorAll(".day-col");
-  const isMultiPlan = document.querySelector(".multi-plan-view") !== null;
-  
-  dayCols.forEach(col => {
-    const entries = Array.from(col.querySelectorAll(".entry"));
-    
-    // Remove old classes first
-    entries.forEach(entry => {
-      entry.classList.remove("overlap-2", "overlap-3", "overlap-pos-0", "overlap-pos-1", "overlap-pos-2");
-      entry.style.left = "";
-      entry.style.width = "";
-    });
-    
-    if (entries.length < 2) return;
-    
-    // Sort by start minute
-    entries.sort((a, b) => {
-      return parseInt(a.dataset.startMinute) - parseInt(b.dataset.startMinute);
-    });
-    
-    // Find overlapping groups (entries that overlap in time)
-    const timeGroups = [];
-    let currentGroup = [];
-    let currentEnd = 0;
-    
-    entries.forEach(entry => {
-      const start = parseInt(entry.dataset.startMinute);
-      const end = parseInt(entry.dataset.endMinute);
-      
-      if (start < currentEnd) {
-        // Overlaps with current group
-        currentGroup.push(entry);
-        currentEnd = Math.max(currentEnd, end);
-      } else {
-        // New group
-        if (currentGroup.length > 0) {
-          timeGroups.push([...currentGroup]);
-        }
-        currentGroup = [entry];
-        currentEnd = end;
-      }
-    });
-    if (currentGroup.length > 0) {
-      timeGroups.push(currentGroup);
+const OUTBOX_DB = "planner-outbox";
+const OUTBOX_STORE = "ops";
+const OUTBOX_MAX_ATTEMPTS = 5;
+const OUTBOX_MAX_RETRY_MS = 30000;
+
+const outbox = {
+  db: null,        // Promise of the IndexedDB database, or of null when unavailable
+  memory: [],      // Fallback queue when IndexedDB is unavailable
+  nextMemoryId: 1,
+  pending: 0,
+  flushing: false,
+  inFlight: null,
+  retryTimer: null,
+  retryMs: 1000,
+  swapTimer: null, // Showing the server's week after a flush, waiting for a drag to end
+};
+
+function openOutbox() {
+  if (outbox.db) return outbox.db;
+  outbox.db = new Promise((resolve) => {
+    if (!window.indexedDB) return resolve(null);
+    const request = indexedDB.open(OUTBOX_DB, 1);
+    request.onupgradeneeded = () => {
+      request.result.createObjectStore(OUTBOX_STORE, { keyPath: "id", autoIncrement: true });
+    };
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => resolve(null);
+  });
+  return outbox.db;
+}
+
+function outboxRequest(db, mode, fn) {
+  return new Promise((resolve, reject) => {
+    const tx = db.transaction(OUTBOX_STORE, mode);
+    const request = fn(tx.objectStore(OUTBOX_STORE));
+    tx.oncomplete = () => resolve(request.result);
+    tx.onerror = () => reject(tx.error);
+  });
+}
+
+async function outboxOps() {
+  const db = await openOutbox();
+  if (!db) return outbox.memory.slice();
+  return outboxRequest(db, "readonly", (store) => store.getAll());
+}
+
+async function outboxSave(op) {
+  const db = await openOutbox();
+  if (db) {
+    op.id = await outboxRequest(db, "readwrite", (store) => store.put(op));
+    return;
+  }
+  if (op.id === undefined) op.id = outbox.nextMemoryId++;
+  outbox.memory = outbox.memory.filter((o) => o.id !== op.id).concat([op]);
+}
+
+async function outboxRemove(id) {
+  const db = await openOutbox();
+  if (db) await outboxRequest(db, "readwrite", (store) => store.delete(id));
+  else outbox.memory = outbox.memory.filter((o) => o.id !== id);
+}
+
+function newIdempotencyKey() {
+  return (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+}
+
+async function queueMutation(method, url, fields, options = {}) {
+  // `coalesce` names the target of the change: a queued change to the same
+  // target that has not been sent yet is superseded, so bursts go out as one
+  outbox.pending += 1;
+  const op = {
+    method,
+    url,
+    body: new URLSearchParams(fields || {}).toString(),
+    key: newIdempotencyKey(),
+    coalesce: options.coalesce || null,
+    label: options.label || "change",
+    attempts: 0,
+  };
+  if (op.coalesce) {
+    const ops = await outboxOps();
+    for (const queued of ops) {
+      if (queued.coalesce === op.coalesce && queued.id !== outbox.inFlight) await outboxRemove(queued.id);
     }
-    
-    // Apply overlap classes
-    timeGroups.forEach(group => {
-      if (group.length === 1) return;
-      
-      if (isMultiPlan) {
-        // In multi-plan view, group by plan - only different plans get separate columns
-        const planGroups = new Map();
-        group.forEach(entry => {
-          const planId = entry.dataset.planId || "none";
-          if (!planGroups.has(planId)) {
-            planGroups.set(planId, []);
-          }
-          planGroups.get(planId).push(entry);
-        });
-        
-        // If all entries are from same plan, no overlap display needed
-        if (planGroups.size === 1) return;
-        
-        const planIds = Array.from(planGroups.keys());
-        const overlapClass = planIds.length === 2 ? "overlap-2" : "overlap-3";
-        
-        planIds.forEach((planId, planIdx) => {
-          planGroups.get(planId).forEach(entry => {
-            entry.classList.add(overlapClass);
-            if (planIdx > 0) {
-              entry.classList.add(`overlap-pos-${planIdx}`);
-            }
-          });
+  }
+  await outboxSave(op);
+  flushOutbox();
+}
+
+function setOutboxState(state) {
+  // CSS hook: "", "pending" or "offline"
+  if (state) document.body.dataset.outbox = state;
+  else delete document.body.dataset.outbox;
+}
+
+function scheduleOutboxRetry() {
+  window.clearTimeout(outbox.retryTimer);
+  outbox.retryTimer = window.setTimeout(flushOutbox, outbox.retryMs);
+  outbox.retryMs = Math.min(outbox.retryMs * 2, OUTBOX_MAX_RETRY_MS);
+}
+
+async function flushOutbox() {
+  if (outbox.flushing) return;
+  outbox.flushing = true;
+  window.clearTimeout(outbox.retryTimer);
+  const rejected = [];
+  let lastHtml = null;
+  let drained = false;
+  try {
+    while (true) {
+      const ops = await outboxOps();
+      outbox.pending = ops.length;
+      if (!ops.length) {
+        drained = true;
+        break;
+      }
+      setOutboxState("pending");
+      const op = ops[0];
+      outbox.inFlight = op.id;
+      let resp;
+      try {
+        resp = await fetch(op.url, {
+          method: op.method,
+          headers: {
+            ...mutationHeaders(),
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Idempotency-Key": op.key,
+          },
+          body: op.method === "DELETE" ? undefined : op.body,
         });
+      } catch (e) {
+        // Offline or the server is unreachable: keep everything and try again later
+        setOutboxState("offline");
+        scheduleOutboxRetry();
+        break;
+      }
+
+      const retryable = resp.status >= 500 || resp.status === 429 || (resp.status === 409 && resp.headers.has("Retry-After"));
+      if (retryable && op.attempts + 1 < OUTBOX_MAX_ATTEMPTS) {
+        op.attempts += 1;
+        await outboxSave(op);
+        scheduleOutboxRetry();
+        break;
+      }
+      await outboxRemove(op.id);
+      outbox.retryMs = 1000;
+      if (resp.ok) {
+        lastHtml = await resp.text();
       } else {
-        // Single plan view - original behavior
-        const overlapClass = group.length === 2 ? "overlap-2" : "overlap-3";
-        
-        group.forEach((entry, idx) => {
-          entry.classList.add(overlapClass);
-          if (idx > 0) {
-            entry.classList.add(`overlap-pos-${idx}`);
-          }
-        });
+        let detail = resp.statusText;
+        try {
+          detail = (await resp.json()).detail || detail;
+        } catch (e) { /* not JSON */ }
+        rejected.push(`${op.label}: ${detail}`);
       }
+    }
+  } finally {
+    outbox.inFlight = null;
+    outbox.flushing = false;
+  }
+
+  if (drained) setOutboxState("");
+  if (rejected.length) {
+    // The grid shows changes the server refused; reload the week as the server has it
+    weekCache.clear();
+    showFlushedSchedule(null);
+    alert(`Some changes could not be saved:\n${rejected.join("\n")}`);
+  } else if (drained && lastHtml !== null) {
+    showFlushedSchedule(lastHtml);
+  }
+}
+
+function showFlushedSchedule(html) {
+  // Show the week as the server has it after a flush: its last response, or a reload
+  window.clearTimeout(outbox.swapTimer);
+  // Swapping mid-drag would detach the dragged entry, so wait for the drop
+  if (window.dragState) {
+    outbox.swapTimer = window.setTimeout(() => {
+      // Unless the drop queued a newer change, whose flush brings newer markup
+      if (!outbox.pending) showFlushedSchedule(html);
+    }, 100);
+    return;
+  }
+  const template = document.createElement("template");
+  template.innerHTML = html || "";
+  const next = template.content.querySelector("#schedule");
+  if (html !== null && next && next.dataset.weekStart === getWeekStart()) {
+    replaceScheduleHtml(html);
+  } else {
+    weekCache.clear();
+    refreshScheduleWithPlans();
+  }
+}
+
+function setupOutbox() {
+  window.addEventListener("online", () => {
+    outbox.retryMs = 1000;
+    flushOutbox();
+  });
+  // Changes queued before a reload or while offline go out now
+  flushOutbox();
+}
+
+/* ---------- OPTIMISTIC GRID UPDATES ---------- */
+function placeEntry(el, day, startMinute, duration) {
+  // Position an entry as the server would; the next morph replaces it with the server's markup
+  const schedule = document.getElementById("schedule");
+  const meta = schedule ? extractMeta(schedule) : null;
+  const col = schedule ? schedule.querySelector(`.day-col[data-day="${day}"]`) : null;
+  if (!meta || !col) return;
+  const endMinute = startMinute + duration;
+  el.style.top = `${Math.round(((startMinute - meta.dayStart) / meta.slotMinutes) * meta.slotHeight)}px`;
+  el.style.height = `${Math.round((duration / meta.slotMinutes) * meta.slotHeight)}px`;
+  el.dataset.day = day;
+  el.dataset.startMinute = String(startMinute);
+  el.dataset.endMinute = String(endMinute);
+  el.dataset.duration = String(duration);
+  const label = el.querySelector(".entry-meta");
+  if (label) label.textContent = `${minutesToTime(startMinute)} – ${minutesToTime(endMinute)}`;
+  el.classList.remove("overlap");
+  el.classList.add("is-pending");
+  el.morphHtml = null;
+  if (el.parentElement !== col) col.appendChild(el);
+}
+
+function removeEntries(selector) {
+  const schedule = document.getElementById("schedule");
+  if (schedule) schedule.querySelectorAll(selector).forEach((el) => el.remove());
+}
+
+let pendingEntrySeq = 0;
+
+// A placeholder has no server id until the refresh after its create lands,
+// so it cannot be moved, resized or opened yet.
+function isPlaceholderEntry(el) {
+  return el.dataset.pendingId !== undefined;
+}
+
+function addPendingEntry(day, startMinute, duration, title, color) {
+  const el = document.createElement("div");
+  el.className = "entry is-pending";
+  el.dataset.pendingId = String(++pendingEntrySeq);
+  el.style.borderColor = color;
+  el.style.background = `${color}30`;
+  const content = document.createElement("div");
+  content.className = "entry-content";
+  const titleEl = document.createElement("div");
+  titleEl.className = "entry-title";
+  titleEl.textContent = title;
+  const metaEl = document.createElement("div");
+  metaEl.className = "entry-meta";
+  content.append(titleEl, metaEl);
+  el.appendChild(content);
+  placeEntry(el, day, startMinute, duration);
+  return el;
+}
+
+function findEntry(selector) {
+  const schedule = document.getElementById("schedule");
+  return schedule ? schedule.querySelector(selector) : null;
+}
+
+/* ─────────────────────────────────────────────────────────
+   Week navigation - cached weeks, idle prefetch and revalidation
+───────────────────────────────────────────────────────── */
+const WEEK_CACHE_SIZE = 8;
+
+// Rendered weeks by schedule URL (week plus plan selection), least recently used first
+const weekCache = {
+  entries: new Map(),
+  get(key) {
+    const entry = this.entries.get(key);
+    if (entry) {
+      this.entries.delete(key);
+      this.entries.set(key, entry);
+    }
+    return entry;
+  },
+  set(key, entry) {
+    this.entries.delete(key);
+    this.entries.set(key, entry);
+    while (this.entries.size > WEEK_CACHE_SIZE) {
+      this.entries.delete(this.entries.keys().next().value);
+    }
+  },
+  clear() {
+    this.entries.clear();
+  },
+};
+let weekLoadSeq = 0;
+let weekPrefetchHandle = null;
+
+function weekScheduleUrl(weekStart) {
+  return addPlanIdsToUrl(`/schedule?week=${weekStart}`, getSelectedPlanIds());
+}
+
+async function fetchWeek(url, cached) {
+  // Resolves to the cache entry for `url`, refreshed unless the server answers 304
+  const headers = cached && cached.etag ? { "If-None-Match": cached.etag } : {};
+  const resp = await fetch(url, { headers });
+  if (resp.status === 304 && cached) return cached;
+  if (!resp.ok) throw new Error(`Week request failed: ${resp.status}`);
+  const entry = { html: await resp.text(), etag: resp.headers.get("ETag") };
+  weekCache.set(url, entry);
+  return entry;
+}
+
+async function showWeek(weekStart, options = {}) {
+  // Show a cached week at once, then revalidate it; uncached weeks wait for the server
+  const url = weekScheduleUrl(weekStart);
+  const cached = weekCache.get(url);
+  const seq = ++weekLoadSeq;
+  if (options.push) {
+    const pageUrl = addPlanIdsToUrl(`/?week=${weekStart}`, getSelectedPlanIds());
+    window.history.pushState({ week: weekStart }, "", pageUrl);
+  }
+  if (cached) replaceScheduleHtml(cached.html, { fromWeekCache: true });
+
+  try {
+    const entry = await fetchWeek(url, cached);
+    // A newer navigation won, or nothing changed since the cached copy was shown
+    if (seq !== weekLoadSeq || entry === cached) return;
+    if (window.dragState) return;
+    replaceScheduleHtml(entry.html, { fromWeekCache: true });
+  } catch (e) {
+    if (!cached && seq === weekLoadSeq && options.push) window.location.reload();
+  } finally {
+    if (seq === weekLoadSeq) connectLiveUpdates();
+  }
+}
+
+function scheduleWeekPrefetch() {
+  // Fetch the neighbouring weeks when the browser is idle, unless data saving is on
+  const connection = navigator.connection;
+  if (connection && connection.saveData) return;
+  const idle = window.requestIdleCallback || ((fn) => window.setTimeout(fn, 200));
+  const cancel = window.cancelIdleCallback || window.clearTimeout;
+  if (weekPrefetchHandle !== null) cancel(weekPrefetchHandle);
+  weekPrefetchHandle = idle(() => {
+    weekPrefetchHandle = null;
+    const schedule = document.getElementById("schedule");
+    if (!schedule) return;
+    [schedule.dataset.nextWeek, schedule.dataset.prevWeek].forEach((weekStart) => {
+      if (!weekStart) return;
+      const url = weekScheduleUrl(weekStart);
+      if (!weekCache.get(url)) fetchWeek(url, null).catch(() => {});
+    });
+  }, { timeout: 2000 });
+}
+
+function syncWeekHeader() {
+  // The header and the modal forms live outside #schedule, so point them at the week now shown
+  const schedule = document.getElementById("schedule");
+  if (!schedule) return;
+  const label = document.querySelector(".week-label");
+  if (label && schedule.dataset.weekLabel) label.textContent = `Week of ${schedule.dataset.weekLabel}`;
+  document.querySelectorAll("[data-week-nav]").forEach((link) => {
+    const weekStart = schedule.dataset[`${link.dataset.weekNav}Week`];
+    if (!weekStart) return;
+    link.dataset.week = weekStart;
+    link.href = link.dataset.weekNav === "this" ? "/" : `/?week=${weekStart}`;
+  });
+  document.querySelectorAll("[data-shown-week]").forEach((input) => {
+    input.value = schedule.dataset.weekStart;
+  });
+  const copyBtn = document.querySelector(".copy-week-btn");
+  if (copyBtn && schedule.dataset.prevWeek) {
+    copyBtn.setAttribute("hx-vals", JSON.stringify({
+      source_week: schedule.dataset.prevWeek,
+      target_week: schedule.dataset.weekStart,
+    }));
+  }
+}
+
+function setupWeekNavigation() {
+  syncWeekHeader();
+  const weekStart = getWeekStart();
+  if (weekStart) window.history.replaceState({ week: weekStart }, "", window.location.href);
+
+  document.querySelectorAll("[data-week-nav]").forEach((link) => {
+    link.addEventListener("click", (e) => {
+      if (e.button !== 0 || e.metaKey || e.ctrlKey || e.shiftKey || e.altKey) return;
+      if (!link.dataset.week || window.dragState) return;
+      e.preventDefault();
+      if (link.dataset.week !== getWeekStart()) showWeek(link.dataset.week, { push: true });
     });
   });
+  window.addEventListener("popstate", (e) => {
+    if (e.state && e.state.week) showWeek(e.state.week);
+  });
+  scheduleWeekPrefetch();
+}
+
+function registerServiceWorker() {
+  // Serves fingerprinted static assets from the cache; see /sw.js
+  if (!("serviceWorker" in navigator)) return;
+  window.addEventListener("load", () => {
+    navigator.serviceWorker.register("/sw.js").catch(() => {});
+  });
+}
+
+/* ─────────────────────────────────────────────────────────
+   Live updates - refresh when another tab or device changes this week
+───────────────────────────────────────────────────────── */
+let liveSource = null;
+let liveSourceKey = null;
+let liveRefreshTimer = null;
+
+function connectLiveUpdates() {
+  if (typeof EventSource === "undefined") return;
+  const weekStart = getWeekStart();
+  if (!weekStart) return;
+
+  const url = new URL("/events", window.location.origin);
+  url.searchParams.set("week", weekStart);
+  const planIds = getSelectedPlanIds();
+  if (planIds.length > 0) url.searchParams.set("plans", planIds.join(","));
+
+  const key = url.search;
+  if (liveSource && liveSourceKey === key) return;
+  if (liveSource) liveSource.close();
+
+  liveSourceKey = key;
+  liveSource = new EventSource(url.toString());
+  liveSource.addEventListener("change", (evt) => {
+    let change = null;
+    try {
+      change = JSON.parse(evt.data);
+    } catch (e) {
+      return;
+    }
+    if (change.origin === CLIENT_ID) return;
+    scheduleLiveRefresh();
+  });
+}
+
+function scheduleLiveRefresh() {
+  // Coalesce bursts of changes into one refresh
+  window.clearTimeout(liveRefreshTimer);
+  liveRefreshTimer = window.setTimeout(() => {
+    // Refreshing mid-drag or with queued changes would undo what the user sees
+    if (window.dragState || outbox.pending) {
+      scheduleLiveRefresh();
+      return;
+    }
+    weekCache.clear();
+    refreshScheduleWithPlans();
+  }, 250);
 }
@@ -0,0 +1,67 @@
+// Service worker: keeps static assets in a local cache so pages load without
+// waiting on the network. Fingerprinted URLs (?v=<hash>) never change, so they
+// are served cache-first; other assets are served from the cache and
+// refreshed in the background. Pages and API requests are left alone.
+const CACHE = "planner-static-v1";
+const CDN_ASSETS = ["https://unpkg.com/htmx.org@1.9.12"];
+
+self.addEventListener("install", () => {
+  self.skipWaiting();
+});
+
+self.addEventListener("activate", (event) => {
+  event.waitUntil((async () => {
+    const names = await caches.keys();
+    await Promise.all(names.filter((name) => name !== CACHE).map((name) => caches.delete(name)));
+    await self.clients.claim();
+  })());
+});
+
+async function dropOtherVersions(cache, url) {
+  // A new fingerprint replaces the old copies of the same file
+  const requests = await cache.keys();
+  await Promise.all(requests
+    .filter((request) => {
+      const cached = new URL(request.url);
+      return cached.pathname === url.pathname && cached.search !== url.search;
+    })
+    .map((request) => cache.delete(request)));
+}
+
+async function cacheFirst(request, url) {
+  const cache = await caches.open(CACHE);
+  const hit = await cache.match(request);
+  if (hit) return hit;
+  const response = await fetch(request);
+  if (response.ok || response.type === "opaque") {
+    await cache.put(request, response.clone());
+    if (url.origin === self.location.origin) await dropOtherVersions(cache, url);
+  }
+  return response;
+}
+
+async function staleWhileRevalidate(event, request) {
+  const cache = await caches.open(CACHE);
+  const hit = await cache.match(request);
+  const refresh = fetch(request).then(async (response) => {
+    if (response.ok) await cache.put(request, response.clone());
+    return response;
+  });
+  if (hit) {
+    event.waitUntil(refresh.catch(() => {}));
+    return hit;
+  }
+  return refresh;
+}
+
+self.addEventListener("fetch", (event) => {
+  const request = event.request;
+  if (request.method !== "GET") return;
+  const url = new URL(request.url);
+
+  if (CDN_ASSETS.includes(request.url)) {
+    event.respondWith(cacheFirst(request, url));
+  } else if (url.origin === self.location.origin && url.pathname.startsWith("/static/")) {
+    event.respondWith(url.searchParams.has("v") ? cacheFirst(request, url) : staleWhileRevalidate(event, request));
+  }
+});
@@ -0,0 +1,123 @@
+"""
+Time analytics: minutes per block type, plan, day period and weekday.
+
+One-off entries are aggregated in SQL over the indexed entry_date column,
+in the archive too when the range reaches archived weeks. Recurring instances
+only exist after expansion, so they are packed into NumPy arrays and
+aggregated with bincount. Both halves are then summed.
+"""
+from collections import Counter
+from datetime import date
+
+import numpy as np
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from .archive import ArchivedEntry, archived_before
+from .config import DAY_ORDER, PERIODS
+from .dates import DAY_INDEX
+from .models import BlockType, Plan, ScheduleEntry
+from .recurring import instances_in_range
+
+SHARED_PLAN = 0  # bincount key for entries that belong to no plan
+
+
+def _period_overlap_sql(entry, period: dict):
+    """Minutes of an entry that fall inside `period`, as a SQL expression."""
+    entry_end = entry.start_minute + entry.duration_minutes
+    return func.max(0, func.min(entry_end, period["end"]) - func.max(entry.start_minute, period["start"]))
+
+
+def _entry_totals(session: Session, entry, start: date, end: date, plan_ids: list[int] | None) -> dict[str, Counter]:
+    filters = [entry.entry_date >= start, entry.entry_date <= end]
+    if plan_ids is not None:
+        filters.append(entry.plan_id.in_(plan_ids) | (entry.plan_id == None))
+    minutes = func.sum(entry.duration_minutes)
+
+    def grouped(column) -> Counter:
+        rows = session.exec(select(column, minutes).where(*filters).group_by(column)).all()
+        return Counter({key: total for key, total in rows})
+
+    period_row = session.exec(
+        select(*(func.coalesce(func.sum(_period_overlap_sql(entry, p)), 0) for p in PERIODS)).where(*filters)
+    ).one()
+    plans = grouped(entry.plan_id)
+    return {
+        "block_types": grouped(entry.block_type_id),
+        "plans": Counter({SHARED_PLAN if k is None else k: v for k, v in plans.items()}),
+        "weekdays": grouped(entry.day),
+        "periods": Counter({p["name"]: total for p, total in zip(PERIODS, period_row)}),
+    }
+
+
+def entry_totals(session: Session, start: date, end: date, plan_ids: list[int] | None) -> dict[str, Counter]:
+    """Aggregate one-off entries, live and archived, with one grouped query per dimension."""
+    totals = _entry_totals(session, ScheduleEntry, start, end, plan_ids)
+    cutoff = archived_before(session)
+    if cutoff is not None and start < cutoff:
+        for key, counter in _entry_totals(session, ArchivedEntry, start, end, plan_ids).items():
+            totals[key].update(counter)
+    return totals
+
+
+def instance_totals(instances: list[dict]) -> dict[str, Counter]:
+    """Aggregate expanded recurring instances with vectorized bincounts."""
+    if not instances:
+        return {"block_types": Counter(), "plans": Counter(), "weekdays": Counter(), "periods": Counter()}
+    count = len(instances)
+    starts = np.fromiter((i["start_minute"] for i in instances), dtype=np.int64, count=count)
+    durations = np.fromiter((i["duration_minutes"] for i in instances), dtype=np.int64, count=count)
+    block_types = np.fromiter((i["block_type"].id if i["block_type"] else 0 for i in instances), dtype=np.int64, count=count)
+    plans = np.fromiter((i["plan_id"] or SHARED_PLAN for i in instances), dtype=np.int64, count=count)
+    weekdays = np.fromiter((DAY_INDEX.get(i["day"], 0) for i in instances), dtype=np.int64, count=count)
+    ends = starts + durations
+
+    def by_key(keys: np.ndarray) -> Counter:
+        totals = np.bincount(keys, weights=durations)
+        present = np.flatnonzero(np.bincount(keys))
+        return Counter({int(k): int(totals[k]) for k in present})
+
+    periods = Counter({
+        p["name"]: int(np.clip(np.minimum(ends, p["end"]) - np.maximum(starts, p["start"]), 0, None).sum())
+        for p in PERIODS
+    })
+    return {
+        "block_types": by_key(block_types),
+        "plans": by_key(plans),
+        "weekdays": Counter({DAY_ORDER[k]: v for k, v in by_key(weekdays).items()}),
+        "periods": periods,
+    }
+
+
+def time_stats(session: Session, start: date, end: date, plan_ids: list[int] | None = None) -> dict:
+    """Minutes scheduled between `start` and `end` (inclusive), broken down four ways."""
+    totals = entry_totals(session, start, end, plan_ids)
+    for key, counter in instance_totals(instances_in_range(session, start, end, plan_ids)).items():
+        totals[key].update(counter)
+
+    block_types = {b.id: b for b in session.exec(select(BlockType)).all()}
+    plans = {p.id: p for p in session.exec(select(Plan)).all()}
+    return {
+        "start": start,
+        "end": end,
+        "total_minutes": sum(totals["block_types"].values()),
+        "block_types": [
+            {
+                "id": block_id,
+                "name": block_types[block_id].name if block_id in block_types else None,
+                "color": block_types[block_id].color if block_id in block_types else None,
+                "minutes": minutes,
+            }
+            for block_id, minutes in totals["block_types"].most_common()
+        ],
+        "plans": [
+            {
+                "id": None if plan_id == SHARED_PLAN else plan_id,
+                "name": plans[plan_id].name if plan_id in plans else None,
+                "minutes": minutes,
+            }
+            for plan_id, minutes in totals["plans"].most_common()
+        ],
+        "periods": [{"name": p["name"], "minutes": totals["periods"][p["name"]]} for p in PERIODS],
+        "weekdays": [{"day": day, "minutes": totals["weekdays"][day]} for day in DAY_ORDER],
+    }
@@ -0,0 +1,94 @@
+"""
+Incremental sync based on the changelog revision.
+
+SQLite triggers (see db.install_change_log_triggers) append a changelog row
+for every insert, update and delete of the synced tables, including the bulk
+``INSERT ... SELECT`` statements in weeks.py. A client remembers the last
+revision it saw and asks for everything after it; several changes to the same
+row collapse into its current state, or just its id once it is gone.
+Restoring a snapshot replaces the log, so it ends with a "reset" row above
+every revision handed out before; clients that synced before it reload.
+"""
+from datetime import datetime
+
+from sqlalchemy import func, text
+from sqlmodel import Session, select
+
+from .models import BlockType, ChangeLog, Plan, RecurringException, RecurringTask, ScheduleEntry
+
+# Table name -> (key in sync payloads, model)
+SYNCED_TABLES = {
+    "scheduleentry": ("entries", ScheduleEntry),
+    "recurringtask": ("recurring_tasks", RecurringTask),
+    "recurringexception": ("recurring_exceptions", RecurringException),
+    "blocktype": ("block_types", BlockType),
+    "plan": ("plans", Plan),
+}
+
+
+def current_revision(session: Session) -> int:
+    """The latest revision, or 0 before anything was recorded."""
+    return session.exec(select(func.max(ChangeLog.rev))).one() or 0
+
+
+def highest_revision(session: Session) -> int:
+    """The highest revision ever handed out, including ones no longer in the log."""
+    seq = session.exec(text("SELECT seq FROM sqlite_sequence WHERE name = 'changelog'")).first()
+    return max(current_revision(session), seq[0] if seq else 0)
+
+
+def mark_reset(session: Session, above: int) -> None:
+    """Log a reset after the database was replaced, numbered above `above` and the restored log."""
+    session.add(ChangeLog(
+        rev=max(above, current_revision(session)) + 1,
+        table_name="*", row_id=0, op="reset", changed_at=datetime.utcnow(),
+    ))
+
+
+def changes_since(session: Session, since: int) -> dict:
+    """Collapse changelog rows after `since` into upserted rows and deleted ids per table.
+
+    A `since` ahead of the log or from before a restore (see mark_reset)
+    cannot be answered incrementally; the payload then carries
+    ``"reset": true`` and the client should reload everything.
+    """
+    rev = current_revision(session)
+    if since > rev:
+        return {"rev": rev, "reset": True, "changes": {}}
+    if since == rev:
+        return {"rev": rev, "reset": False, "changes": {}}
+    if since and session.exec(
+        select(ChangeLog.rev).where(ChangeLog.rev > since, ChangeLog.op == "reset").limit(1)
+    ).first():
+        return {"rev": rev, "reset": True, "changes": {}}
+
+    latest = (
+        select(func.max(ChangeLog.rev))
+        .where(ChangeLog.rev > since, ChangeLog.rev <= rev)
+        .group_by(ChangeLog.table_name, ChangeLog.row_id)
+    )
+    rows = session.exec(
+        select(ChangeLog.table_name, ChangeLog.row_id, ChangeLog.op).where(ChangeLog.rev.in_(latest))
+    ).all()
+
+    touched: dict[str, dict[str, set[int]]] = {}
+    for table_name, row_id, op in rows:
+        bucket = touched.setdefault(table_name, {"upserted": set(), "deleted": set()})
+        bucket["deleted" if op == "delete" else "upserted"].add(row_id)
+
+    changes = {}
+    for table_name, bucket in touched.items():
+        if table_name not in SYNCED_TABLES:
+            continue
+        key, model = SYNCED_TABLES[table_name]
+        found = (
+            session.exec(select(model).where(model.id.in_(bucket["upserted"]))).all()
+            if bucket["upserted"] else []
+        )
+        # A row updated after `rev` was read but deleted since is reported as deleted
+        missing = bucket["upserted"] - {row.id for row in found}
+        changes[key] = {
+            "upserted": [row.model_dump(mode="json") for row in found],
+            "deleted": sorted(bucket["deleted"] | missing),
+        }
+    return {"rev": rev, "reset": False, "changes": changes}
@@ -0,0 +1,49 @@
+"""
+Jinja environment for the app's templates.
+
+In development templates are recompiled whenever their file changes. In
+production (PLANNER_TEMPLATE_MODE=production) auto-reload is off and compiled
+templates go to a filesystem bytecode cache shared by every worker, which
+``python -m app.templating`` can fill ahead of time, e.g. while building the
+image, so no worker compiles templates on its first requests.
+"""
+from pathlib import Path
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from .assets import asset_url
+from .config import TEMPLATE_CACHE_DIR, TEMPLATE_MODE
+
+TEMPLATES_DIR = Path(__file__).parent / "templates"
+
+
+def make_environment(mode: str = TEMPLATE_MODE, cache_dir: str | None = TEMPLATE_CACHE_DIR) -> Environment:
+    production = mode == "production"
+    bytecode_cache = None
+    if production:
+        if cache_dir:
+            Path(cache_dir).mkdir(parents=True, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(cache_dir)
+        else:
+            bytecode_cache = FileSystemBytecodeCache()
+    env = Environment(
+        loader=FileSystemLoader(TEMPLATES_DIR),
+        autoescape=True,
+        auto_reload=not production,
+        bytecode_cache=bytecode_cache,
+    )
+    env.globals["asset_url"] = asset_url
+    return env
+
+
+def precompile(env: Environment) -> int:
+    """Compile every template, filling the bytecode cache. Returns the number compiled."""
+    names = env.list_templates(extensions=("html",))
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+if __name__ == "__main__":
+    count = precompile(make_environment(mode="production"))
+    print(f"Compiled {count} template(s) into the bytecode cache")
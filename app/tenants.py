@@ -0,0 +1,414 @@
+"""
+Multi-tenant mode: one SQLite database per user.
+
+With PLANNER_TENANT_MODE=header or basic, every request is tied to a user.
+In header mode the user comes from PLANNER_TENANT_HEADER, which an
+authenticating reverse proxy must set, and strip from client requests. In
+basic mode the user comes from HTTP Basic credentials, checked against
+PLANNER_TENANT_USERS_FILE (see ``python -m app.tenants add-user``). The
+request then runs against PLANNER_TENANT_DIR/<user>.db. Code reaches it
+through ``db.get_engine()``, and jobs started by the request inherit it. So
+users only contend for their own write lock.
+
+Each worker keeps an LRU registry of open tenant engines. A database is
+created and migrated (schema patches, default palette and plan, recurring
+horizon) the first time a worker opens it. A file lock keeps workers from
+preparing the same new database twice at once. Past PLANNER_TENANT_CACHE_SIZE
+open tenants, the least recently used idle ones are closed. Tenants idle for
+PLANNER_TENANT_IDLE_SECONDS are closed in the background. A tenant with a
+request in flight, including an open /events stream, is never closed.
+Scheduled archival and the recurring horizon refresh run against every open
+tenant as well as the shared database (``run_everywhere``).
+
+Usage: python -m app.tenants add-user NAME | remove-user NAME | list
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import getpass
+import hashlib
+import hmac
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Iterator
+
+from fastapi import HTTPException
+from sqlalchemy import Engine
+from sqlmodel import Session
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from . import db
+from .config import (
+    TENANT_CACHE_SIZE, TENANT_DIR, TENANT_HEADER, TENANT_IDLE_SECONDS, TENANT_MODE, TENANT_USERS_FILE,
+)
+from .jobs import fail_interrupted_jobs
+from .recurring import ensure_horizon
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger("uvicorn.error")
+
+# A name may not end in ".archive": <name>.archive.db is the archive of <name>
+TENANT_NAME = re.compile(r"^(?!.*\.archive$)[a-z0-9][a-z0-9_.@-]{0,63}$")
+# Served the same to everyone, or guarded by their own admin tokens
+SHARED_PATHS = ("/static", "/sw.js", "/profiles", "/diagnostics")
+PBKDF2_ITERATIONS = 200_000
+REALM = 'Basic realm="planner", charset="UTF-8"'
+# Jobs created before this process started cannot be running in any current worker
+STARTED_AT = datetime.utcnow()
+
+
+# ─────────────────────────── USERS ───────────────────────────────────────────
+
+def hash_password(password: str, iterations: int = PBKDF2_ITERATIONS) -> str:
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"pbkdf2_sha256${iterations}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password: str, encoded: str) -> bool:
+    try:
+        algorithm, iterations, salt, expected = encoded.split("$")
+        if algorithm != "pbkdf2_sha256":
+            return False
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+def read_users(path: str) -> dict[str, str]:
+    """`name:password hash` per line; blank lines and # comments are skipped."""
+    users = {}
+    with open(path) as lines:
+        for line in lines:
+            line = line.strip()
+            if line and not line.startswith("#") and ":" in line:
+                name, encoded = line.split(":", 1)
+                users[name.strip()] = encoded.strip()
+    return users
+
+
+def write_users(path: str, users: dict[str, str]) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".part", "w") as out:
+        for name, encoded in sorted(users.items()):
+            out.write(f"{name}:{encoded}\n")
+    os.replace(path + ".part", path)
+
+
+class UserFile:
+    """The users file, reread when it changes, plus credentials already verified against it.
+
+    PBKDF2 is slow on purpose, so a verified Authorization header is
+    remembered (as a hash) until the file changes.
+    """
+
+    def __init__(self) -> None:
+        self.mtime: int | None = None
+        self.users: dict[str, str] = {}
+        self.verified: dict[bytes, str] = {}
+        self._lock = threading.Lock()
+
+    def authenticate(self, authorization: str) -> str | None:
+        path = TENANT_USERS_FILE
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        key = hashlib.sha256(authorization.encode()).digest()
+        with self._lock:
+            if mtime != self.mtime:
+                self.users, self.verified, self.mtime = read_users(path), {}, mtime
+            if key in self.verified:
+                return self.verified[key]
+            users = self.users
+        name, password = _basic_credentials(authorization)
+        if name is None or name not in users or not verify_password(password, users[name]):
+            return None
+        with self._lock:
+            self.verified[key] = name
+        return name
+
+
+def _basic_credentials(authorization: str) -> tuple[str | None, str]:
+    scheme, _, encoded = authorization.partition(" ")
+    if scheme.lower() != "basic":
+        return None, ""
+    try:
+        name, _, password = base64.b64decode(encoded, validate=True).decode().partition(":")
+    except (binascii.Error, UnicodeDecodeError):
+        return None, ""
+    return name.strip().lower(), password
+
+
+user_file = UserFile()
+
+
+def identify(scope: Scope) -> str:
+    """The user a request belongs to; HTTPException if it cannot be told or is not allowed."""
+    headers = Headers(scope=scope)
+    if TENANT_MODE == "basic":
+        name = user_file.authenticate(headers.get("authorization", ""))
+        if name is None:
+            raise HTTPException(status_code=401, detail="Sign in required", headers={"WWW-Authenticate": REALM})
+    else:
+        name = (headers.get(TENANT_HEADER) or "").strip().lower()
+        if not name:
+            raise HTTPException(status_code=401, detail=f"Missing {TENANT_HEADER} header")
+    if not TENANT_NAME.match(name):
+        raise HTTPException(status_code=400, detail="Invalid user name")
+    return name
+
+
+# ─────────────────────────── ENGINES ─────────────────────────────────────────
+
+def tenant_path(name: str, suffix: str = ".db") -> str:
+    """Where a user's files live: their database, and next to it their archive and job files."""
+    return os.path.join(TENANT_DIR, f"{name}{suffix}")
+
+
+@contextmanager
+def _file_lock(path: str) -> Iterator[None]:
+    """Exclusive lock across worker processes (a no-op where flock is missing)."""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def prepare_tenant_database() -> None:
+    """Create or migrate the current tenant's database (the per-database part of startup)."""
+    db.init_db()
+    db.seed_defaults()
+    with Session(db.get_engine()) as session:
+        ensure_horizon(session)
+        fail_interrupted_jobs(session, before=STARTED_AT)
+        session.commit()
+
+
+@dataclass(eq=False)
+class Tenant:
+    name: str
+    engine: Engine
+    prepared: bool = False
+    active: int = 0  # requests in flight
+    last_used: float = field(default_factory=time.monotonic)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class TenantRegistry:
+    """Open tenant engines, least recently used first."""
+
+    def __init__(self, capacity: int = TENANT_CACHE_SIZE, idle_seconds: int = TENANT_IDLE_SECONDS) -> None:
+        self.capacity = capacity
+        self.idle_seconds = idle_seconds
+        self.tenants: OrderedDict[str, Tenant] = OrderedDict()
+        self.opened = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, name: str) -> Tenant:
+        """The tenant's engine, opened if needed; pair with release()."""
+        with self._lock:
+            tenant = self.tenants.get(name)
+            if tenant is None:
+                tenant = Tenant(name, db.make_engine(f"sqlite:///{tenant_path(name)}"))
+                self.tenants[name] = tenant
+                self.opened += 1
+            self.tenants.move_to_end(name)
+            tenant.active += 1
+            tenant.last_used = time.monotonic()
+            closing = self._take(lambda t: len(self.tenants) > self.capacity)
+        self._close(closing)
+        return tenant
+
+    def release(self, tenant: Tenant) -> None:
+        with self._lock:
+            tenant.active -= 1
+            tenant.last_used = time.monotonic()
+            if tenant.name in self.tenants:
+                self.tenants.move_to_end(tenant.name)
+
+    def prepare(self, tenant: Tenant) -> None:
+        """Create and migrate the tenant's database, once per worker."""
+        with tenant.lock:
+            if tenant.prepared:
+                return
+            path = tenant_path(tenant.name)
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with _file_lock(path + ".lock"), db.use_engine(tenant.engine, tenant.name):
+                prepare_tenant_database()
+            tenant.prepared = True
+
+    def run_on_open(self, work: Callable, *args) -> None:
+        """Run work(*args) against each open, prepared tenant database in turn.
+
+        A tenant is pinned while its turn runs, so it is not closed underneath
+        the work, but its last use is left alone: background work does not keep
+        an idle tenant open. A failure is logged and the next tenant still runs.
+        """
+        with self._lock:
+            names = [name for name, t in self.tenants.items() if t.prepared]
+        for name in names:
+            with self._lock:
+                tenant = self.tenants.get(name)
+                if tenant is None:
+                    continue
+                tenant.active += 1
+            try:
+                with db.use_engine(tenant.engine, name):
+                    work(*args)
+            except Exception:  # noqa: BLE001 - one broken database must not stop the others
+                logger.exception("Background %s failed for tenant %s", work.__name__, name)
+            finally:
+                with self._lock:
+                    tenant.active -= 1
+
+    def evict_idle(self) -> int:
+        """Close tenants idle for longer than idle_seconds. Returns how many were closed."""
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            closing = self._take(lambda t: t.last_used < cutoff)
+        self._close(closing)
+        return len(closing)
+
+    def close_all(self) -> None:
+        with self._lock:
+            closing = list(self.tenants.values())
+            self.tenants.clear()
+        self._close(closing)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "open": len(self.tenants),
+                "capacity": self.capacity,
+                "opened": self.opened,
+                "evicted": self.evicted,
+                "tenants": {
+                    name: {"active": t.active, "idle_seconds": round(now - t.last_used, 1), "pool": t.engine.pool.status()}
+                    for name, t in self.tenants.items()
+                },
+            }
+
+    def _take(self, should_close) -> list[Tenant]:
+        """Remove idle tenants, oldest first, while should_close(tenant) holds. Call with the lock held."""
+        closing = []
+        for tenant in list(self.tenants.values()):
+            if tenant.active or not should_close(tenant):
+                continue
+            del self.tenants[tenant.name]
+            closing.append(tenant)
+        self.evicted += len(closing)
+        return closing
+
+    @staticmethod
+    def _close(tenants: list[Tenant]) -> None:
+        for tenant in tenants:
+            tenant.engine.dispose()
+
+
+registry = TenantRegistry()
+
+
+def run_everywhere(work: Callable, *args) -> None:
+    """Run work(*args) against the shared database, then every open tenant's."""
+    try:
+        work(*args)
+    except Exception:  # noqa: BLE001 - the tenants still get their turn
+        logger.exception("Background %s failed for the shared database", work.__name__)
+    registry.run_on_open(work, *args)
+
+
+async def evict_idle_tenants_periodically() -> None:
+    while True:
+        await asyncio.sleep(max(registry.idle_seconds / 4, 1))
+        await asyncio.to_thread(registry.evict_idle)
+
+
+class TenantMiddleware:
+    """Run each request against its user's database in multi-tenant mode."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if TENANT_MODE == "off" or scope["type"] != "http" or scope["path"].startswith(SHARED_PATHS):
+            await self.app(scope, receive, send)
+            return
+        try:
+            name = await asyncio.to_thread(identify, scope) if TENANT_MODE == "basic" else identify(scope)
+        except HTTPException as exc:
+            await JSONResponse({"detail": exc.detail}, status_code=exc.status_code, headers=exc.headers)(scope, receive, send)
+            return
+        tenant = registry.acquire(name)
+        try:
+            if not tenant.prepared:
+                await asyncio.to_thread(registry.prepare, tenant)
+            with db.use_engine(tenant.engine, name):
+                await self.app(scope, receive, send)
+        finally:
+            registry.release(tenant)
+
+
+# ─────────────────────────── CLI ─────────────────────────────────────────────
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.tenants", description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add-user", help="add a user or change their password (read from stdin when piped)")
+    add.add_argument("name")
+    remove = commands.add_parser("remove-user", help="remove a user's login (their database is kept)")
+    remove.add_argument("name")
+    commands.add_parser("list", help="list users and their database sizes")
+    args = parser.parse_args(argv)
+
+    users = read_users(TENANT_USERS_FILE) if os.path.exists(TENANT_USERS_FILE) else {}
+    if args.command == "list":
+        names = set(users)
+        if os.path.isdir(TENANT_DIR):
+            names |= {f[:-3] for f in os.listdir(TENANT_DIR) if f.endswith(".db") and not f.endswith(".archive.db")}
+        for name in sorted(names):
+            path = tenant_path(name)
+            size = f"{os.path.getsize(path) / 1024:.0f} KiB" if os.path.exists(path) else "no database yet"
+            print(f"  {name:32} {'login' if name in users else 'no login':>8} {size:>16}")
+        return
+    name = args.name.strip().lower()
+    if not TENANT_NAME.match(name):
+        parser.error("user names are lowercase letters, digits and _ . @ -, up to 64 characters, not ending in .archive")
+    if args.command == "add-user":
+        password = getpass.getpass(f"Password for {name}: ") if sys.stdin.isatty() else sys.stdin.readline().rstrip("\n")
+        if not password:
+            parser.error("empty password")
+        users[name] = hash_password(password)
+        print(f"Saved {name} to {TENANT_USERS_FILE}")
+    elif users.pop(name, None) is None:
+        parser.error(f"no user {name}")
+    else:
+        print(f"Removed {name}; {tenant_path(name)} was kept")
+    write_users(TENANT_USERS_FILE, users)
+
+
+if __name__ == "__main__":
+    main()
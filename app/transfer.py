@@ -0,0 +1,228 @@
+"""
+CSV archive export and import.
+
+Both directions stream: export writes rows to the ZIP in batches as they are
+read, import parses each CSV member straight from the archive and inserts it
+in batches. A `progress(table, rows)` callback reports how many rows of each
+table have been processed so far, which the job runner stores for polling.
+"""
+import csv
+import io
+import zipfile
+from datetime import date, datetime
+from itertools import chain
+from typing import BinaryIO, Callable
+
+from sqlalchemy import delete, insert
+from sqlmodel import Session, select
+
+from .archive import ArchivedEntry, ArchivedException, archived_before
+from .dates import entry_date_for, epoch_minutes
+from .models import BlockType, Plan, RecurringException, RecurringTask, ScheduleEntry
+
+BATCH_SIZE = 1000
+
+Progress = Callable[[str, int], None]
+
+
+def _no_progress(table: str, rows: int) -> None:
+    pass
+
+
+def _write_csv(zf: zipfile.ZipFile, name: str, header: list[str], rows, table: str, progress: Progress) -> None:
+    with zf.open(name, "w") as raw:
+        out = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+        writer = csv.writer(out)
+        writer.writerow(header)
+        count = 0
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+            if count % BATCH_SIZE == 0:
+                progress(table, count)
+        out.flush()
+        out.detach()
+    progress(table, count)
+
+
+def export_archive(
+    session: Session,
+    fileobj: BinaryIO,
+    start: date | None = None,
+    end: date | None = None,
+    progress: Progress = _no_progress,
+) -> None:
+    """Write the ZIP of CSV files to `fileobj`; `start`/`end` limit the schedule entries.
+
+    Archived entries and exceptions are included, ahead of the live ones.
+    """
+    batched = {"yield_per": BATCH_SIZE}
+    cutoff = archived_before(session)
+    with_archive = cutoff is not None and (start or date.min) < cutoff
+
+    def entry_rows(entry):
+        query = select(entry).order_by(entry.start_at)
+        if start or end:
+            query = query.where(entry.entry_date >= (start or date.min), entry.entry_date <= (end or date.max))
+        return session.exec(query.execution_options(**batched))
+
+    def exception_rows(exception):
+        return session.exec(select(exception).execution_options(**batched))
+
+    # Each query runs once the one before it is read
+    entries = chain.from_iterable(map(entry_rows, [ArchivedEntry, ScheduleEntry] if with_archive else [ScheduleEntry]))
+    exceptions = chain.from_iterable(map(
+        exception_rows, [ArchivedException, RecurringException] if cutoff is not None else [RecurringException]
+    ))
+
+    with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED) as zf:
+        _write_csv(zf, "plans.csv", ["id", "name", "color", "created_at"], (
+            [p.id, p.name, p.color, p.created_at.isoformat()]
+            for p in session.exec(select(Plan))
+        ), "plans", progress)
+
+        _write_csv(zf, "block_types.csv", ["id", "name", "color", "icon", "duration_minutes", "is_quick_template", "created_at"], (
+            [bt.id, bt.name, bt.color, bt.icon, bt.duration_minutes, bt.is_quick_template, bt.created_at.isoformat()]
+            for bt in session.exec(select(BlockType))
+        ), "block_types", progress)
+
+        _write_csv(zf, "schedule_entries.csv", ["id", "week_start", "day", "start_minute", "duration_minutes", "note", "block_type_id", "plan_id", "custom_title", "is_quick", "created_at", "entry_date"], (
+            [e.id, e.week_start.isoformat(), e.day, e.start_minute, e.duration_minutes, e.note or "", e.block_type_id, e.plan_id or "", e.custom_title or "", e.is_quick, e.created_at.isoformat(), e.entry_date.isoformat() if e.entry_date else ""]
+            for e in entries
+        ), "schedule_entries", progress)
+
+        _write_csv(zf, "recurring_tasks.csv", ["id", "title", "note", "block_type_id", "plan_id", "pattern", "interval", "day_of_week", "day_of_month", "start_minute", "duration_minutes", "start_date", "end_date", "created_at"], (
+            [rt.id, rt.title, rt.note or "", rt.block_type_id, rt.plan_id or "", rt.pattern, rt.interval, rt.day_of_week, rt.day_of_month, rt.start_minute, rt.duration_minutes, rt.start_date.isoformat(), rt.end_date.isoformat() if rt.end_date else "", rt.created_at.isoformat()]
+            for rt in session.exec(select(RecurringTask).execution_options(**batched))
+        ), "recurring_tasks", progress)
+
+        _write_csv(zf, "recurring_exceptions.csv", ["id", "recurring_task_id", "exception_date", "exception_type", "new_day", "new_start_minute", "new_duration_minutes", "created_at"], (
+            [ex.id, ex.recurring_task_id, ex.exception_date.isoformat(), ex.exception_type, ex.new_day or "", ex.new_start_minute or "", ex.new_duration_minutes or "", ex.created_at.isoformat()]
+            for ex in exceptions
+        ), "recurring_exceptions", progress)
+
+
+# ─────────────────────────── IMPORT ──────────────────────────────────────────
+
+def _optional_int(value: str | None) -> int | None:
+    return int(value) if value else None
+
+
+def _plan_row(row: dict) -> dict:
+    return {
+        "id": int(row["id"]),
+        "name": row["name"],
+        "color": row["color"],
+        "created_at": datetime.fromisoformat(row["created_at"]),
+    }
+
+
+def _block_type_row(row: dict) -> dict:
+    return {
+        "id": int(row["id"]),
+        "name": row["name"],
+        "color": row["color"],
+        "icon": row["icon"],
+        "duration_minutes": int(row["duration_minutes"]),
+        "is_quick_template": row["is_quick_template"].lower() == "true",
+        "created_at": datetime.fromisoformat(row["created_at"]),
+    }
+
+
+def _entry_row(row: dict) -> dict:
+    week_start = date.fromisoformat(row["week_start"])
+    start_minute = int(row["start_minute"])
+    # Bulk inserts bypass the ORM hook that derives these
+    entry_date = entry_date_for(week_start, row["day"])
+    return {
+        "id": int(row["id"]),
+        "week_start": week_start,
+        "day": row["day"],
+        "start_minute": start_minute,
+        "duration_minutes": int(row["duration_minutes"]),
+        "note": row["note"] or None,
+        "block_type_id": int(row["block_type_id"]),
+        "plan_id": _optional_int(row.get("plan_id")),
+        "custom_title": row["custom_title"] or None,
+        "is_quick": row["is_quick"].lower() == "true",
+        "created_at": datetime.fromisoformat(row["created_at"]),
+        "entry_date": entry_date,
+        "start_at": epoch_minutes(entry_date, start_minute) if entry_date else None,
+    }
+
+
+def _recurring_task_row(row: dict) -> dict:
+    return {
+        "id": int(row["id"]),
+        "title": row["title"],
+        "note": row["note"] or None,
+        "block_type_id": int(row["block_type_id"]),
+        "plan_id": _optional_int(row.get("plan_id")),
+        "pattern": row["pattern"],
+        "interval": int(row["interval"]),
+        "day_of_week": _optional_int(row["day_of_week"]),
+        "day_of_month": _optional_int(row["day_of_month"]),
+        "start_minute": int(row["start_minute"]),
+        "duration_minutes": int(row["duration_minutes"]),
+        "start_date": date.fromisoformat(row["start_date"]),
+        "end_date": date.fromisoformat(row["end_date"]) if row["end_date"] else None,
+        "created_at": datetime.fromisoformat(row["created_at"]),
+    }
+
+
+def _recurring_exception_row(row: dict) -> dict:
+    return {
+        "id": int(row["id"]),
+        "recurring_task_id": int(row["recurring_task_id"]),
+        "exception_date": date.fromisoformat(row["exception_date"]),
+        "exception_type": row["exception_type"],
+        "new_day": row["new_day"] or None,
+        "new_start_minute": _optional_int(row["new_start_minute"]),
+        "new_duration_minutes": _optional_int(row["new_duration_minutes"]),
+        "created_at": datetime.fromisoformat(row["created_at"]),
+    }
+
+
+# Member name, progress key, model and row parser, in foreign key order
+IMPORT_TABLES = (
+    ("plans.csv", "plans", Plan, _plan_row),
+    ("block_types.csv", "block_types", BlockType, _block_type_row),
+    ("schedule_entries.csv", "schedule_entries", ScheduleEntry, _entry_row),
+    ("recurring_tasks.csv", "recurring_tasks", RecurringTask, _recurring_task_row),
+    ("recurring_exceptions.csv", "recurring_exceptions", RecurringException, _recurring_exception_row),
+)
+
+
+def validate_archive(path: str) -> None:
+    """Raise ValueError if `path` is not a readable ZIP archive."""
+    try:
+        with zipfile.ZipFile(path):
+            pass
+    except zipfile.BadZipFile as exc:
+        raise ValueError("Invalid ZIP file") from exc
+
+
+def import_archive(session: Session, path: str, progress: Progress = _no_progress) -> None:
+    """Replace all planner data with the contents of the archive at `path`. The caller commits."""
+    with zipfile.ZipFile(path) as zf:
+        names = set(zf.namelist())
+        for _, _, model, _ in reversed(IMPORT_TABLES):
+            session.exec(delete(model.__table__))
+
+        for member, table, model, parse in IMPORT_TABLES:
+            if member not in names:
+                continue
+            count = 0
+            batch = []
+            with zf.open(member) as raw:
+                for row in csv.DictReader(io.TextIOWrapper(raw, encoding="utf-8", newline="")):
+                    batch.append(parse(row))
+                    if len(batch) >= BATCH_SIZE:
+                        session.exec(insert(model.__table__), params=batch)
+                        count += len(batch)
+                        batch = []
+                        progress(table, count)
+            if batch:
+                session.exec(insert(model.__table__), params=batch)
+                count += len(batch)
+            progress(table, count)
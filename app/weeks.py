@@ -0,0 +1,146 @@
+"""
+Set-based week operations: copying blocks between weeks and week templates.
+
+Every operation is expressed as ``INSERT ... SELECT`` (plus a correlated
+``DELETE`` for the overwrite policy), so copying a week costs one statement
+per target week no matter how many blocks it contains.
+"""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import Date, DateTime, and_, delete, exists, insert, literal, select
+from sqlmodel import Session
+
+from .dates import entry_date_sql, start_at_sql
+from .models import ScheduleEntry, WeekTemplate, WeekTemplateEntry
+
+CONFLICT_POLICIES = ("skip", "overwrite")
+# Most weeks one copy or template stamp may write, a year's worth
+MAX_WEEKS = 52
+
+# Columns shared by ScheduleEntry and WeekTemplateEntry that are copied verbatim.
+COPIED_COLUMNS = (
+    "day", "start_minute", "duration_minutes", "note",
+    "block_type_id", "plan_id", "custom_title", "is_quick",
+)
+
+entry_table = ScheduleEntry.__table__
+template_entry_table = WeekTemplateEntry.__table__
+
+
+def _source_filters(source, plan_ids: list[int] | None, block_type_ids: list[int] | None) -> list:
+    """Optional plan/block type filters, using the same plan semantics as the schedule view."""
+    filters = []
+    if plan_ids is not None:
+        filters.append(source.c.plan_id.in_(plan_ids) | (source.c.plan_id == None))
+    if block_type_ids is not None:
+        filters.append(source.c.block_type_id.in_(block_type_ids))
+    return filters
+
+
+def _conflicts(target, source, week_start: date):
+    """Rows of `target` in `week_start` that overlap a `source` row on the same day and plan."""
+    return and_(
+        target.c.week_start == literal(week_start, Date),
+        target.c.day == source.c.day,
+        target.c.start_minute < source.c.start_minute + source.c.duration_minutes,
+        source.c.start_minute < target.c.start_minute + target.c.duration_minutes,
+        target.c.plan_id.is_not_distinct_from(source.c.plan_id),
+    )
+
+
+def _stamp(session: Session, source, filters: list, week_start: date, conflict: str) -> int:
+    """Insert the filtered rows of `source` into `week_start`, applying the conflict policy."""
+    if conflict not in CONFLICT_POLICIES:
+        raise ValueError(f"Unknown conflict policy: {conflict}")
+
+    if conflict == "overwrite":
+        clash = select(literal(1)).select_from(source).where(*filters, _conflicts(entry_table, source, week_start))
+        session.exec(delete(entry_table).where(exists(clash)))
+    else:
+        existing = entry_table.alias("existing")
+        clash = select(literal(1)).select_from(existing).where(_conflicts(existing, source, week_start))
+        filters = [*filters, ~exists(clash)]
+
+    rows = select(
+        literal(week_start, Date),
+        *(source.c[column] for column in COPIED_COLUMNS),
+        literal(datetime.utcnow(), DateTime),
+        entry_date_sql(source.c.day, week_start),
+        start_at_sql(source.c.day, source.c.start_minute, week_start),
+    ).where(*filters)
+    result = session.exec(
+        insert(entry_table).from_select(
+            ["week_start", *COPIED_COLUMNS, "created_at", "entry_date", "start_at"], rows
+        )
+    )
+    return result.rowcount or 0
+
+
+def copy_weeks(
+    session: Session,
+    source_week: date,
+    target_week: date,
+    weeks: int = 1,
+    plan_ids: list[int] | None = None,
+    block_type_ids: list[int] | None = None,
+    conflict: str = "skip",
+) -> int:
+    """Copy `weeks` consecutive weeks starting at `source_week` onto `target_week` onwards.
+
+    Returns the number of blocks created. Like every function here, the caller commits.
+    """
+    if not 1 <= weeks <= MAX_WEEKS:
+        raise ValueError(f"weeks must be between 1 and {MAX_WEEKS}")
+    offset = (target_week - source_week).days
+    if abs(offset) < weeks * 7:
+        raise ValueError("Source and target ranges overlap")
+    if (date.max - max(source_week, target_week)).days < weeks * 7:
+        raise ValueError("Weeks out of range")
+
+    source = entry_table.alias("source")
+    created = 0
+    for i in range(weeks):
+        week = source_week + timedelta(days=7 * i)
+        filters = [source.c.week_start == literal(week, Date), *_source_filters(source, plan_ids, block_type_ids)]
+        created += _stamp(session, source, filters, week + timedelta(days=offset), conflict)
+    return created
+
+
+def save_week_template(
+    session: Session,
+    name: str,
+    week_start: date,
+    plan_ids: list[int] | None = None,
+    block_type_ids: list[int] | None = None,
+) -> WeekTemplate:
+    """Snapshot the blocks of `week_start` into a new template."""
+    template = WeekTemplate(name=name)
+    session.add(template)
+    session.flush()
+
+    rows = select(
+        literal(template.id),
+        *(entry_table.c[column] for column in COPIED_COLUMNS),
+    ).where(entry_table.c.week_start == literal(week_start, Date), *_source_filters(entry_table, plan_ids, block_type_ids))
+    session.exec(insert(template_entry_table).from_select(["template_id", *COPIED_COLUMNS], rows))
+    return template
+
+
+def apply_week_template(
+    session: Session,
+    template_id: int,
+    target_weeks: list[date],
+    conflict: str = "skip",
+) -> int:
+    """Stamp a template onto each of `target_weeks`. Returns the number of blocks created."""
+    source = template_entry_table.alias("source")
+    filters = [source.c.template_id == template_id]
+    created = 0
+    for week in dict.fromkeys(target_weeks):
+        created += _stamp(session, source, filters, week, conflict)
+    return created
+
+
+def delete_week_template(session: Session, template_id: int) -> None:
+    session.exec(delete(template_entry_table).where(template_entry_table.c.template_id == template_id))
+    session.exec(delete(WeekTemplate.__table__).where(WeekTemplate.__table__.c.id == template_id))
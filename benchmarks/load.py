@@ -0,0 +1,440 @@
+"""
+Load test: simulated planner users against a locally started server.
+
+Usage: python -m benchmarks.load [--concurrency 1,4,16,64] [--duration 20]
+                                 [--workers 1] [--think-ms 0] [--tenants 0]
+                                 [--json out.json]
+
+Seeds a throwaway SQLite database, starts the production server on it
+(``python -m app serve``) in a subprocess, then runs one step per concurrency
+level. In each step that many virtual users repeat the client's flows from
+app.js (weights in SCENARIOS):
+
+* open a week (prev/next/this), revalidating weeks seen before with
+  If-None-Match like the client's week cache;
+* toggle plans, refetching /schedule?plans=;
+* drag an entry (POST /entries/{id}/move through the outbox);
+* create a quick task;
+* move or skip one instance of a recurring task (an exception);
+* export a week as a CSV archive.
+
+Mutations carry Idempotency-Key and HX-Request headers, as the outbox sends
+them. With --tenants N the server runs in multi-tenant header mode and the
+users are spread over N users' databases, each seeded alike.
+
+For each step it reports throughput and latency percentiles per endpoint,
+status codes, and SQLite "database is locked" errors, which are counted from
+the server log and given per mutation request.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from pathlib import Path
+
+import httpx
+
+from app.config import DAY_END_MINUTE, DAY_ORDER, DAY_START_MINUTE, PLAN_COLORS
+
+ROOT = Path(__file__).resolve().parent.parent
+WEEKS = 5  # seeded weeks around the current one
+ENTRIES_PER_WEEK = 40
+RECURRING_TASKS = 6
+LOCK_ERROR = re.compile(r"OperationalError\) database is locked")
+
+
+@dataclass
+class Fixture:
+    weeks: list[date]
+    plan_ids: list[int]
+    entry_ids: list[int]
+    recurring: list[tuple[int, int]]  # (task id, weekday)
+
+
+def seed(tenant_names: list[str]) -> Fixture:
+    """Fill the database named by DATABASE_URL, or each tenant's, and return the ids the scenarios use."""
+    import app.db as db
+    import app.main as main
+    from app import tenants
+
+    main.on_startup()
+    if not tenant_names:
+        return seed_rows()
+    os.makedirs(tenants.TENANT_DIR, exist_ok=True)
+    for name in tenant_names:
+        engine = db.make_engine(f"sqlite:///{tenants.tenant_path(name)}")
+        with db.use_engine(engine, name):
+            tenants.prepare_tenant_database()
+            # Every database starts empty and is filled alike, so the ids match
+            fixture = seed_rows()
+        engine.dispose()
+    return fixture
+
+
+def seed_rows() -> Fixture:
+    from sqlmodel import Session, select
+
+    import app.db as db
+    import app.main as main
+    from app.models import BlockType, Plan, RecurringTask, ScheduleEntry
+
+    this_week = main.get_week_start(date.today())
+    weeks = [this_week + timedelta(weeks=offset) for offset in range(-(WEEKS // 2), WEEKS - WEEKS // 2)]
+    rng = random.Random(7)
+    slots = (DAY_END_MINUTE - 60 - DAY_START_MINUTE) // 15
+    with Session(db.get_engine()) as session:
+        for i, name in enumerate(("Work", "Home")):
+            session.add(Plan(name=name, color=PLAN_COLORS[(i + 1) % len(PLAN_COLORS)]))
+        session.commit()
+        block_ids = session.exec(select(BlockType.id).where(BlockType.is_quick_template == False)).all()
+        plan_ids = session.exec(select(Plan.id)).all()
+        entries = []
+        for week in weeks:
+            for i in range(ENTRIES_PER_WEEK):
+                entry = ScheduleEntry(
+                    week_start=week,
+                    day=DAY_ORDER[i % 7],
+                    start_minute=DAY_START_MINUTE + rng.randrange(slots) * 15,
+                    duration_minutes=rng.choice((30, 60, 90)),
+                    block_type_id=rng.choice(block_ids),
+                    plan_id=rng.choice(plan_ids),
+                    note=f"Entry {i}",
+                )
+                session.add(entry)
+                entries.append(entry)
+        tasks = []
+        for i in range(RECURRING_TASKS):
+            task = RecurringTask(
+                title=f"Routine {i}", block_type_id=block_ids[i % len(block_ids)], plan_id=plan_ids[i % len(plan_ids)],
+                pattern="weekly", interval=1, day_of_week=i % 7, start_minute=DAY_START_MINUTE + 60 * i,
+                duration_minutes=45, start_date=weeks[0],
+            )
+            session.add(task)
+            tasks.append(task)
+        session.commit()
+        fixture = Fixture(
+            weeks=weeks,
+            plan_ids=list(plan_ids),
+            entry_ids=[entry.id for entry in entries],
+            recurring=[(task.id, task.day_of_week) for task in tasks],
+        )
+    db.get_engine().dispose()
+    return fixture
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, workers: int, env: dict, log_path: Path) -> subprocess.Popen:
+    cmd = [
+        sys.executable, "-m", "app", "serve",
+        "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning",
+    ]
+    log = open(log_path, "ab")
+    return subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_until_up(base_url: str, server: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode}")
+            try:
+                if (await client.get("/sw.js")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not start in time")
+
+
+@dataclass
+class Step:
+    concurrency: int
+    elapsed: float = 0.0
+    latencies: dict[str, list[float]] = field(default_factory=lambda: defaultdict(list))
+    statuses: dict[str, Counter] = field(default_factory=lambda: defaultdict(Counter))
+    mutations: int = 0
+    lock_errors: int = 0
+
+    def record(self, label: str, started: float, status: int | str) -> None:
+        self.latencies[label].append((time.perf_counter() - started) * 1000)
+        self.statuses[label][status] += 1
+
+
+class VirtualUser:
+    """One browser tab: a current week, a plan selection and a week cache of ETags."""
+
+    def __init__(
+        self, client: httpx.AsyncClient, fixture: Fixture, step: Step, rng: random.Random, tenant: str | None = None,
+    ) -> None:
+        self.client = client
+        self.headers = {"X-Forwarded-User": tenant} if tenant else {}
+        self.fixture = fixture
+        self.step = step
+        self.rng = rng
+        self.client_id = uuid.uuid4().hex
+        self.week = fixture.weeks[len(fixture.weeks) // 2]
+        self.plans: list[int] = []
+        self.etags: dict[str, str] = {}
+
+    @property
+    def selected_plans(self) -> str:
+        return ",".join(map(str, self.plans))
+
+    async def request(self, label: str, method: str, url: str, **kwargs) -> httpx.Response | None:
+        started = time.perf_counter()
+        kwargs["headers"] = {**self.headers, **kwargs.get("headers", {})}
+        try:
+            resp = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as exc:
+            self.step.record(label, started, type(exc).__name__)
+            return None
+        self.step.record(label, started, resp.status_code)
+        return resp
+
+    async def mutate(self, label: str, url: str, data: dict) -> None:
+        self.step.mutations += 1
+        headers = {"HX-Request": "true", "X-Client-Id": self.client_id, "Idempotency-Key": uuid.uuid4().hex}
+        await self.request(label, "POST", url, data=data, headers=headers)
+
+    async def fetch_week(self, label: str) -> None:
+        params = {"week": self.week.isoformat()}
+        if self.plans:
+            params["plans"] = self.selected_plans
+        cache_key = f"{params['week']}|{params.get('plans', '')}"
+        headers = {"HX-Request": "true"}
+        if cache_key in self.etags:
+            headers["If-None-Match"] = self.etags[cache_key]
+        resp = await self.request(label, "GET", "/schedule", params=params, headers=headers)
+        if resp is not None and resp.status_code == 200 and "etag" in resp.headers:
+            self.etags[cache_key] = resp.headers["etag"]
+
+    async def open_week(self) -> None:
+        weeks = self.fixture.weeks
+        index = weeks.index(self.week) + self.rng.choice((-1, 1))
+        self.week = weeks[index] if 0 <= index < len(weeks) else weeks[len(weeks) // 2]
+        await self.fetch_week("GET /schedule (open week)")
+
+    async def toggle_plans(self) -> None:
+        plan_id = self.rng.choice(self.fixture.plan_ids)
+        self.plans = [p for p in self.plans if p != plan_id] if plan_id in self.plans else sorted(self.plans + [plan_id])
+        if len(self.plans) == len(self.fixture.plan_ids):
+            self.plans = []
+        await self.fetch_week("GET /schedule?plans= (toggle plans)")
+
+    async def move_entry(self) -> None:
+        entry_id = self.rng.choice(self.fixture.entry_ids)
+        await self.mutate("POST /entries/{id}/move", f"/entries/{entry_id}/move", {
+            "day": self.rng.choice(DAY_ORDER),
+            "start_minute": self.rng.randrange(DAY_START_MINUTE, DAY_END_MINUTE - 60, 15),
+            "duration_minutes": self.rng.choice((30, 45, 60, 90)),
+            "selected_plans": self.selected_plans,
+        })
+
+    async def quick_task(self) -> None:
+        minute = self.rng.randrange(DAY_START_MINUTE, DAY_END_MINUTE - 60, 15)
+        await self.mutate("POST /quick-task", "/quick-task", {
+            "title": f"Task {self.rng.randrange(10_000)}",
+            "day": self.rng.choice(DAY_ORDER),
+            "start_time": f"{minute // 60:02d}:{minute % 60:02d}",
+            "week": self.week.isoformat(),
+            "plan_id": self.rng.choice(self.fixture.plan_ids),
+            "selected_plans": self.selected_plans,
+        })
+
+    async def recurring_exception(self) -> None:
+        task_id, weekday = self.rng.choice(self.fixture.recurring)
+        data = {
+            "exception_date": (self.week + timedelta(days=weekday)).isoformat(),
+            "exception_type": self.rng.choice(("modified", "deleted")),
+            "week": self.week.isoformat(),
+            "selected_plans": self.selected_plans,
+        }
+        if data["exception_type"] == "modified":
+            data.update(
+                new_day=self.rng.choice(DAY_ORDER),
+                new_start_minute=self.rng.randrange(DAY_START_MINUTE, DAY_END_MINUTE - 60, 15),
+                new_duration_minutes=45,
+            )
+        await self.mutate("POST /recurring-tasks/{id}/exception", f"/recurring-tasks/{task_id}/exception", data)
+
+    async def export(self) -> None:
+        params = {"start": self.week.isoformat(), "end": (self.week + timedelta(days=6)).isoformat()}
+        await self.request("GET /export/csv", "GET", "/export/csv", params=params)
+
+    async def run(self, until: float, think_ms: int) -> None:
+        scenarios = [getattr(self, name) for name in SCENARIOS]
+        weights = list(SCENARIOS.values())
+        while time.perf_counter() < until:
+            await self.rng.choices(scenarios, weights)[0]()
+            if think_ms:
+                await asyncio.sleep(self.rng.uniform(0, 2 * think_ms) / 1000)
+
+
+# Relative frequency of each flow; reads dominate, as in a real session
+SCENARIOS = {
+    "open_week": 40,
+    "toggle_plans": 20,
+    "move_entry": 20,
+    "quick_task": 8,
+    "recurring_exception": 8,
+    "export": 4,
+}
+
+
+def count_lock_errors(log_path: Path, offset: int) -> tuple[int, int]:
+    """Lock errors logged since `offset`, and the new end of the log."""
+    with open(log_path, "rb") as log:
+        log.seek(offset)
+        text = log.read().decode(errors="replace")
+        return len(LOCK_ERROR.findall(text)), log.tell()
+
+
+async def run_step(
+    base_url: str, fixture: Fixture, concurrency: int, duration: float, think_ms: int, seed: int, tenants: list[str],
+) -> Step:
+    step = Step(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        users = [
+            VirtualUser(client, fixture, step, random.Random(seed * 1000 + i), tenants[i % len(tenants)] if tenants else None)
+            for i in range(concurrency)
+        ]
+        started = time.perf_counter()
+        await asyncio.gather(*(user.run(started + duration, think_ms) for user in users))
+        step.elapsed = time.perf_counter() - started
+    return step
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile of sorted `values`."""
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+def summarize(step: Step) -> dict:
+    endpoints = {}
+    for label, timings in sorted(step.latencies.items()):
+        timings.sort()
+        endpoints[label] = {
+            "requests": len(timings),
+            "rps": round(len(timings) / step.elapsed, 1),
+            "p50_ms": round(percentile(timings, 50), 1),
+            "p90_ms": round(percentile(timings, 90), 1),
+            "p99_ms": round(percentile(timings, 99), 1),
+            "max_ms": round(timings[-1], 1),
+            "statuses": {str(status): count for status, count in sorted(step.statuses[label].items(), key=str)},
+        }
+    total = sum(endpoint["requests"] for endpoint in endpoints.values())
+    failed = sum(
+        count for label in step.statuses for status, count in step.statuses[label].items()
+        if not isinstance(status, int) or status >= 500
+    )
+    return {
+        "concurrency": step.concurrency,
+        "seconds": round(step.elapsed, 1),
+        "requests": total,
+        "rps": round(total / step.elapsed, 1),
+        "failed": failed,
+        "mutations": step.mutations,
+        "lock_errors": step.lock_errors,
+        "lock_error_rate": round(step.lock_errors / step.mutations, 4) if step.mutations else 0.0,
+        "endpoints": endpoints,
+    }
+
+
+def print_summary(summary: dict) -> None:
+    print(
+        f"\nconcurrency {summary['concurrency']}: {summary['requests']} requests in {summary['seconds']} s, "
+        f"{summary['rps']} req/s, {summary['failed']} failed, "
+        f"{summary['lock_errors']} lock errors ({summary['lock_error_rate']:.2%} of {summary['mutations']} mutations)"
+    )
+    print(f"  {'endpoint':<38} {'reqs':>6} {'req/s':>7} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}  statuses")
+    for label, row in summary["endpoints"].items():
+        statuses = " ".join(f"{status}:{count}" for status, count in row["statuses"].items())
+        print(
+            f"  {label:<38} {row['requests']:>6} {row['rps']:>7} {row['p50_ms']:>6.1f}ms {row['p90_ms']:>6.1f}ms "
+            f"{row['p99_ms']:>6.1f}ms {row['max_ms']:>6.1f}ms  {statuses}"
+        )
+
+
+async def run(args, fixture: Fixture, base_url: str, server: subprocess.Popen, log_path: Path) -> list[dict]:
+    await wait_until_up(base_url, server)
+    offset = log_path.stat().st_size
+    summaries = []
+    for i, concurrency in enumerate(args.concurrency):
+        step = await run_step(base_url, fixture, concurrency, args.duration, args.think_ms, i, args.tenant_names)
+        step.lock_errors, offset = count_lock_errors(log_path, offset)
+        summary = summarize(step)
+        print_summary(summary)
+        summaries.append(summary)
+    return summaries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")], default=[1, 4, 16, 64])
+    parser.add_argument("--duration", type=float, default=20, help="seconds per concurrency step")
+    parser.add_argument("--workers", type=int, default=1, help="server worker processes (0 = one per CPU)")
+    parser.add_argument("--tenants", type=int, default=0, help="spread users over this many per-user databases")
+    parser.add_argument("--think-ms", type=int, default=0, help="mean pause between a user's actions")
+    parser.add_argument("--json", type=Path, help="also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{Path(tmp) / 'load.db'}",
+            "PLANNER_JOBS_DIR": str(Path(tmp) / "jobs"),
+            "PLANNER_ACCESS_LOG": "0",
+            "PLANNER_TENANT_MODE": "header" if args.tenants else "off",
+            "PLANNER_TENANT_DIR": str(Path(tmp) / "tenants"),
+            # Several workers must see each other's changes for live updates to be realistic
+            "PLANNER_EVENTS_BACKEND": "sqlite" if args.workers != 1 else os.getenv("PLANNER_EVENTS_BACKEND", "memory"),
+        }
+        os.environ.update(env)
+        from app import tenants
+
+        tenants.TENANT_DIR = env["PLANNER_TENANT_DIR"]
+        args.tenant_names = [f"user{i}" for i in range(args.tenants)]
+        fixture = seed(args.tenant_names)
+        print(
+            f"Seeded {len(fixture.entry_ids)} entries over {len(fixture.weeks)} weeks, "
+            f"{len(fixture.recurring)} weekly recurring tasks, {len(fixture.plan_ids)} plans"
+            + (f", in each of {args.tenants} tenant databases" if args.tenants else "")
+        )
+
+        port = free_port()
+        log_path = Path(tmp) / "server.log"
+        server = start_server(port, args.workers, env, log_path)
+        try:
+            summaries = asyncio.run(run(args, fixture, f"http://127.0.0.1:{port}", server, log_path))
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    if args.json:
+        args.json.write_text(json.dumps({"workers": args.workers, "tenants": args.tenants, "steps": summaries}, indent=2))
+        print(f"\nWrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
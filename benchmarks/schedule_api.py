@@ -0,0 +1,86 @@
+"""
+Compare the HTML schedule partial with the JSON API for one busy week.
+
+Usage: python -m benchmarks.schedule_api [--entries 500] [--rounds 50]
+
+Seeds a throwaway SQLite database, then reports response size and median
+latency for GET /schedule and GET /api/weeks/{week}.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import date
+from pathlib import Path
+
+
+def seed(db, entries: int, week: date) -> None:
+    from sqlmodel import Session, select
+
+    from app.config import DAY_ORDER
+    from app.models import BlockType, Plan, RecurringTask, ScheduleEntry
+
+    with Session(db.engine) as session:
+        block_ids = session.exec(select(BlockType.id)).all()
+        plan_id = session.exec(select(Plan.id)).first()
+        for i in range(entries):
+            session.add(ScheduleEntry(
+                week_start=week,
+                day=DAY_ORDER[i % 7],
+                start_minute=6 * 60 + (i // 7 % 64) * 15,
+                duration_minutes=30,
+                block_type_id=block_ids[i % len(block_ids)],
+                plan_id=plan_id,
+                note=f"Entry {i}",
+            ))
+        for i in range(10):
+            session.add(RecurringTask(
+                title=f"Routine {i}", block_type_id=block_ids[i % len(block_ids)], plan_id=plan_id,
+                pattern="daily", interval=1, start_minute=5 * 60, start_date=week,
+            ))
+        session.commit()
+
+
+def measure(client, url: str, rounds: int, headers: dict | None = None) -> tuple[int, float]:
+    timings = []
+    size = 0
+    for _ in range(rounds):
+        started = time.perf_counter()
+        resp = client.get(url, headers=headers or {})
+        timings.append((time.perf_counter() - started) * 1000)
+        assert resp.status_code == 200, resp.status_code
+        size = len(resp.content)
+    return size, statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{Path(tmp) / 'bench.db'}"
+        from fastapi.testclient import TestClient
+
+        import app.db as db
+        import app.main as main
+
+        main.on_startup()
+        week = date(2024, 1, 1)
+        seed(db, args.entries, week)
+        client = TestClient(main.app)
+
+        rows = [
+            ("GET /schedule (HTML)", f"/schedule?week={week}", {"HX-Request": "true"}),
+            ("GET /api/weeks (JSON)", f"/api/weeks/{week}", None),
+        ]
+        print(f"{args.entries} entries + 10 daily recurring tasks, median of {args.rounds} requests")
+        for label, url, headers in rows:
+            size, latency = measure(client, url, args.rounds, headers)
+            print(f"  {label:<24} {size / 1024:8.1f} KiB {latency:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
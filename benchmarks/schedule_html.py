@@ -0,0 +1,52 @@
+"""
+Measure the schedule partial for one busy week.
+
+Usage: python -m benchmarks.schedule_html [--entries 500] [--rounds 50]
+
+Seeds a throwaway SQLite database and reports the rendered size and median
+render time of partials/schedule.html, excluding the database queries.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import date
+from pathlib import Path
+
+from benchmarks.schedule_api import seed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{Path(tmp) / 'bench.db'}"
+        from sqlmodel import Session
+
+        import app.db as db
+        import app.main as main
+
+        main.on_startup()
+        week = date(2024, 1, 1)
+        seed(db, args.entries, week)
+        with Session(db.engine) as session:
+            ctx = main._schedule_data(session, week)
+            ctx["request"] = None
+            template = main.templates.get_template("partials/schedule.html")
+            html = template.render(ctx)
+            timings = []
+            for _ in range(args.rounds):
+                started = time.perf_counter()
+                template.render(ctx)
+                timings.append((time.perf_counter() - started) * 1000)
+
+        print(f"{args.entries} entries + 10 daily recurring tasks, median of {args.rounds} renders")
+        print(f"  partials/schedule.html {len(html.encode()) / 1024:8.1f} KiB {statistics.median(timings):8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
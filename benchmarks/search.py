@@ -0,0 +1,88 @@
+"""
+Latency of GET /search over a large schedule.
+
+Usage: python -m benchmarks.search [--entries 1000000] [--rounds 20]
+
+Seeds a throwaway SQLite database with entries whose notes are drawn from a
+small vocabulary (one in a thousand mentions a dentist), then reports the
+median latency of a few typical queries.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+WORDS = (
+    "meeting call review plan gym groceries lunch project report email train "
+    "read write budget laundry cleaning walk dinner coffee class practice"
+).split()
+QUERIES = ("dentist", "dent", "weekly review", "groceries budget")
+
+
+def seed(db, entries: int, batch: int = 50_000) -> None:
+    from sqlalchemy import insert
+    from sqlmodel import Session, select
+
+    from app.config import DAY_ORDER
+    from app.models import BlockType, ScheduleEntry
+
+    rng = random.Random(42)
+    first_week = date(2000, 1, 3)
+    with Session(db.engine) as session:
+        block_ids = session.exec(select(BlockType.id)).all()
+        for chunk_start in range(0, entries, batch):
+            rows = []
+            for i in range(chunk_start, min(entries, chunk_start + batch)):
+                note = " ".join(rng.choice(WORDS) for _ in range(6))
+                if i % 1000 == 0:
+                    note += " dentist"
+                rows.append({
+                    "week_start": first_week + timedelta(weeks=i // 100),
+                    "day": DAY_ORDER[i % 7],
+                    "start_minute": 6 * 60 + (i % 60) * 15,
+                    "duration_minutes": 30,
+                    "block_type_id": block_ids[i % len(block_ids)],
+                    "note": note,
+                    "is_quick": False,
+                    "created_at": first_week,
+                })
+            session.exec(insert(ScheduleEntry.__table__), params=rows)
+            session.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=1_000_000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{Path(tmp) / 'bench.db'}"
+        from fastapi.testclient import TestClient
+
+        import app.db as db
+        import app.main as main
+
+        main.on_startup()
+        started = time.perf_counter()
+        seed(db, args.entries)
+        print(f"Seeded and indexed {args.entries} entries in {time.perf_counter() - started:.1f} s")
+        client = TestClient(main.app)
+
+        for query in QUERIES:
+            timings = []
+            for _ in range(args.rounds):
+                started = time.perf_counter()
+                resp = client.get("/search", params={"q": query})
+                timings.append((time.perf_counter() - started) * 1000)
+                assert resp.status_code == 200, resp.text
+            hits = len(resp.json()["results"])
+            print(f"  q={query!r:<20} first page {hits:>3} results, median {statistics.median(timings):7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
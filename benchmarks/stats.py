@@ -0,0 +1,89 @@
+"""
+Latency of GET /stats over a full year.
+
+Usage: python -m benchmarks.stats [--per-day 20] [--recurring 10] [--rounds 10]
+
+Seeds a throwaway SQLite database with a year of one-off entries and daily
+recurring tasks, then reports the median latency of a one-year /stats call.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+YEAR_START = date(2024, 1, 1)
+
+
+def seed(db, per_day: int, recurring: int) -> None:
+    from sqlalchemy import insert
+    from sqlmodel import Session, select
+
+    from app.config import DAY_ORDER
+    from app.dates import epoch_minutes
+    from app.models import BlockType, Plan, RecurringTask, ScheduleEntry
+
+    with Session(db.engine) as session:
+        block_ids = session.exec(select(BlockType.id)).all()
+        plan_id = session.exec(select(Plan.id)).first()
+        rows = []
+        for offset in range(366):
+            day = YEAR_START + timedelta(days=offset)
+            for i in range(per_day):
+                start_minute = 6 * 60 + i * 40
+                rows.append({
+                    "week_start": day - timedelta(days=day.weekday()),
+                    "day": DAY_ORDER[day.weekday()],
+                    "start_minute": start_minute,
+                    "duration_minutes": 30,
+                    "block_type_id": block_ids[i % len(block_ids)],
+                    "plan_id": plan_id if i % 3 else None,
+                    "is_quick": False,
+                    "created_at": YEAR_START,
+                    "entry_date": day,
+                    "start_at": epoch_minutes(day, start_minute),
+                })
+        session.exec(insert(ScheduleEntry.__table__), params=rows)
+        for i in range(recurring):
+            session.add(RecurringTask(
+                title=f"Routine {i}", block_type_id=block_ids[i % len(block_ids)], plan_id=plan_id,
+                pattern="daily", interval=1, start_minute=5 * 60, start_date=YEAR_START,
+            ))
+        session.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--per-day", type=int, default=20)
+    parser.add_argument("--recurring", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{Path(tmp) / 'bench.db'}"
+        from fastapi.testclient import TestClient
+
+        import app.db as db
+        import app.main as main
+
+        main.on_startup()
+        seed(db, args.per_day, args.recurring)
+        client = TestClient(main.app)
+        params = {"start": YEAR_START.isoformat(), "end": (YEAR_START + timedelta(days=365)).isoformat()}
+
+        timings = []
+        for _ in range(args.rounds):
+            started = time.perf_counter()
+            resp = client.get("/stats", params=params)
+            timings.append((time.perf_counter() - started) * 1000)
+            assert resp.status_code == 200, resp.text
+        print(
+            f"{366 * args.per_day} entries + {args.recurring} daily recurring tasks over one year: "
+            f"median {statistics.median(timings):.1f} ms of {args.rounds} requests"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+First-request and steady-state render latency of the main templates.
+
+Usage: python -m benchmarks.templates [--entries 500] [--rounds 50]
+
+"first" is a fresh environment rendering a template once: development mode
+compiles from source, production mode with a warm bytecode cache only loads
+the cached code. "steady" is the median of later lookups and renders.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import date
+from pathlib import Path
+
+from benchmarks.schedule_api import seed
+
+TEMPLATES = ("index.html", "partials/schedule.html")
+
+
+def first_render(make_env, name: str, ctx: dict) -> float:
+    env = make_env()
+    started = time.perf_counter()
+    env.get_template(name).render(ctx)
+    return (time.perf_counter() - started) * 1000
+
+
+def steady_render(make_env, name: str, ctx: dict, rounds: int) -> float:
+    env = make_env()
+    env.get_template(name).render(ctx)
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        # Look the template up each time, like a request does, so reload checks count
+        env.get_template(name).render(ctx)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = f"sqlite:///{Path(tmp) / 'bench.db'}"
+        from sqlmodel import Session
+
+        import app.db as db
+        import app.main as main
+        from app.templating import make_environment, precompile
+
+        main.on_startup()
+        week = date(2024, 1, 1)
+        seed(db, args.entries, week)
+        session = Session(db.engine)
+        ctx = main._schedule_data(session, week)
+        ctx["request"] = None
+
+        cache_dir = str(Path(tmp) / "bytecode")
+        modes = {
+            "development": lambda: make_environment(mode="development"),
+            "production": lambda: make_environment(mode="production", cache_dir=cache_dir),
+        }
+        precompile(modes["production"]())
+
+        print(f"{args.entries} entries + 10 daily recurring tasks, steady = median of {args.rounds} renders")
+        for mode, make_env in modes.items():
+            for name in TEMPLATES:
+                first = first_render(make_env, name, ctx)
+                steady = steady_render(make_env, name, ctx, args.rounds)
+                print(f"  {mode:<12} {name:<24} first {first:8.2f} ms  steady {steady:8.2f} ms")
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
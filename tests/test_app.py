@@ -11,6 +11,7 @@ def make_client():
 
     importlib.reload(db)
     importlib.reload(main)
+    main.on_startup()
     client = TestClient(main.app)
     return client, db
 
@@ -36,9 +37,921 @@ def test_create_entry():
         "duration_minutes": 60,
         "block_type_id": block_id,
         "note": "Test entry",
+        "week": "2024-01-01",
     }
     resp = client.post("/entries", data=payload)
     assert resp.status_code == 200
     with Session(db.engine) as session:
-        count = session.exec(select(BlockType)).count()
+        count = len(session.exec(select(BlockType)).all())
         assert count >= 1
+
+
+def _add_entry(db, week_start, day="Monday", start_minute=9 * 60, duration=60, **extra):
+    from app.models import BlockType, ScheduleEntry
+
+    with Session(db.engine) as session:
+        extra.setdefault("block_type_id", session.exec(select(BlockType.id)).first())
+        entry = ScheduleEntry(
+            week_start=week_start,
+            day=day,
+            start_minute=start_minute,
+            duration_minutes=duration,
+            **extra,
+        )
+        session.add(entry)
+        session.commit()
+        return entry.id
+
+
+def _entries_for_week(db, week_start):
+    from app.models import ScheduleEntry
+
+    with Session(db.engine) as session:
+        return session.exec(select(ScheduleEntry).where(ScheduleEntry.week_start == week_start)).all()
+
+
+def test_copy_week_skips_conflicts():
+    from datetime import date
+
+    client, db = make_client()
+    source, target = date(2024, 1, 1), date(2024, 1, 8)
+    _add_entry(db, source, start_minute=9 * 60, note="copied")
+    _add_entry(db, source, start_minute=13 * 60, note="clashing")
+    _add_entry(db, target, start_minute=13 * 60 + 30, note="kept")
+
+    resp = client.post("/weeks/copy", data={"source_week": "2024-01-01", "target_week": "2024-01-10"})
+    assert resp.status_code == 200
+
+    notes = sorted(e.note for e in _entries_for_week(db, target))
+    assert notes == ["copied", "kept"]
+    assert len(_entries_for_week(db, source)) == 2
+
+
+def test_copy_week_overwrite_replaces_conflicts():
+    from datetime import date
+
+    client, db = make_client()
+    source, target = date(2024, 1, 1), date(2024, 1, 8)
+    _add_entry(db, source, start_minute=13 * 60, note="incoming")
+    _add_entry(db, target, start_minute=13 * 60 + 30, note="replaced")
+    _add_entry(db, target, day="Tuesday", note="untouched")
+
+    resp = client.post(
+        "/weeks/copy",
+        data={"source_week": "2024-01-01", "target_week": "2024-01-08", "conflict": "overwrite"},
+    )
+    assert resp.status_code == 200
+    assert sorted(e.note for e in _entries_for_week(db, target)) == ["incoming", "untouched"]
+
+    resp = client.post("/weeks/copy", data={"source_week": "2024-01-01", "target_week": "2024-01-03"})
+    assert resp.status_code == 400
+    for bad in ({"weeks": "100000"}, {"target_week": "9999-12-27"}, {"block_types": "abc"}):
+        resp = client.post("/weeks/copy", data={"source_week": "2024-01-01", "target_week": "2024-03-04", **bad})
+        assert resp.status_code == 400, bad
+    assert _entries_for_week(db, date(2024, 3, 4)) == []
+
+
+def test_week_template_stamps_multiple_weeks():
+    from datetime import date
+
+    client, db = make_client()
+    _add_entry(db, date(2024, 1, 1), note="standup")
+    _add_entry(db, date(2024, 1, 1), day="Friday", note="review")
+
+    resp = client.post("/templates", data={"name": "Default week", "week": "2024-01-01"})
+    assert resp.status_code == 200
+    template = resp.json()
+    assert template["entries"] == 2
+
+    resp = client.post(
+        f"/templates/{template['id']}/apply",
+        data={"weeks": "2024-02-05,2024-02-12,2024-02-19"},
+    )
+    assert resp.json()["created"] == 6
+    assert len(_entries_for_week(db, date(2024, 2, 12))) == 2
+
+    # Re-applying with the default skip policy creates nothing new.
+    resp = client.post(f"/templates/{template['id']}/apply", data={"weeks": "2024-02-05"})
+    assert resp.json()["created"] == 0
+
+
+def test_materialized_recurring_instances_match_expansion(monkeypatch):
+    from datetime import date
+    import app.recurring as recurring
+    from app.models import BlockType, RecurringInstance
+
+    client, db = make_client()
+    monkeypatch.setattr(recurring, "MATERIALIZE_RECURRING", True)
+    import app.main as main
+
+    with Session(db.engine) as session:
+        block_id = session.exec(select(BlockType.id)).first()
+        recurring.ensure_horizon(session, today=date(2024, 1, 10))
+        session.commit()
+
+    resp = client.post("/recurring-tasks", data={
+        "title": "Gym",
+        "block_type_id": block_id,
+        "pattern": "daily",
+        "interval": 2,
+        "start_time": "08:00",
+        "duration_minutes": 60,
+        "start_date": "2024-01-01",
+        "end_date": "2024-02-01",
+    })
+    assert resp.status_code == 200
+    client.post("/recurring-tasks/1/exception", data={"exception_date": "2024-01-03", "exception_type": "deleted"})
+    client.post("/recurring-tasks/1/exception", data={
+        "exception_date": "2024-01-05",
+        "exception_type": "modified",
+        "new_day": "Saturday",
+        "new_start_minute": 600,
+    })
+
+    week = date(2024, 1, 1)
+    with Session(db.engine) as session:
+        assert len(session.exec(select(RecurringInstance)).all()) == 15
+        materialized = main.get_recurring_instances_for_week(session, week)
+        monkeypatch.setattr(recurring, "MATERIALIZE_RECURRING", False)
+        expanded = main.get_recurring_instances_for_week(session, week)
+
+    key = lambda i: (i["instance_date"], i["day"], i["start_minute"])
+    assert sorted(map(key, materialized)) == sorted(map(key, expanded))
+    assert (date(2024, 1, 5), "Saturday", 600) in map(key, materialized)
+    assert date(2024, 1, 3) not in [i["instance_date"] for i in materialized]
+
+    monkeypatch.setattr(recurring, "MATERIALIZE_RECURRING", True)
+    client.delete("/recurring-tasks/1")
+    with Session(db.engine) as session:
+        assert session.exec(select(RecurringInstance)).all() == []
+
+
+def test_materialized_horizon_moves_incrementally(monkeypatch):
+    from datetime import date
+    import app.recurring as recurring
+    from app.models import BlockType, RecurringHorizon, RecurringInstance, RecurringTask
+
+    _, db = make_client()
+    monkeypatch.setattr(recurring, "MATERIALIZE_RECURRING", True)
+    monkeypatch.setattr(recurring, "RECURRING_HORIZON_WEEKS_BACK", 1)
+    monkeypatch.setattr(recurring, "RECURRING_HORIZON_WEEKS_FORWARD", 2)
+
+    with Session(db.engine) as session:
+        block_id = session.exec(select(BlockType.id)).first()
+        session.add(RecurringTask(
+            title="Review", block_type_id=block_id, pattern="weekly", interval=1,
+            day_of_week=4, start_minute=600, start_date=date(2023, 1, 6),
+        ))
+        recurring.ensure_horizon(session, today=date(2024, 1, 10))
+        session.commit()
+        dates = sorted(i.instance_date for i in session.exec(select(RecurringInstance)).all())
+        assert dates == [date(2024, 1, 5), date(2024, 1, 12), date(2024, 1, 19), date(2024, 1, 26)]
+
+        recurring.ensure_horizon(session, today=date(2024, 1, 17))
+        session.commit()
+        dates = sorted(i.instance_date for i in session.exec(select(RecurringInstance)).all())
+        assert dates == [date(2024, 1, 12), date(2024, 1, 19), date(2024, 1, 26), date(2024, 2, 2)]
+        assert session.get(RecurringHorizon, 1).start_date == date(2024, 1, 8)
+
+
+def test_entry_date_kept_in_sync():
+    from datetime import date
+    from sqlalchemy import text
+    from app.dates import epoch_minutes
+    from app.models import ScheduleEntry
+
+    client, db = make_client()
+    entry_id = _add_entry(db, date(2024, 1, 1), day="Wednesday", start_minute=9 * 60)
+    with Session(db.engine) as session:
+        entry = session.get(ScheduleEntry, entry_id)
+        assert entry.entry_date == date(2024, 1, 3)
+        assert entry.start_at == epoch_minutes(date(2024, 1, 3), 9 * 60)
+
+    client.post(f"/entries/{entry_id}/move", data={"day": "Sunday", "start_minute": 600, "duration_minutes": 60})
+    client.post("/weeks/copy", data={"source_week": "2024-01-01", "target_week": "2024-01-08"})
+    with Session(db.engine) as session:
+        moved = session.get(ScheduleEntry, entry_id)
+        assert (moved.entry_date, moved.start_at) == (date(2024, 1, 7), epoch_minutes(date(2024, 1, 7), 600))
+        copied = session.exec(select(ScheduleEntry).where(ScheduleEntry.week_start == date(2024, 1, 8))).one()
+        assert (copied.entry_date, copied.start_at) == (date(2024, 1, 14), epoch_minutes(date(2024, 1, 14), 600))
+
+    with db.engine.begin() as conn:
+        conn.execute(text("UPDATE scheduleentry SET entry_date = NULL, start_at = NULL"))
+    db.backfill_entry_dates()
+    with Session(db.engine) as session:
+        rows = session.exec(select(ScheduleEntry).order_by(ScheduleEntry.start_at)).all()
+        assert [(e.entry_date, e.start_at) for e in rows] == [
+            (date(2024, 1, 7), epoch_minutes(date(2024, 1, 7), 600)),
+            (date(2024, 1, 14), epoch_minutes(date(2024, 1, 14), 600)),
+        ]
+
+
+def test_change_events_reach_matching_subscribers():
+    import asyncio
+    from datetime import date
+    from app.events import broker
+
+    client, db = make_client()
+    entry_id = _add_entry(db, date(2024, 1, 1))
+
+    async def scenario():
+        watching = broker.subscribe(date(2024, 1, 1), None)
+        other_week = broker.subscribe(date(2024, 1, 8), None)
+        other_plan = broker.subscribe(date(2024, 1, 1), [999])
+        try:
+            resp = await asyncio.to_thread(
+                client.post,
+                f"/entries/{entry_id}/move",
+                data={"day": "Tuesday", "start_minute": 600, "duration_minutes": 60, "plan_id": 1},
+                headers={"X-Client-Id": "tab-1"},
+            )
+            assert resp.status_code == 200
+            event = await asyncio.wait_for(watching.queue.get(), timeout=2)
+            assert other_week.queue.empty()
+            return event
+        finally:
+            for sub in (watching, other_week, other_plan):
+                broker.unsubscribe(sub)
+
+    event = asyncio.run(scenario())
+    assert (event.kind, event.week_start, event.entry_id, event.origin) == ("entry", date(2024, 1, 1), entry_id, "tab-1")
+
+
+def test_sqlite_event_backend_round_trip():
+    import asyncio
+    from datetime import date
+    from sqlalchemy.exc import OperationalError
+    from app.events import ChangeEvent, EventBroker, SQLiteBackend
+
+    make_client()
+    backend = SQLiteBackend()
+    event = ChangeEvent("recurring", date(2024, 1, 1), plan_id=2, origin="tab-2")
+    backend.publish(event, EventBroker(backend))
+
+    rows = backend._fetch()
+    assert [ChangeEvent.from_json(payload) for _, payload in rows] == [event]
+
+    # A failed poll is logged and polling goes on
+    broker = EventBroker(backend)
+    broker.subscriptions.add(object())
+    fetches, delivered = [], []
+
+    def flaky_fetch():
+        fetches.append(1)
+        if len(fetches) == 1:
+            raise OperationalError("SELECT", {}, Exception("database is locked"))
+        return rows
+
+    async def scenario():
+        backend.poll_seconds = 0
+        backend._fetch = flaky_fetch
+        broker.dispatch = lambda event: delivered.append(event)
+        task = asyncio.create_task(backend._poll(broker))
+        while not delivered and not task.done():
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert len(fetches) >= 2 and delivered[0] == event
+
+
+def test_sync_returns_collapsed_deltas_since_revision():
+    from datetime import date
+
+    client, db = make_client()
+    start = client.get("/sync").json()["rev"]
+    gone = _add_entry(db, date(2024, 1, 1), start_minute=12 * 60)
+    kept = _add_entry(db, date(2024, 1, 1))
+    client.post(f"/entries/{kept}/move", data={"day": "Friday", "start_minute": 600, "duration_minutes": 90})
+    client.delete(f"/entries/{gone}")
+    # Bulk INSERT ... SELECT bypasses the ORM but is still logged
+    client.post("/weeks/copy", data={"source_week": "2024-01-01", "target_week": "2024-01-08"})
+
+    resp = client.get("/sync", params={"since": start})
+    payload = resp.json()
+    assert resp.headers["ETag"] == f'"rev-{payload["rev"]}"'
+    entries = payload["changes"]["entries"]
+    assert {(e["day"], e["week_start"]) for e in entries["upserted"]} == {("Friday", "2024-01-01"), ("Friday", "2024-01-08")}
+    assert entries["deleted"] == [gone]
+
+    assert client.get("/sync", params={"since": payload["rev"]}).json()["changes"] == {}
+    assert client.get("/sync", params={"since": payload["rev"] + 5}).json()["reset"] is True
+
+
+def test_restore_never_reuses_sync_revisions():
+    from datetime import date
+
+    client, db = make_client()
+    snapshot = client.get("/backup").content
+    for minute in (9 * 60, 10 * 60, 11 * 60):
+        _add_entry(db, date(2024, 1, 1), start_minute=minute)
+    seen = client.get("/sync").json()["rev"]
+    etag = client.get("/schedule", params={"week": "2024-01-01"}).headers["ETag"]
+
+    restored = client.post("/backup/restore", files={"file": ("planner.db.gz", snapshot)}).json()
+    assert restored["revision"] > seen
+    for minute in (12 * 60, 13 * 60, 14 * 60, 15 * 60):
+        _add_entry(db, date(2024, 1, 1), start_minute=minute)
+    payload = client.get("/sync", params={"since": seen}).json()
+    assert payload["reset"] is True and payload["rev"] > seen
+    assert client.get("/schedule", params={"week": "2024-01-01"}, headers={"If-None-Match": etag}).status_code == 200
+
+    # After reloading, the client syncs incrementally again
+    _add_entry(db, date(2024, 1, 8))
+    payload = client.get("/sync", params={"since": payload["rev"]}).json()
+    assert payload["reset"] is False and len(payload["changes"]["entries"]["upserted"]) == 1
+
+
+def test_json_api_returns_columnar_week_and_range():
+    from datetime import date
+    from app.models import BlockType, RecurringTask
+
+    client, db = make_client()
+    entry_id = _add_entry(db, date(2024, 1, 1), day="Wednesday", custom_title="Standup")
+    with Session(db.engine) as session:
+        block_id = session.exec(select(BlockType.id)).first()
+        session.add(RecurringTask(
+            title="Review", block_type_id=block_id, pattern="weekly", interval=1,
+            day_of_week=4, start_minute=600, start_date=date(2023, 1, 6),
+        ))
+        session.commit()
+
+    week = client.get("/api/weeks/2024-01-03").json()
+    assert week["start"] == "2024-01-01" and week["end"] == "2024-01-07"
+    assert week["entries"]["id"] == [entry_id]
+    assert week["entries"]["date"] == ["2024-01-03"]
+    assert week["entries"]["title"] == ["Standup"]
+    assert week["recurring"]["date"] == ["2024-01-05"]
+    assert block_id in week["block_types"]["id"]
+
+    # Ranges need not be aligned to weeks
+    month = client.get("/api/range", params={"start": "2024-01-04", "end": "2024-01-31"}).json()
+    assert month["entries"]["id"] == []
+    assert month["recurring"]["date"] == ["2024-01-05", "2024-01-12", "2024-01-19", "2024-01-26"]
+    assert client.get("/api/range", params={"start": "2024-02-01", "end": "2024-01-01"}).status_code == 400
+
+
+def test_plan_calendar_feed_uses_rrules_and_conditional_requests():
+    from datetime import date
+    from app.models import BlockType, Plan
+
+    client, db = make_client()
+    with Session(db.engine) as session:
+        block_id = session.exec(select(BlockType.id)).first()
+        plan_id = session.exec(select(Plan.id)).first()
+    _add_entry(db, date(2024, 1, 1), day="Tuesday", custom_title="Dentist, early", plan_id=plan_id)
+    client.post("/recurring-tasks", data={
+        "title": "Review",
+        "block_type_id": block_id,
+        "pattern": "weekly",
+        "interval": 1,
+        "day_of_week": 4,
+        "start_time": "10:00",
+        "duration_minutes": 60,
+        "start_date": "2024-01-01",
+        "plan_id": plan_id,
+    })
+    client.post("/recurring-tasks/1/exception", data={"exception_date": "2024-01-12", "exception_type": "deleted"})
+    client.post("/recurring-tasks/1/exception", data={
+        "exception_date": "2024-01-19", "exception_type": "modified", "new_day": "Saturday", "new_start_minute": 540,
+    })
+
+    resp = client.get(f"/plans/{plan_id}/calendar.ics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/calendar")
+    body = resp.text
+    assert body.startswith("BEGIN:VCALENDAR\r\n") and body.endswith("END:VCALENDAR\r\n")
+    assert "SUMMARY:Dentist\\, early\r\n" in body
+    assert "DTSTART:20240102T090000\r\n" in body
+    assert "RRULE:FREQ=WEEKLY;INTERVAL=1;BYDAY=FR\r\n" in body
+    assert "DTSTART:20240105T100000\r\n" in body
+    assert "EXDATE:20240112T100000\r\n" in body
+    assert "RECURRENCE-ID:20240119T100000\r\n" in body and "DTSTART:20240120T090000\r\n" in body
+
+    etag = resp.headers["ETag"]
+    assert client.get(f"/plans/{plan_id}/calendar.ics", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(
+        f"/plans/{plan_id}/calendar.ics", headers={"If-Modified-Since": resp.headers["Last-Modified"]}
+    ).status_code == 304
+
+    client.delete("/recurring-tasks/1")
+    assert client.get(f"/plans/{plan_id}/calendar.ics", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_static_assets_are_fingerprinted_precompressed_and_immutable():
+    import re
+
+    client, _ = make_client()
+    page = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert page.headers["content-encoding"] == "gzip"
+    url = re.search(r'src="(/static/js/app\.js\?v=[0-9a-f]+)"', page.text).group(1)
+
+    resp = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert resp.status_code == 200
+    assert resp.headers["content-encoding"] == "gzip"
+    assert resp.headers["content-type"].startswith(("text/javascript", "application/javascript"))
+    assert "immutable" in resp.headers["cache-control"]
+    assert "connectLiveUpdates" in resp.text
+
+    stale = client.get("/static/js/app.js?v=000000000000", headers={"Accept-Encoding": "identity"})
+    assert stale.headers["cache-control"] == "no-cache"
+    assert "content-encoding" not in stale.headers
+
+
+def test_icons_reference_the_page_sprite():
+    from datetime import date
+
+    client, db = make_client()
+    _add_entry(db, date(2024, 1, 1))
+    page = client.get("/", params={"week": "2024-01-01"}).text
+    assert page.count('<symbol id="icon-users"') == 1
+    partial = client.get("/schedule", params={"week": "2024-01-01"}).text
+    assert '<use href="#icon-' in partial
+    assert "<path" not in partial
+
+
+def test_production_templates_use_bytecode_cache(tmp_path):
+    from app.templating import make_environment, precompile
+
+    env = make_environment(mode="production", cache_dir=str(tmp_path))
+    assert env.auto_reload is False
+    assert precompile(env) >= 2
+    assert any(tmp_path.iterdir())
+    assert make_environment(mode="development").auto_reload is True
+
+
+def test_stats_combine_entries_and_recurring_instances():
+    from datetime import date
+    from app.models import BlockType, Plan, RecurringTask
+
+    client, db = make_client()
+    with Session(db.engine) as session:
+        block_ids = session.exec(select(BlockType.id).order_by(BlockType.id)).all()
+        plan_id = session.exec(select(Plan.id)).first()
+        session.add(RecurringTask(
+            title="Run", block_type_id=block_ids[1], pattern="daily", interval=1,
+            start_minute=14 * 60, duration_minutes=120, start_date=date(2024, 1, 1), plan_id=plan_id,
+        ))
+        session.commit()
+    # 60 min in Production, then 90 min straddling Production/Activity (15:00)
+    _add_entry(db, date(2024, 1, 1), day="Monday", start_minute=9 * 60, block_type_id=block_ids[0])
+    _add_entry(db, date(2024, 1, 1), day="Tuesday", start_minute=14 * 60 + 30, duration=90, block_type_id=block_ids[0], plan_id=plan_id)
+
+    stats = client.get("/stats", params={"start": "2024-01-01", "end": "2024-01-03"}).json()
+    assert stats["total_minutes"] == 60 + 90 + 3 * 120
+    assert {b["id"]: b["minutes"] for b in stats["block_types"]} == {block_ids[0]: 150, block_ids[1]: 360}
+    assert {p["id"]: p["minutes"] for p in stats["plans"]} == {None: 60, plan_id: 450}
+    periods = {p["name"]: p["minutes"] for p in stats["periods"]}
+    assert periods == {"Production": 60 + 30 + 3 * 60, "Activity": 60 + 3 * 60, "Night": 0}
+    weekdays = {d["day"]: d["minutes"] for d in stats["weekdays"]}
+    assert (weekdays["Monday"], weekdays["Tuesday"], weekdays["Wednesday"], weekdays["Thursday"]) == (180, 210, 120, 0)
+
+
+def test_search_finds_titles_notes_and_block_names():
+    from datetime import date
+    from app.models import BlockType, RecurringTask
+
+    client, db = make_client()
+    with Session(db.engine) as session:
+        block = session.exec(select(BlockType).where(BlockType.is_quick_template == False)).first()
+        session.add(RecurringTask(
+            title="Dentist checkup", block_type_id=block.id, pattern="monthly", day_of_month=3,
+            start_minute=600, start_date=date(2024, 1, 1),
+        ))
+        session.commit()
+        block_id, block_name = block.id, block.name
+    noted = _add_entry(db, date(2024, 1, 1), note="Call the dentist about Friday", custom_title="Errands")
+    untitled = _add_entry(db, date(2024, 1, 8), day="Friday", block_type_id=block_id)
+
+    results = client.get("/search", params={"q": "dent"}).json()["results"]
+    assert {(r["kind"], r["id"]) for r in results} == {("entry", noted), ("recurring", 1)}
+    entry = next(r for r in results if r["kind"] == "entry")
+    assert (entry["week_start"], entry["day"], entry["url"]) == ("2024-01-01", "Monday", "/?week=2024-01-01")
+
+    assert [r["id"] for r in client.get("/search", params={"q": block_name}).json()["results"]] == [untitled]
+    client.post(f"/entries/{noted}/note", data={"note": "Pick up parcel"})
+    assert [r["kind"] for r in client.get("/search", params={"q": "dentist"}).json()["results"]] == ["recurring"]
+
+    page = client.get("/search", params={"q": "dentist", "per_page": 1, "page": 2}).json()
+    assert page["results"] == [] and page["has_more"] is False
+
+
+def test_export_and_import_run_as_background_jobs(monkeypatch, tmp_path):
+    from datetime import date
+    import app.jobs as jobs
+
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path))
+    client, db = make_client()
+    _add_entry(db, date(2024, 1, 1), note="Kept")
+    _add_entry(db, date(2024, 3, 4), note="Outside range")
+
+    job = client.post("/export/csv", data={"start": "2024-01-01", "end": "2024-01-31"}).json()
+    assert job["kind"] == "export"
+    jobs.runner.wait(job["id"], timeout=10)
+    job = client.get(f"/jobs/{job['id']}").json()
+    assert job["status"] == "done" and job["progress"]["schedule_entries"] == 1
+    archive = client.get(job["download_url"])
+    assert archive.headers["content-disposition"].startswith("attachment")
+
+    resp = client.post("/import/csv", files={"file": ("export.zip", archive.content, "application/zip")})
+    assert resp.status_code == 202
+    jobs.runner.wait(resp.json()["id"], timeout=10)
+    job = client.get(f"/jobs/{resp.json()['id']}").json()
+    assert job["status"] == "done", job["error"]
+    assert [e.note for e in _entries_for_week(db, date(2024, 1, 1))] == ["Kept"]
+    assert _entries_for_week(db, date(2024, 3, 4)) == []
+    assert not any(tmp_path.glob("upload-*"))
+
+    bad = client.post("/import/csv", files={"file": ("bad.zip", b"not a zip", "application/zip")})
+    assert bad.status_code == 400
+
+
+def test_backup_snapshot_restores_database(monkeypatch, tmp_path):
+    from datetime import date
+    import app.jobs as jobs
+
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path))
+    client, db = make_client()
+    kept = _add_entry(db, date(2024, 1, 1), note="Before backup")
+
+    resp = client.get("/backup", headers={"Accept-Encoding": "gzip"})
+    assert resp.headers["content-type"] == "application/gzip" and "content-encoding" not in resp.headers
+    snapshot = resp.content
+    assert snapshot[:2] == b"\x1f\x8b"
+
+    _add_entry(db, date(2024, 1, 1), note="After backup")
+    resp = client.post("/backup/restore", files={"file": ("planner.db.gz", snapshot)})
+    assert resp.status_code == 200
+    assert [e.id for e in _entries_for_week(db, date(2024, 1, 1))] == [kept]
+    assert client.get("/search", params={"q": "before"}).json()["results"][0]["id"] == kept
+
+    bad = client.post("/backup/restore", files={"file": ("planner.db", b"not a database")})
+    assert bad.status_code == 400
+    assert len(_entries_for_week(db, date(2024, 1, 1))) == 1
+
+
+def test_archival_moves_old_weeks_and_prunes_exceptions(monkeypatch, tmp_path):
+    from datetime import date
+    import app.archive as archive
+    from app.models import BlockType, RecurringException, RecurringTask
+
+    monkeypatch.setattr(archive, "ARCHIVE_PATH", str(tmp_path / "archive.db"))
+    client, db = make_client()
+    with Session(db.engine) as session:
+        block_id = session.exec(select(BlockType.id)).first()
+        task = RecurringTask(
+            title="Standup", block_type_id=block_id, pattern="weekly", day_of_week=0,
+            start_minute=540, start_date=date(2023, 1, 2), end_date=date(2024, 6, 24),
+        )
+        session.add(task)
+        session.commit()
+        session.add_all([
+            RecurringException(recurring_task_id=task.id, exception_date=date(2023, 1, 9), exception_type="deleted"),
+            RecurringException(recurring_task_id=task.id, exception_date=date(2023, 1, 10), exception_type="deleted"),
+            RecurringException(recurring_task_id=task.id, exception_date=date(2024, 7, 1), exception_type="deleted"),
+            RecurringException(recurring_task_id=task.id, exception_date=date(2024, 3, 4), exception_type="deleted"),
+        ])
+        session.commit()
+    recent = _add_entry(db, date(2024, 3, 4), note="Recent")
+    old = _add_entry(db, date(2023, 1, 2), note="Old")
+    also_old = _add_entry(db, date(2023, 1, 9), note="Also old")
+
+    results = archive.run_archival(today=date(2024, 3, 6), after_weeks=52)
+    assert sum(r["archived_entries"] for r in results) == 2
+    assert results[-1]["pruned_exceptions"] == 1  # past the end date
+    # Off-pattern exceptions are kept (a reverted pattern edit applies them again), here archived
+    assert sum(r["archived_exceptions"] for r in results) == 2
+    assert results[-1]["archived_before"] == date(2023, 3, 6)
+
+    assert [e.id for e in _entries_for_week(db, date(2024, 3, 4))] == [recent]
+    assert _entries_for_week(db, date(2023, 1, 2)) == []
+    page = client.get("/schedule", params={"week": "2023-01-02"})
+    assert "is-archived" in page.text and f'data-entry-id="{old}"' in page.text
+    week = client.get("/api/weeks/2023-01-09").json()
+    assert week["entries"]["note"] == ["Also old"]
+    assert week["recurring"]["title"] == []  # the archived "deleted" exception still applies
+
+    # Ids of archived rows are not handed out again
+    assert _add_entry(db, date(2024, 3, 5)) > also_old
+
+    report = archive.storage_report()
+    assert report["tables"]["archive.scheduleentry"]["rows"] == 2
+    assert report["tables"]["main.scheduleentry"]["rows"] == 2
+
+
+def test_archived_weeks_stay_in_stats_search_exports_and_backups(monkeypatch, tmp_path):
+    import csv
+    import io
+    import zipfile
+    from datetime import date
+    import app.archive as archive
+    import app.jobs as jobs
+    from app.models import BlockType, Plan, RecurringException, RecurringTask
+
+    monkeypatch.setattr(archive, "ARCHIVE_PATH", str(tmp_path / "archive.db"))
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path))
+    client, db = make_client()
+    old = _add_entry(db, date(2023, 1, 2), note="Ancient history")
+    _add_entry(db, date(2024, 3, 4), note="Recent")
+    with Session(db.engine) as session:
+        plan_id = session.exec(select(Plan.id)).first()
+        task = RecurringTask(
+            title="Swim", block_type_id=session.exec(select(BlockType.id)).first(), pattern="weekly",
+            day_of_week=0, start_minute=7 * 60, duration_minutes=60, start_date=date(2023, 1, 2),
+        )
+        session.add(task)
+        session.flush()
+        session.add_all([
+            RecurringException(recurring_task_id=task.id, exception_date=date(2023, 1, 9), exception_type="deleted"),
+            RecurringException(
+                recurring_task_id=task.id, exception_date=date(2023, 1, 16), exception_type="modified",
+                new_day="Monday", new_start_minute=8 * 60,
+            ),
+        ])
+        session.commit()
+    archive.run_archival(today=date(2024, 3, 6), after_weeks=52)
+    assert _entries_for_week(db, date(2023, 1, 2)) == []
+
+    assert client.get("/stats", params={"start": "2023-01-02", "end": "2023-01-08"}).json()["total_minutes"] == 120
+    results = client.get("/search", params={"q": "ancient"}).json()["results"]
+    assert [(r["id"], r["week_start"]) for r in results] == [(old, "2023-01-02")]
+    resp = client.get("/export/csv", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in resp.headers
+    export = zipfile.ZipFile(io.BytesIO(resp.content))
+    rows = list(csv.DictReader(io.TextIOWrapper(export.open("schedule_entries.csv"), encoding="utf-8")))
+    assert [r["note"] for r in rows] == ["Ancient history", "Recent"]
+    feed = client.get(f"/plans/{plan_id}/calendar.ics").text
+    assert f"UID:entry-{old}@planner" in feed and feed.index("Ancient history") < feed.index("Recent")
+    assert "EXDATE:20230109T070000\r\n" in feed
+    assert "RECURRENCE-ID:20230116T070000\r\n" in feed and "DTSTART:20230116T080000\r\n" in feed
+
+    # The snapshot holds the archived week; restoring it brings the week back live, once
+    snapshot = client.get("/backup").content
+    assert client.post("/backup/restore", files={"file": ("planner.db.gz", snapshot)}).status_code == 200
+    assert [e.id for e in _entries_for_week(db, date(2023, 1, 2))] == [old]
+    assert client.get("/api/weeks/2023-01-02").json()["entries"]["id"] == [old]
+    assert [r["id"] for r in client.get("/search", params={"q": "ancient"}).json()["results"]] == [old]
+
+    # An import replaces everything, the archive included
+    archive.run_archival(today=date(2024, 3, 6), after_weeks=52)
+    resp = client.post("/import/csv", files={"file": ("export.zip", client.get("/export/csv").content, "application/zip")})
+    jobs.runner.wait(resp.json()["id"], timeout=10)
+    assert client.get("/api/weeks/2023-01-02").json()["entries"]["id"] == [old]
+    with Session(db.engine) as session:
+        assert archive.archived_before(session) is None
+
+
+def test_scheduled_archival_survives_a_failed_run(monkeypatch):
+    import asyncio
+    import app.archive as archive
+    from app import tenants
+    from sqlalchemy.exc import OperationalError
+
+    runs = []
+
+    def run_everywhere(work, *args):
+        runs.append(work)
+        if len(runs) == 1:
+            raise OperationalError("archive", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(archive, "ARCHIVE_INTERVAL_SECONDS", 0)
+    monkeypatch.setattr(tenants, "run_everywhere", run_everywhere)
+
+    async def scenario():
+        task = asyncio.create_task(archive.archive_periodically())
+        while len(runs) < 2 and not task.done():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        return task
+
+    task = asyncio.run(scenario())
+    assert len(runs) >= 2 and set(runs) == {archive.archive_old_weeks} and task.cancelled()
+
+
+def test_schedule_lays_out_overlapping_entries_in_lanes():
+    import re
+    from datetime import date
+
+    client, db = make_client()
+    ids = [_add_entry(db, date(2024, 1, 1), start_minute=9 * 60 + i * 15, duration=60) for i in range(4)]
+    later = _add_entry(db, date(2024, 1, 1), start_minute=14 * 60, duration=30)
+
+    html = client.get("/schedule", params={"week": "2024-01-01"}).text
+    lanes = {}
+    for match in re.finditer(r'data-entry-id="(\d+)"[^>]*?style="([^"]*)"', html):
+        lane = re.search(r"--lane: (\d+); --lanes: (\d+)", match.group(2))
+        lanes[int(match.group(1))] = (int(lane.group(1)), int(lane.group(2))) if lane else None
+    assert [lanes[i] for i in ids] == [(0, 4), (1, 4), (2, 4), (3, 4)]
+    assert lanes[later] is None
+
+
+def test_schedule_weeks_revalidate_with_etags():
+    from datetime import date
+
+    client, db = make_client()
+    resp = client.get("/schedule", params={"week": "2024-01-03"})
+    assert resp.status_code == 200
+    assert 'data-prev-week="2023-12-25"' in resp.text and 'data-next-week="2024-01-08"' in resp.text
+    etag = resp.headers["ETag"]
+    assert etag.startswith('W/"')
+
+    cached = client.get("/schedule", params={"week": "2024-01-01"}, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["ETag"] == etag
+    other_plans = client.get("/schedule", params={"week": "2024-01-01", "plans": "1"}, headers={"If-None-Match": etag})
+    assert other_plans.status_code == 200
+
+    _add_entry(db, date(2024, 1, 8))
+    changed = client.get("/schedule", params={"week": "2024-01-01"}, headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag
+
+    worker = client.get("/sw.js")
+    assert worker.status_code == 200 and "caches.open" in worker.text
+
+
+def test_mutations_with_idempotency_keys_run_once(monkeypatch):
+    from datetime import date
+    from app import idempotency
+    from app.models import ScheduleEntry
+
+    client, db = make_client()
+    form = {"title": "Call", "day": "Monday", "start_time": "09:00", "week": "2024-01-01"}
+    headers = {"HX-Request": "true", "Idempotency-Key": "quick-1"}
+
+    first = client.post("/quick-task", data=form, headers=headers)
+    assert first.status_code == 200
+    retry = client.post("/quick-task", data=form, headers=headers)
+    assert retry.status_code == 200
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.text == first.text
+    with Session(db.engine) as session:
+        assert len(session.exec(select(ScheduleEntry)).all()) == 1
+
+    # Rejections are final and replayed too; a key reused for another request is refused
+    clash = client.post("/quick-task", data=form, headers={"HX-Request": "true", "Idempotency-Key": "quick-2"})
+    assert clash.status_code == 409 and "retry-after" not in clash.headers
+    assert client.post("/quick-task", data=form, headers={"Idempotency-Key": "quick-2"}).status_code == 409
+    assert client.post("/quick-task", data={**form, "title": "Other"}, headers=headers).status_code == 422
+
+    # Large bodies are not stored: the replay keeps the status and has no body
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_MAX_BODY_BYTES", 0)
+    entry_id = _add_entry(db, date(2024, 1, 1), day="Tuesday")
+    move = {"day": "Wednesday", "start_minute": 600, "duration_minutes": 30}
+    assert client.post(f"/entries/{entry_id}/move", data=move, headers={"Idempotency-Key": "move-1"}).status_code == 200
+    with Session(db.engine) as session:
+        session.get(ScheduleEntry, entry_id).day = "Friday"
+        session.commit()
+    replayed = client.post(f"/entries/{entry_id}/move", data=move, headers={"Idempotency-Key": "move-1"})
+    assert replayed.status_code == 200 and replayed.content == b""
+    assert replayed.headers["idempotent-replayed"] == "true"
+    with Session(db.engine) as session:
+        assert session.get(ScheduleEntry, entry_id).day == "Friday"
+
+
+def test_profiling_on_demand_and_sampled(monkeypatch, tmp_path):
+    import json
+    from app import profiling
+
+    client, _ = make_client()
+    assert client.get("/profiles").status_code == 404
+
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", "s3cret")
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+
+    assert "x-profile-report" not in client.get("/schedule", params={"profile": "wrong"}).headers
+    resp = client.get("/schedule", params={"week": "2024-01-01", "profile": "s3cret"})
+    assert resp.status_code == 200
+    report_url = resp.headers["x-profile-report"]
+
+    assert client.get(report_url).status_code == 403
+    report = client.get(report_url, headers={"X-Profile-Token": "s3cret"})
+    assert report.status_code == 200
+    for line in report.text.splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert stack.startswith("GET_/schedule;") and int(count) > 0
+    listed = client.get("/profiles", params={"profile": "s3cret"}).json()
+    assert [p["url"] for p in listed] == [report_url]
+
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", None)
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_EVERY", 2)
+    for _ in range(4):
+        client.get("/schedule", params={"week": "2024-01-01"})
+    stats = json.loads((tmp_path / "aggregate.json").read_text())
+    assert stats["GET_/schedule"]["requests"] == 2
+
+
+def test_memory_diagnostics_report(monkeypatch):
+    from app import diagnostics
+
+    client, _ = make_client()
+    assert client.get("/diagnostics/memory").status_code == 404
+    monkeypatch.setattr(diagnostics, "DIAGNOSTICS_TOKEN", "s3cret")
+    assert client.get("/diagnostics/memory", params={"token": "nope"}).status_code == 403
+
+    headers = {"X-Diagnostics-Token": "s3cret"}
+    client.get("/schedule", params={"week": "2024-01-01"})
+    assert client.post("/diagnostics/memory/tracing", headers=headers).json() == {"tracing": True}
+    try:
+        first = client.get("/diagnostics/memory", headers=headers).json()
+        assert first["tracemalloc"]["tracing"] and first["tracemalloc"]["growth"] is None
+        assert first["tracemalloc"]["top"][0]["bytes"] > 0
+        second = client.get("/diagnostics/memory", params={"top": 5, "group_by": "filename"}, headers=headers).json()
+        assert isinstance(second["tracemalloc"]["growth"], list) and len(second["tracemalloc"]["top"]) <= 5
+    finally:
+        client.delete("/diagnostics/memory/tracing", headers=headers)
+
+    report = client.get("/diagnostics/memory", headers=headers).json()
+    assert report["tracemalloc"] == {"tracing": False}
+    assert report["process"]["rss_bytes"] > 0
+    assert report["caches"]["templates"]["entries"] >= 1 and report["caches"]["templates"]["bytes"] > 0
+    assert "pool" in report["sqlalchemy"] and report["objects"]["tracked"] > 0
+    assert client.get("/diagnostics/memory", params={"group_by": "nope"}, headers=headers).status_code == 400
+
+
+def test_serve_prepares_once_and_sizes_workers(monkeypatch):
+    from app import server
+
+    client, _ = make_client()
+    import app.main as main
+
+    def prepare_again():
+        raise AssertionError("prepared twice")
+
+    # Workers forked by `python -m app serve` inherit the prepared flag
+    assert main.database_prepared
+    monkeypatch.setattr(main, "init_db", prepare_again)
+    main.on_startup()
+    assert client.get("/").status_code == 200
+
+    monkeypatch.setattr(server, "SERVER_MAX_WORKERS", 1)
+    assert server.default_workers() == 1
+    assert server.resolve_http("h11") == "h11"
+    assert server.resolve_loop("auto") in ("uvloop", "asyncio")
+    config = server.make_config(main.app, "127.0.0.1", 0)
+    assert config.timeout_keep_alive == server.SERVER_KEEPALIVE_SECONDS
+    assert config.timeout_graceful_shutdown == server.SERVER_GRACEFUL_TIMEOUT
+
+
+def test_tenants_get_their_own_databases(monkeypatch, tmp_path):
+    import base64
+    import sqlite3
+    from datetime import date
+
+    from app import tenants
+    from app.models import ScheduleEntry
+
+    client, db = make_client()
+    monkeypatch.setattr(tenants, "TENANT_MODE", "header")
+    monkeypatch.setattr(tenants, "TENANT_DIR", str(tmp_path))
+    monkeypatch.setattr(tenants, "registry", tenants.TenantRegistry(capacity=1, idle_seconds=60))
+    assert client.get("/").status_code == 401
+    assert client.get("/", headers={"X-Forwarded-User": "../etc"}).status_code == 400
+    # Would open Alice's archive as its database
+    assert client.get("/", headers={"X-Forwarded-User": "alice.archive"}).status_code == 400
+    assert not (tmp_path / "alice.archive.db").exists()
+
+    alice = {"X-Forwarded-User": "Alice", "HX-Request": "true"}
+    bob = {"X-Forwarded-User": "bob", "HX-Request": "true"}
+    week = "2024-01-01"
+    form = {"title": "Dentist", "day": "Monday", "start_time": "09:00", "week": week}
+    assert client.post("/quick-task", data=form, headers=alice).status_code == 200
+    assert "Dentist" in client.get("/schedule", params={"week": week}, headers=alice).text
+    # Bob's first request creates and seeds his database, and closes Alice's idle engine
+    assert "Dentist" not in client.get("/schedule", params={"week": week}, headers=bob).text
+    assert (tmp_path / "alice.db").exists() and (tmp_path / "bob.db").exists()
+    stats = tenants.registry.stats()
+    assert list(stats["tenants"]) == ["bob"] and stats["evicted"] == 1
+    with Session(db.engine) as session:
+        assert not session.exec(select(ScheduleEntry).where(ScheduleEntry.custom_title == "Dentist")).first()
+    assert "Dentist" in client.get("/schedule", params={"week": week}, headers=alice).text
+    assert tenants.registry.evict_idle() == 0
+
+    # Job files go next to the user's database
+    import app.jobs as jobs
+
+    job = client.post("/export/csv", headers=alice).json()
+    jobs.runner.futures[("alice", job["id"])].result(timeout=10)
+    assert list((tmp_path / "alice.jobs").glob("export-*.zip"))
+
+    # Background archival reaches the open tenants, without keeping them busy
+    from app import archive
+
+    tenants.registry.run_on_open(archive.archive_old_weeks, date(2025, 1, 6))
+    assert not (tmp_path / "bob.archive.db").exists()
+    with sqlite3.connect(tmp_path / "alice.archive.db") as archived:
+        assert archived.execute("SELECT custom_title FROM scheduleentry").fetchall() == [("Dentist",)]
+    assert tenants.registry.stats()["tenants"]["alice"]["active"] == 0
+    assert "Dentist" in client.get("/schedule", params={"week": week}, headers=alice).text
+
+    users_file = tmp_path / "users.txt"
+    tenants.write_users(str(users_file), {"alice": tenants.hash_password("pw", iterations=1000)})
+    monkeypatch.setattr(tenants, "TENANT_MODE", "basic")
+    monkeypatch.setattr(tenants, "TENANT_USERS_FILE", str(users_file))
+
+    def basic(password):
+        return {"Authorization": "Basic " + base64.b64encode(f"alice:{password}".encode()).decode()}
+
+    resp = client.get("/schedule", params={"week": week}, headers=basic("wrong"))
+    assert resp.status_code == 401 and resp.headers["www-authenticate"].startswith("Basic")
+    assert "Dentist" in client.get("/schedule", params={"week": week}, headers=basic("pw")).text
+    tenants.registry.close_all()